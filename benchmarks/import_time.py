@@ -0,0 +1,34 @@
+"""
+Benchmark for importing dexy.load_plugins in a fresh interpreter, which
+registers filter plugins from the manifest without importing filter modules.
+
+The first import may rebuild the manifest, so it is not counted.
+
+Usage: python benchmarks/import_time.py [number of imports]
+"""
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_SCRIPT = """
+import time
+start = time.time()
+import dexy.load_plugins
+print(time.time() - start)
+"""
+
+def import_time():
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_TIME_SCRIPT], cwd=project_dir)
+    return float(output.decode('utf-8').splitlines()[-1])
+
+def run(n):
+    import_time()
+    times = sorted(import_time() for i in range(n))
+    print("import dexy.load_plugins, %s imports" % n)
+    print("min: %0.3fs" % times[0])
+    print("median: %0.3fs" % times[len(times) // 2])
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*(args + [5][len(args):]))
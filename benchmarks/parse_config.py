@@ -0,0 +1,70 @@
+"""
+Benchmark for parsing a large dexy.yaml into an AbstractSyntaxTree and
+walking the tree to create nodes.
+
+The config is written to disk and parsed by the wrapper as in a dexy run.
+The other files named in the config are added to the wrapper's filemap
+rather than written to disk, so this only measures config parsing and
+node creation.
+
+Usage: python benchmarks/parse_config.py [number of entries]
+"""
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
+import dexy.batch
+import dexy.load_plugins
+import sys
+import time
+
+def synthetic_config(n):
+    """
+    Returns yaml text for a config with n entries. Every 10th entry is a
+    bundle whose children are the 9 entries before it, and each doc is
+    filtered and depends on a shared include file.
+    """
+    lines = []
+    for i in range(n):
+        if i % 10 == 9:
+            lines.append("- bundle%s:" % i)
+            for j in range(i-9, i):
+                lines.append("    - file%s.txt|jinja:" % j)
+                lines.append("        - include.txt")
+    return "\n".join(lines)
+
+def synthetic_filemap(n):
+    filenames = ["file%s.txt" % i for i in range(n)]
+    filenames.extend(["include.txt", "dexy.yaml"])
+    return dict((name, {'dir' : '.', 'ospath' : name}) for name in filenames)
+
+def run(n):
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write(synthetic_config(n))
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper = Wrapper()
+        wrapper.to_valid()
+        wrapper.nodes = {}
+        wrapper.roots = []
+        wrapper.batch = dexy.batch.Batch(wrapper)
+        wrapper.filemap = synthetic_filemap(n)
+        parse_and_walk(wrapper, n)
+
+def parse_and_walk(wrapper, n):
+    start = time.time()
+    ast = wrapper.parse_configs()
+    parsed = time.time()
+    ast.walk()
+    walked = time.time()
+
+    print("%s entries, %s nodes, %s roots" % (n, len(wrapper.nodes), len(wrapper.roots)))
+    print("parse: %0.3fs" % (parsed - start))
+    print("walk: %0.3fs" % (walked - parsed))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 100000
+    run(n)
@@ -0,0 +1,49 @@
+"""
+Benchmark for expanding file patterns against a large file map, comparing
+the file map's indexes with matching every pattern against every file.
+
+Usage: python benchmarks/pattern_expansion.py [number of files] [number of patterns]
+"""
+from dexy.filemap import FileMap
+import fnmatch
+import sys
+import time
+
+def synthetic_filemap(n_files, n_exts):
+    filemap = FileMap()
+    for i in range(n_files):
+        filepath = "src/dir%s/sub%s/file%s.ext%s" % (i % 100, i % 7, i, i % n_exts)
+        filemap[filepath] = {}
+    return filemap
+
+def synthetic_patterns(n):
+    patterns = []
+    for i in range(n):
+        if i % 3 == 0:
+            patterns.append("src/dir%s/**/*.ext%s" % (i % 100, i))
+        else:
+            patterns.append("*.ext%s" % i)
+    return patterns
+
+def run(n_files, n_patterns):
+    filemap = synthetic_filemap(n_files, n_patterns)
+    patterns = synthetic_patterns(n_patterns)
+
+    start = time.time()
+    n_matches = sum(len(filemap.glob(pattern)) for pattern in patterns)
+    indexed = time.time() - start
+
+    # Matching every file is slow, so only time a sample of the patterns.
+    sample = patterns[0:10]
+    start = time.time()
+    for pattern in sample:
+        [f for f in filemap if fnmatch.fnmatch(f, pattern)]
+    scanned = (time.time() - start) * len(patterns) / len(sample)
+
+    print("%s files, %s patterns, %s matches" % (n_files, n_patterns, n_matches))
+    print("indexed: %0.3fs (including building indexes)" % indexed)
+    print("fnmatch every file: %0.3fs (estimated from %s patterns)" % (scanned, len(sample)))
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    run(*(args + [120000, 300][len(args):]))
@@ -0,0 +1,186 @@
+"""
+Benchmark suite which generates a synthetic project on disk and times each
+phase of a dexy run separately: mapping files, parsing configs, walking the
+tree, checking the cache, running filters and running reporters.
+
+The project is run twice, first with an empty cache and then again with
+everything cached from the first run. Timings are printed as JSON.
+
+Usage: python benchmarks/phases.py [options], see --help for options.
+"""
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
+import argparse
+import dexy.batch
+import dexy.load_plugins
+import dexy.reporter
+import json
+import os
+import sqlite3
+import sys
+import time
+
+TEMPLATE = """<html>
+<head><title>{{ title }}</title></head>
+<body>
+{{ content }}
+</body>
+</html>
+"""
+
+def write_file(filepath, contents):
+    parent_dir = os.path.dirname(filepath)
+    if parent_dir and not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+    with open(filepath, "w") as f:
+        f.write(contents)
+
+def layer_doc(layer, i):
+    return "layer%s/doc%s.html" % (layer, i)
+
+def synthetic_project(options):
+    """
+    Writes files and a dexy.yaml for a synthetic project to the current dir.
+
+    Docs are arranged in layers, each doc takes fan-in docs from the layer
+    below as inputs, so each doc is an input to roughly fan-in docs in the
+    layer above. Pattern entries each match a dir of plain files, and key
+    value docs are sqlite files with a kvstore table.
+    """
+    doc_filter = options.sectioned and "lines" or "dexy"
+    docs_per_layer = max(1, options.docs // options.depth)
+    lines = []
+
+    write_file("_template.html", TEMPLATE)
+
+    for layer in range(options.depth):
+        for i in range(docs_per_layer):
+            doc = layer_doc(layer, i)
+            write_file(doc, "\n".join("<p>%s line %s</p>" % (doc, j)
+                for j in range(options.lines)))
+
+            if layer == 0:
+                lines.append("- %s|%s" % (doc, doc_filter))
+            else:
+                lines.append("- %s|%s:" % (doc, doc_filter))
+                for j in range(options.fan_in):
+                    input_doc = layer_doc(layer-1, (i+j) % docs_per_layer)
+                    lines.append("    - %s|%s" % (input_doc, doc_filter))
+
+    for p in range(options.patterns):
+        for i in range(options.files_per_pattern):
+            write_file("patterns/p%s/file%s.txt" % (p, i), "file %s\n" % i)
+        lines.append("- patterns/p%s/*.txt|dexy" % p)
+
+    for k in range(options.kv):
+        filepath = "kv/data%s.sqlite3" % k
+        if not os.path.exists("kv"):
+            os.makedirs("kv")
+        conn = sqlite3.connect(filepath)
+        conn.execute("CREATE TABLE kvstore (key TEXT, value TEXT)")
+        conn.executemany("INSERT INTO kvstore VALUES (?, ?)",
+                (("key%s" % i, "value %s" % i) for i in range(options.kv_rows)))
+        conn.commit()
+        conn.close()
+        lines.append("- %s|kv" % filepath)
+
+    write_file("dexy.yaml", "\n".join(lines))
+
+def time_phase(timings, name, f, *args):
+    start = time.time()
+    result = f(*args)
+    timings[name] = time.time() - start
+    return result
+
+def run_phases(options):
+    """
+    Runs dexy in the current dir, returning timings of each phase.
+    """
+    wrapper = Wrapper(
+            jobs=options.jobs,
+            threads=options.threads)
+    timings = {}
+
+    time_phase(timings, 'setup', wrapper.to_valid)
+
+    wrapper.nodes = {}
+    wrapper.roots = []
+    wrapper.batch = dexy.batch.Batch(wrapper)
+    wrapper.filemap = time_phase(timings, 'map_files', wrapper.map_files)
+    wrapper.ast = time_phase(timings, 'parse_configs', wrapper.parse_configs)
+    time_phase(timings, 'walk', wrapper.ast.walk)
+    wrapper.transition('walked')
+
+    time_phase(timings, 'check', wrapper.to_checked)
+    time_phase(timings, 'run', wrapper.run)
+    if wrapper.state == 'error':
+        raise wrapper.error
+
+    for alias in ('output', 'ws'):
+        reporter = dexy.reporter.Reporter.create_instance(alias)
+        time_phase(timings, "report:%s" % alias, reporter.run, wrapper)
+
+    info = {
+            'nodes' : len(wrapper.nodes),
+            'docs' : len(wrapper.batch.docs),
+            'patterns' : wrapper.batch.pattern_count,
+            'timings' : timings,
+            'total' : sum(timings.values())
+            }
+
+    wrapper.log_writer.flush()
+    return info
+
+def run(options):
+    results = {
+            'project' : vars(options).copy(),
+            'python' : sys.version.split()[0],
+            'runs' : {}
+            }
+    del results['project']['output']
+
+    with tempdir():
+        synthetic_project(options)
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        results['runs']['cold'] = run_phases(options)
+        results['runs']['warm'] = run_phases(options)
+
+    text = json.dumps(results, indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=500,
+            help="number of docs in layers")
+    parser.add_argument("--depth", type=int, default=4,
+            help="number of layers of docs")
+    parser.add_argument("--fan-in", type=int, default=3,
+            help="number of inputs each doc takes from the layer below")
+    parser.add_argument("--lines", type=int, default=50,
+            help="number of lines in each doc")
+    parser.add_argument("--patterns", type=int, default=20,
+            help="number of pattern entries")
+    parser.add_argument("--files-per-pattern", type=int, default=10,
+            help="number of files matched by each pattern")
+    parser.add_argument("--sectioned", action="store_true",
+            help="use sectioned data for docs in layers instead of generic")
+    parser.add_argument("--kv", type=int, default=5,
+            help="number of sqlite key value docs")
+    parser.add_argument("--kv-rows", type=int, default=1000,
+            help="number of rows in each key value doc")
+    parser.add_argument("--jobs", type=int, default=1,
+            help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=0,
+            help="number of threads for subprocess filters")
+    parser.add_argument("-o", "--output",
+            help="file to write JSON results to instead of stdout")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    run(parse_args(sys.argv[1:]))
@@ -0,0 +1,52 @@
+"""
+Benchmark for walking the inputs of every doc in a long script bundle, where
+each doc has all earlier docs in the bundle as inputs.
+
+Usage: python benchmarks/script_bundle.py [number of steps]
+"""
+from dexy.doc import Doc
+from dexy.node import ScriptNode
+from dexy.utils import tempdir
+from dexy.wrapper import Wrapper
+import dexy.batch
+import dexy.load_plugins
+import sys
+import time
+
+def script_bundle(wrapper, n):
+    docs = [Doc("step%04d.sh|sh" % i, wrapper, [], contents="echo %s" % i)
+            for i in range(n)]
+    return ScriptNode("script:steps", wrapper, docs)
+
+def run(n):
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper = Wrapper()
+        wrapper.to_valid()
+        wrapper.batch = dexy.batch.Batch(wrapper)
+
+        start = time.time()
+        script = script_bundle(wrapper, n)
+        created = time.time()
+
+        n_inputs = 0
+        for doc in script.inputs:
+            n_inputs += len(list(doc.walk_input_docs()))
+        walked = time.time()
+
+        for doc in script.inputs:
+            list(doc.walk_input_docs())
+        walked_again = time.time()
+
+    print("%s steps, %s inputs walked" % (n, n_inputs))
+    print("create nodes: %0.3fs" % (created - start))
+    print("walk inputs: %0.3fs" % (walked - created))
+    print("walk inputs again: %0.3fs" % (walked_again - walked))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    else:
+        n = 2000
+    run(n)
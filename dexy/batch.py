@@ -1,8 +1,204 @@
+from collections.abc import Mapping
 import uuid
 import pickle
 import os
+import sqlite3
 import dexy.data
 
+class BatchStore(object):
+    """
+    Sqlite database holding metadata for all batches, indexed by doc key and
+    storage key so that single documents can be looked up without loading
+    the whole batch. Previous batches are retained.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._conn = None
+
+    def conn(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    uuid TEXT PRIMARY KEY,
+                    filters_used BLOB,
+                    start_time REAL,
+                    end_time REAL
+                );
+                CREATE TABLE IF NOT EXISTS docs (
+                    batch_uuid TEXT,
+                    doc_key TEXT,
+                    name TEXT,
+                    storage_key TEXT,
+                    state TEXT,
+                    info BLOB,
+                    PRIMARY KEY (batch_uuid, doc_key)
+                );
+                CREATE INDEX IF NOT EXISTS docs_name ON docs (batch_uuid, name);
+                CREATE INDEX IF NOT EXISTS docs_storage_key ON docs (batch_uuid, storage_key);
+            """)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def save(self, batch):
+        """
+        Saves batch, replacing any previously saved version of it.
+        """
+        storage_keys = dict((doc_key, storage_key)
+                for storage_key, doc_key in batch.doc_keys.items())
+
+        rows = []
+        for doc_key, info in batch.docs.items():
+            rows.append((
+                batch.uuid,
+                doc_key,
+                info['output-data'][1],
+                storage_keys.get(doc_key),
+                info['state'],
+                pickle.dumps(info)))
+
+        conn = self.conn()
+        with conn:
+            # Delete and re-insert so this batch has the highest rowid.
+            conn.execute("DELETE FROM batches WHERE uuid = ?", (batch.uuid,))
+            conn.execute("DELETE FROM docs WHERE batch_uuid = ?", (batch.uuid,))
+            conn.execute("INSERT INTO batches VALUES (?, ?, ?, ?)", (
+                batch.uuid,
+                pickle.dumps(batch.filters_used),
+                batch.start_time,
+                batch.end_time))
+            conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def most_recent_uuid(self):
+        row = self.conn().execute(
+                "SELECT uuid FROM batches ORDER BY rowid DESC LIMIT 1").fetchone()
+        if row:
+            return row[0]
+
+    def oldest_start_time(self, keep):
+        """
+        Returns the start time of the oldest of the keep most recent batches,
+        or None if there are fewer than keep batches.
+        """
+        row = self.conn().execute(
+                "SELECT start_time FROM batches ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (keep - 1,)).fetchone()
+        if row:
+            return row[0]
+
+    def remove_old_batches(self, keep, vacuum=False):
+        """
+        Removes all but the keep most recent batches, returning the number of
+        batches removed.
+        """
+        conn = self.conn()
+        with conn:
+            rows = conn.execute(
+                    "SELECT uuid FROM batches ORDER BY rowid DESC LIMIT -1 OFFSET ?",
+                    (keep,)).fetchall()
+            conn.executemany("DELETE FROM docs WHERE batch_uuid = ?", rows)
+            conn.executemany("DELETE FROM batches WHERE uuid = ?", rows)
+        if vacuum:
+            conn.execute("VACUUM")
+        return len(rows)
+
+    def batch_info(self, batch_uuid):
+        return self.conn().execute(
+                "SELECT filters_used, start_time, end_time FROM batches WHERE uuid = ?",
+                (batch_uuid,)).fetchone()
+
+    def doc_keys(self, batch_uuid, include_uncached=True, name=None, name_contains=None):
+        sql = "SELECT doc_key FROM docs WHERE batch_uuid = ?"
+        args = [batch_uuid]
+        if not include_uncached:
+            sql += " AND state != 'uncached'"
+        if name is not None:
+            sql += " AND name = ?"
+            args.append(name)
+        if name_contains is not None:
+            sql += " AND instr(name, ?) > 0"
+            args.append(name_contains)
+        return [row[0] for row in self.conn().execute(sql, args)]
+
+    def storage_keys(self, batch_uuid):
+        return [row[0] for row in self.conn().execute(
+                "SELECT storage_key FROM docs WHERE batch_uuid = ? AND storage_key IS NOT NULL",
+                (batch_uuid,))]
+
+    def doc_count(self, batch_uuid):
+        return self.conn().execute(
+                "SELECT count(*) FROM docs WHERE batch_uuid = ?",
+                (batch_uuid,)).fetchone()[0]
+
+    def doc_info(self, batch_uuid, doc_key):
+        row = self.conn().execute(
+                "SELECT info FROM docs WHERE batch_uuid = ? AND doc_key = ?",
+                (batch_uuid, doc_key)).fetchone()
+        if row:
+            return pickle.loads(row[0])
+
+    def doc_key(self, batch_uuid, storage_key):
+        row = self.conn().execute(
+                "SELECT doc_key FROM docs WHERE batch_uuid = ? AND storage_key = ?",
+                (batch_uuid, storage_key)).fetchone()
+        if row:
+            return row[0]
+
+class StoredDocs(Mapping):
+    """
+    Read-only mapping of doc keys to doc info for a saved batch. Doc info is
+    only loaded from the batch store when it is requested.
+    """
+    def __init__(self, store, batch_uuid):
+        self.store = store
+        self.batch_uuid = batch_uuid
+        self.loaded = {}
+
+    def __getitem__(self, doc_key):
+        if not doc_key in self.loaded:
+            info = self.store.doc_info(self.batch_uuid, doc_key)
+            if info is None:
+                raise KeyError(doc_key)
+            self.loaded[doc_key] = info
+        return self.loaded[doc_key]
+
+    def __contains__(self, doc_key):
+        try:
+            self[doc_key]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return iter(self.store.doc_keys(self.batch_uuid))
+
+    def __len__(self):
+        return self.store.doc_count(self.batch_uuid)
+
+class StoredDocKeys(Mapping):
+    """
+    Read-only mapping of storage keys to doc keys for a saved batch.
+    """
+    def __init__(self, store, batch_uuid):
+        self.store = store
+        self.batch_uuid = batch_uuid
+
+    def __getitem__(self, storage_key):
+        doc_key = self.store.doc_key(self.batch_uuid, storage_key)
+        if doc_key is None:
+            raise KeyError(storage_key)
+        return doc_key
+
+    def __iter__(self):
+        return iter(self.store.storage_keys(self.batch_uuid))
+
+    def __len__(self):
+        return self.store.doc_count(self.batch_uuid)
+
 class Batch(object):
     def __init__(self, wrapper):
         self.wrapper = wrapper
@@ -12,14 +208,22 @@ class Batch(object):
         self.uuid = str(uuid.uuid4())
         self.start_time = None
         self.end_time = None
+        self.pattern_count = 0
+        self.pattern_time = 0.0
+        self.store = None
+        self._datas = {}
 
     def __repr__(self):
         return "Batch(%s)" % self.uuid
 
     def __iter__(self):
-        for doc_key in self.docs:
-            if self.docs[doc_key]['state'] in ('uncached',):
-                continue
+        if self.store:
+            doc_keys = self.store.doc_keys(self.uuid, include_uncached=False)
+        else:
+            doc_keys = [doc_key for doc_key, info in self.docs.items()
+                    if not info['state'] in ('uncached',)]
+
+        for doc_key in doc_keys:
             yield self.output_data(doc_key)
 
     def add_doc(self, doc):
@@ -33,8 +237,30 @@ class Batch(object):
             self.update_doc_info(doc)
             self.filters_used.extend(doc.filter_aliases)
 
+    def remove_doc(self, doc):
+        """
+        Removes a doc added by add_doc, e.g. an additional doc which is no
+        longer generated.
+        """
+        doc_key = doc.key_with_class()
+        self.docs.pop(doc_key, None)
+        for storage_key, key in list(self.doc_keys.items()):
+            if key == doc_key:
+                del self.doc_keys[storage_key]
+        self._datas.pop((doc_key, 'input'), None)
+        self._datas.pop((doc_key, 'output'), None)
+
     def update_doc_info(self, doc):
-        self.docs[doc.key_with_class()] = doc.batch_info()
+        self.update_docs({doc.key_with_class() : doc.batch_info()})
+
+    def update_docs(self, docs):
+        """
+        Updates doc info for several docs, dropping any cached data objects.
+        """
+        self.docs.update(docs)
+        for doc_key in docs:
+            self._datas.pop((doc_key, 'input'), None)
+            self._datas.pop((doc_key, 'output'), None)
 
     def output_data(self, doc_key):
         return self.data(doc_key, 'output')
@@ -44,7 +270,7 @@ class Batch(object):
 
     def doc_info(self, doc_key):
         return self.docs[doc_key]
-   
+
     def doc_key(self, storage_key):
         return self.doc_keys[storage_key]
 
@@ -58,16 +284,41 @@ class Batch(object):
 
     def data(self, doc_key, input_or_output='output'):
         """
-        Retrieves a data object given the doc key.
+        Retrieves a data object given the doc key. Data objects are created
+        once per batch and reused for later lookups.
+        """
+        cache_key = (doc_key, input_or_output)
+        if not cache_key in self._datas:
+            doc_info = self.doc_info(doc_key)["%s-data" % input_or_output]
+            args = list(doc_info)
+            args.append(self.wrapper)
+            data = dexy.data.Data.create_instance(*args)
+            data.setup_storage()
+            if hasattr(data.storage, 'connect'):
+                data.storage.connect()
+            self._datas[cache_key] = data
+        return self._datas[cache_key]
+
+    def output_data_matching(self, key=None, expr=None):
+        """
+        Returns output data for docs whose name is exactly key or contains
+        expr, without loading info for any other docs.
+        """
+        if self.store:
+            doc_keys = self.store.doc_keys(self.uuid, False, name=key, name_contains=expr)
+        else:
+            doc_keys = [doc_key for doc_key, info in self.docs.items()
+                    if not info['state'] in ('uncached',)
+                    and (key is None or info['output-data'][1] == key)
+                    and (expr is None or expr in info['output-data'][1])]
+        return [self.output_data(doc_key) for doc_key in doc_keys]
+
+    def add_pattern_time(self, elapsed):
+        """
+        Records time taken to find files matching a pattern node's pattern.
         """
-        doc_info = self.doc_info(doc_key)["%s-data" % input_or_output]
-        args = list(doc_info)
-        args.append(self.wrapper)
-        data = dexy.data.Data.create_instance(*args)
-        data.setup_storage()
-        if hasattr(data.storage, 'connect'):
-            data.storage.connect()
-        return data
+        self.pattern_count += 1
+        self.pattern_time += elapsed
 
     def elapsed(self):
         if self.end_time and self.start_time:
@@ -75,21 +326,11 @@ class Batch(object):
         else:
             return 0
 
-    def filename(self):
-        return "%s.pickle" % self.uuid
-
-    def filepath(self):
-        return os.path.join(self.batch_dir(), self.filename())
-
-    def most_recent_filename(self):
-        return os.path.join(self.batch_dir(), 'most-recent-batch.txt')
-
     def batch_dir(self):
         return os.path.join(self.wrapper.artifacts_dir, 'batches')
 
-    def to_dict(self):
-        attr_names = ['docs', 'doc_keys', 'filters_used', 'uuid']
-        return dict((k, getattr(self, k),) for k in attr_names)
+    def store_filepath(self):
+        return os.path.join(self.batch_dir(), 'batches.sqlite3')
 
     def save_to_file(self):
         try:
@@ -97,31 +338,73 @@ class Batch(object):
         except OSError:
             pass
 
-        with open(self.filepath(), 'wb') as f:
-            pickle.dump(self.to_dict(), f)
+        store = BatchStore(self.store_filepath())
+        try:
+            store.save(self)
+        finally:
+            store.close()
+
+    def remove_old_batches(self, keep, vacuum=False):
+        """
+        Removes information about all but the keep most recent batches, and
+        any batch files left by older dexy versions.
+        """
+        n = 0
+        if os.path.exists(self.batch_dir()):
+            for entry in os.scandir(self.batch_dir()):
+                if entry.name.endswith(".pickle"):
+                    os.remove(entry.path)
+                    n += 1
+
+        if keep and os.path.exists(self.store_filepath()):
+            store = BatchStore(self.store_filepath())
+            try:
+                n += store.remove_old_batches(keep, vacuum)
+            finally:
+                store.close()
 
-        with open(self.most_recent_filename(), 'w') as f:
-            f.write(self.uuid)
+        return n
 
-    def load_from_file(self):
-        with open(self.filepath(), 'rb') as f:
-            d = pickle.load(f)
-            for k, v in d.items():
-                setattr(self, k, v)
+    def retention_start_time(self, keep):
+        """
+        Returns the start time of the oldest batch which is kept when keeping
+        the keep most recent batches, or None if none are removed.
+        """
+        if keep and os.path.exists(self.store_filepath()):
+            store = BatchStore(self.store_filepath())
+            try:
+                return store.oldest_start_time(keep)
+            finally:
+                store.close()
+
+    def load(self, store, batch_uuid):
+        """
+        Points this batch at a batch saved in store. Doc info is loaded lazily.
+        """
+        filters_used, start_time, end_time = store.batch_info(batch_uuid)
+        self.store = store
+        self.uuid = batch_uuid
+        self.filters_used = pickle.loads(filters_used)
+        self.start_time = start_time
+        self.end_time = end_time
+        self.docs = StoredDocs(store, batch_uuid)
+        self.doc_keys = StoredDocKeys(store, batch_uuid)
+        self._datas = {}
 
     @classmethod
     def load_most_recent(klass, wrapper):
         """
-        Retuns a batch instance representing the most recent batch as indicated
-        by the UUID stored in most-recent-batch.txt.
+        Retuns a batch instance representing the most recently saved batch,
+        or None if no batch has been saved.
         """
         batch = Batch(wrapper)
-        try:
-            with open(batch.most_recent_filename(), 'r') as f:
-                most_recent_uuid = f.read()
+        if not os.path.exists(batch.store_filepath()):
+            return
 
-            batch.uuid = most_recent_uuid
-            batch.load_from_file()
+        store = BatchStore(batch.store_filepath())
+        most_recent_uuid = store.most_recent_uuid()
+        if most_recent_uuid:
+            batch.load(store, most_recent_uuid)
             return batch
-        except IOError:
-            pass
+        else:
+            store.close()
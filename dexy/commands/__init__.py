@@ -20,6 +20,7 @@ from dexy.commands.info import links_command
 from dexy.commands.parsers import parsers_command
 from dexy.commands.conf import conf_command
 from dexy.commands.dirs import cleanup_command
+from dexy.commands.dirs import gc_command
 from dexy.commands.dirs import reset_command
 from dexy.commands.dirs import setup_command
 from dexy.commands.env import env_command
@@ -41,6 +42,7 @@ from dexy.commands.serve import serve_command
 from dexy.commands.templates import gen_command
 from dexy.commands.templates import template_command
 from dexy.commands.templates import templates_command
+from dexy.commands.watch import watch_command
 
 ### "modargs-settings"
 dexy_default_cmd = 'dexy'
@@ -169,6 +171,7 @@ def help_command(
         
         Other commands:
           `dexy serve` start a local static web server to view generated docs
+          `dexy watch` run dexy again each time files change
           `dexy help` you're reading it
           `dexy version` print the version of dexy software which is installed
         """)
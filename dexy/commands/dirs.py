@@ -32,6 +32,26 @@ def cleanup_command(
     wrapper.remove_dexy_dirs()
     wrapper.remove_reports_dirs(reports)
 
+def gc_command(
+        __cli_options=False,
+        artifactsdir=defaults['artifacts_dir'], # Where dexy should store working files.
+        batchretention=defaults['batch_retention'], # Number of batches to keep information about, 0 to keep all.
+        cachemaxsize=defaults['cache_max_size'], # Maximum size of cache files to keep, like 500M or 2G.
+        ):
+    """
+    Remove cache files which are no longer used, information about old
+    batches and, if the cache is larger than cachemaxsize, the least recently
+    used cache files. Highlighted code and compiled templates which none of
+    the kept batches used are also removed.
+    """
+    wrapper = init_wrapper(locals())
+    wrapper.assert_dexy_dirs_exist()
+    wrapper.object_store.keep_all()
+    n_batches, n_objects, size = wrapper.collect_garbage(vacuum=True)
+    wrapper.empty_trash()
+    print("removed %s old batches and %s cache files (%0.1f MB)" % (
+        n_batches, n_objects, size / (1024.0 * 1024)))
+
 def setup_command(
         __cli_options=False,
         artifactsdir=defaults['artifacts_dir'], # Where dexy should store working files.
@@ -51,10 +51,10 @@ def grep_command(
         sys.exit(1)
     else:
         if expr:
-            matches = sorted([data for data in batch if expr in data.key],
+            matches = sorted(batch.output_data_matching(expr=expr),
                     key=attrgetter('key'))
         elif key:
-            matches = sorted([data for data in batch if key == data.key],
+            matches = sorted(batch.output_data_matching(key=key),
                     key=attrgetter('key'))
         else:
             raise dexy.exceptions.UserFeedback("Must specify either expr or key")
@@ -100,10 +100,10 @@ def info_command(
 
     if expr:
         print("search expr:", expr)
-        matches = sorted([data for data in batch if expr in data.key],
+        matches = sorted(batch.output_data_matching(expr=expr),
                 key=attrgetter('key'))
     elif key:
-        matches = sorted([data for data in batch if key == data.key],
+        matches = sorted(batch.output_data_matching(key=key),
                 key=attrgetter('key'))
     else:
         raise dexy.exceptions.UserFeedback("Must specify either expr or key")
@@ -10,6 +10,8 @@ import time
 def dexy_command(
         __cli_options=False,
         artifactsdir=defaults['artifacts_dir'], # location of directory in which to store artifacts
+        batchretention=defaults['batch_retention'], # number of batches to keep information about, 0 to keep all
+        cachemaxsize=defaults['cache_max_size'], # maximum size of cache files to keep, like 500M or 2G, least recently used files are removed after each run when the cache is larger
         conf=defaults['config_file'], # name to use for configuration file
         configs=defaults['configs'], # list of doc config files to parse
         debug=defaults['debug'], # Prints stack traces, other debug stuff.
@@ -24,10 +26,12 @@ def dexy_command(
         h=False, #nodoc
         hashfunction=defaults['hashfunction'], # What hash function to use, set to crc32 or adler32 for more speed but less reliability
         include=defaults['include'], # Locations to include which would normally be excluded.
+        jobs=defaults['jobs'], # Number of worker processes to run documents in, documents run as soon as their inputs have run.
         logdir=defaults['log_dir'], # DEPRECATED
         logfile=defaults['log_file'], # name of log file
-        logformat=defaults['log_format'], # format of log entries
+        logformat=defaults['log_format'], # format of log entries, or 'json' to write one JSON object per line
         loglevel=defaults['log_level'], # log level, valid options are DEBUG, INFO, WARN
+        memorypipeline=defaults['memory_pipeline'], # Whether filters which read their input from memory get it straight from the previous filter while its file is written in the background.
         nocache=defaults['dont_use_cache'], # whether to force dexy not to use files from the cache
         noreports=False, # if true, don't run any reports
         outputroot=defaults['output_root'], # Subdirectory to use as root for output
@@ -36,13 +40,19 @@ def dexy_command(
         profile=defaults['profile'], # whether to run with cProfile. Arg can be a boolean, in which case profile saved to 'dexy.prof', or a filename to save to.
         r=False, # whether to clear cache before running dexy
         recurse=defaults['recurse'], # whether to include doc config files in subdirectories
+        replpool=defaults['repl_pool'], # Number of REPL processes to start ahead of time for each interpreter, so documents using filters like pycon don't wait for an interpreter to start.
         reports=defaults['reports'], # reports to be run after dexy runs, enclose in quotes and separate with spaces
         reset=False, # whether to clear cache before running dexy
+        sharedcache=defaults['shared_cache'], # Directory or http(s) URL of a cache shared between checkouts, docs not cached locally are fetched from here instead of being run.
+        sharedcacheupload=defaults['shared_cache_upload'], # Whether to upload docs to the shared cache after a successful run.
         silent=defaults['silent'], # Whether to not print any output when running dexy
         strace=defaults['strace'], # Run dexy using strace (VERY slow)
         uselocals=defaults['uselocals'], # use cached local copies of remote URLs, faster but might not be up to date, 304 from server will override this setting
         target=defaults['target'], # Which target to run. By default all targets are run, this allows you to run only 1 bundle (and its dependencies).
+        threads=defaults['threads'], # Number of threads to run documents which call external executables in, independent of -jobs.
+        trace=defaults['trace'], # File to write a trace of the run to, in trace event JSON format which can be opened in Perfetto or chrome://tracing.
         version=False, # For people who type -version out of habit
+        workspacemode=defaults['workspace_mode'], # How to put inputs in filter workspaces: 'copy', 'link' to use links to read-only cache files where possible, or 'lazy' to also only place inputs when filters which support it ask for them.
         writeanywhere=defaults['writeanywhere'] # Whether dexy can write files outside of the dexy project root.
     ):
     """
@@ -16,6 +16,8 @@ class NullHandler(logging.Handler):
 
 RENAME_PARAMS = {
         'artifactsdir' : 'artifacts_dir',
+        'batchretention' : 'batch_retention',
+        'cachemaxsize' : 'cache_max_size',
         'conf' : 'config_file',
         'dbalias' : 'db_alias',
         'dbfile' : 'db_file',
@@ -27,8 +29,13 @@ RENAME_PARAMS = {
         'logformat' : 'log_format',
         'loglevel' : 'log_level',
         'logdir' : 'log_dir',
+        'memorypipeline' : 'memory_pipeline',
         'nocache' : 'dont_use_cache',
-        'outputroot' : 'output_root'
+        'outputroot' : 'output_root',
+        'replpool' : 'repl_pool',
+        'sharedcache' : 'shared_cache',
+        'sharedcacheupload' : 'shared_cache_upload',
+        'workspacemode' : 'workspace_mode'
         }
 
 def default_config():
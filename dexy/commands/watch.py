@@ -0,0 +1,133 @@
+from dexy.commands.it import handle_user_feedback_exception
+from dexy.commands.it import log_and_print_exception
+from dexy.commands.utils import init_wrapper
+from dexy.filehashes import stat_signature
+from dexy.utils import defaults
+import dexy.exceptions
+import os
+import sys
+import time
+
+# Options of the dexy command which don't apply to dexy watch. Every other
+# option of the dexy command must also be an option of dexy watch, which
+# tests check.
+DEXY_ONLY_OPTIONS = ('dryrun', 'h', 'help', 'logdir', 'profile', 'r', 'reset',
+        'silent', 'strace', 'version',)
+
+# Options of dexy watch which aren't passed on to the wrapper.
+WATCH_ONLY_OPTIONS = ('interval',)
+
+def watch_command(
+        __cli_options=False,
+        artifactsdir=defaults['artifacts_dir'], # location of directory in which to store artifacts
+        batchretention=defaults['batch_retention'], # number of batches to keep information about, 0 to keep all
+        cachemaxsize=defaults['cache_max_size'], # maximum size of cache files to keep, like 500M or 2G, least recently used files are removed after each run when the cache is larger
+        conf=defaults['config_file'], # name to use for configuration file
+        configs=defaults['configs'], # list of doc config files to parse
+        debug=defaults['debug'], # Prints stack traces, other debug stuff.
+        directory=defaults['directory'], # Allow processing just a subdirectory.
+        encoding=defaults['encoding'], # Default encoding. Set to 'chardet' to use chardet auto detection.
+        exclude=defaults['exclude'], # comma-separated list of directory names to exclude from dexy processing
+        excludealso=defaults['exclude_also'], # comma-separated list of directory names to exclude from dexy processing
+        full=defaults['full'], # Whether to do a full run including tasks marked default: False
+        globals=defaults['globals'], # global values to make available within dexy documents, should be KEY=VALUE pairs separated by spaces
+        hashfunction=defaults['hashfunction'], # What hash function to use, set to crc32 or adler32 for more speed but less reliability
+        include=defaults['include'], # Locations to include which would normally be excluded.
+        interval=1.0, # Number of seconds to wait between checks for changed files.
+        jobs=defaults['jobs'], # Number of worker processes to run documents in, documents run as soon as their inputs have run.
+        logfile=defaults['log_file'], # name of log file
+        logformat=defaults['log_format'], # format of log entries, or 'json' to write one JSON object per line
+        loglevel=defaults['log_level'], # log level, valid options are DEBUG, INFO, WARN
+        memorypipeline=defaults['memory_pipeline'], # Whether filters which read their input from memory get it straight from the previous filter while its file is written in the background.
+        nocache=defaults['dont_use_cache'], # whether to force dexy not to use files from the cache
+        noreports=False, # if true, don't run any reports
+        outputroot=defaults['output_root'], # Subdirectory to use as root for output
+        pickle=defaults['pickle'], # library to use for persisting info to disk, may be 'c', 'py', 'json'
+        plugins=defaults['plugins'], # additional python packages containing dexy plugins
+        recurse=defaults['recurse'], # whether to include doc config files in subdirectories
+        replpool=defaults['repl_pool'], # Number of REPL processes to start ahead of time for each interpreter, so documents using filters like pycon don't wait for an interpreter to start.
+        reports=defaults['reports'], # reports to be run after dexy runs, enclose in quotes and separate with spaces
+        sharedcache=defaults['shared_cache'], # Directory or http(s) URL of a cache shared between checkouts, docs not cached locally are fetched from here instead of being run.
+        sharedcacheupload=defaults['shared_cache_upload'], # Whether to upload docs to the shared cache after a successful run.
+        target=defaults['target'], # Which target to run. By default all targets are run, this allows you to run only 1 bundle (and its dependencies).
+        threads=defaults['threads'], # Number of threads to run documents which call external executables in, independent of -jobs.
+        trace=defaults['trace'], # File to write a trace of the run to, in trace event JSON format which can be opened in Perfetto or chrome://tracing.
+        uselocals=defaults['uselocals'], # use cached local copies of remote URLs, faster but might not be up to date, 304 from server will override this setting
+        workspacemode=defaults['workspace_mode'], # How to put inputs in filter workspaces: 'copy', 'link' to use links to read-only cache files where possible, or 'lazy' to also only place inputs when filters which support it ask for them.
+        writeanywhere=defaults['writeanywhere'] # Whether dexy can write files outside of the dexy project root.
+        ):
+    """
+    Runs dexy, then keeps watching the project directory and runs again
+    whenever files change. Only changed documents and documents which depend
+    on them are run again. Adding or removing files or changing a config file
+    causes a full run.
+    """
+    options = locals()
+    for name in WATCH_ONLY_OPTIONS:
+        del options[name]
+    del options['noreports']
+
+    def build():
+        wrapper = init_wrapper(options)
+        wrapper.assert_dexy_dirs_exist()
+        run_and_report(wrapper, wrapper.run_from_new)
+        return wrapper
+
+    def run_and_report(wrapper, run_fn, *args):
+        start = time.time()
+        try:
+            run_fn(*args)
+        except dexy.exceptions.UserFeedback as e:
+            handle_user_feedback_exception(wrapper, e)
+            return
+        except Exception as e:
+            log_and_print_exception(wrapper, e)
+            return
+
+        elapsed = time.time() - start
+        print("dexy run finished in %0.3f%s" % (elapsed, wrapper.state_message()))
+
+        if not noreports and wrapper.state in ('ran', 'error',):
+            wrapper.report()
+
+    wrapper = build()
+    signatures = file_signatures(wrapper.map_files())
+    print("watching for changes, press ctrl+c to stop")
+
+    try:
+        while True:
+            time.sleep(float(interval))
+
+            filemap = wrapper.map_files()
+            new_signatures = file_signatures(filemap)
+            if new_signatures == signatures:
+                continue
+
+            config_names = wrapper.parsers.split()
+            structure_changed = set(new_signatures) != set(signatures) or any(
+                    new_signatures[filepath] != signatures[filepath]
+                    for filepath in new_signatures
+                    if os.path.split(filepath)[1] in config_names)
+            signatures = new_signatures
+
+            if structure_changed or not wrapper.state in ('ran', 'error',):
+                print("files added, removed or reconfigured, running everything")
+                wrapper = build()
+                continue
+
+            wrapper.filemap = filemap
+            changed_docs = wrapper.changed_documents()
+
+            if changed_docs:
+                print("changed: %s" % ", ".join(doc.key for doc in changed_docs))
+                run_and_report(wrapper, wrapper.rerun, changed_docs)
+
+    except KeyboardInterrupt:
+        sys.stderr.write(os.linesep)
+
+def file_signatures(filemap):
+    """
+    Returns the stat signature of each file in filemap.
+    """
+    return dict((filepath, stat_signature(fileinfo['stat']))
+            for filepath, fileinfo in filemap.items())
@@ -2,13 +2,27 @@ from dexy.exceptions import InternalDexyProblem
 import dexy.plugin
 import dexy.storage
 import dexy.utils
+import concurrent.futures
 import dexy.wrapper
 import inflection
 import os
 import posixpath
-import shutil
 import urllib
 
+_background_writer = None
+_background_writer_pid = None
+
+def background_writer():
+    """
+    Returns the executor used to write data files in a background thread. A
+    new one is created in each process since threads don't survive a fork.
+    """
+    global _background_writer, _background_writer_pid
+    if _background_writer_pid != os.getpid():
+        _background_writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        _background_writer_pid = os.getpid()
+    return _background_writer
+
 class Data(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
     Base class for types of Data.
@@ -46,7 +60,9 @@ class Data(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         self.storage_key = storage_key
 
         self.wrapper = wrapper
-        self.initialize_settings(**settings)
+        # update_settings applies every entry in settings, so there's no need
+        # to also pass them to initialize_settings.
+        self.initialize_settings()
         self.update_settings(settings)
 
         self._data = None
@@ -126,15 +142,22 @@ class Data(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     def clear_data(self):
         self._data = None
 
+    def wait_for_save(self):
+        """
+        Waits for any save running in the background to finish.
+        """
+        pass
+
     def clear_cache(self):
         self._size = None
+        self.wrapper.object_store.forget(self.storage.data_file_name())
         try:
-            os.remove(self.storage.data_file())
+            os.remove(self.storage.data_file(read=False))
         except os.error as e:
             self.wrapper.log.warn(str(e))
 
     def copy_from_file(self, filename):
-        shutil.copyfile(filename, self.storage.data_file())
+        dexy.utils.copy_file(filename, self.storage.data_file(read=False))
 
     def output_to_file(self, filepath):
         """
@@ -281,6 +304,7 @@ class Data(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         """
         Returns size of file stored on disk.
         """
+        self.wait_for_save()
         if this is None:
             this = (self.wrapper.state in ('walked', 'running'))
         return self.storage.data_file_size(this)
@@ -318,22 +342,84 @@ class Generic(Data):
     """
     aliases = ['generic']
 
+    # Set when the next filter takes this data from memory, so the file can
+    # be written while the next filter runs.
+    save_in_background = False
+    _pending_save = None
+    # The bytes last decoded by __str__ and the resulting text.
+    _decoded = None
+
     def save(self):
-        if isinstance(self._data, str):
-            self.storage.write_data(self._data.encode("utf-8"))
+        self.wait_for_save()
+        if self._data is None:
+            msg = "No data found for '%s', did you reference a file that doesn't exist?"
+            raise dexy.exceptions.UserFeedback(msg % self.key)
+
+        if self.save_in_background:
+            self._pending_save = background_writer().submit(self.write_data, self._data)
         else:
-            if self._data == None:
-                msg = "No data found for '%s', did you reference a file that doesn't exist?"
-                raise dexy.exceptions.UserFeedback(msg % self.key)
-            self.storage.write_data(self._data)
+            self.write_data(self._data)
+
+    def write_data(self, data):
+        if isinstance(data, str):
+            self.storage.write_data(data.encode("utf-8"))
+        else:
+            self.storage.write_data(data)
+
+    def wait_for_save(self):
+        """
+        Waits for a save running in the background to finish, raising any
+        error it raised.
+        """
+        pending = self._pending_save
+        if pending is not None:
+            self._pending_save = None
+            pending.result()
+
+    def is_cached(self, this=None):
+        self.wait_for_save()
+        return Data.is_cached(self, this)
+
+    def output_to_file(self, filepath):
+        self.wait_for_save()
+        Data.output_to_file(self, filepath)
 
     def __str__(self):
-        if isinstance(self.data(), str):
-            return self.data()
-        elif not self.data():
+        data = self.data()
+        if isinstance(data, str):
+            return data
+        elif not data:
             return str(None)
+        elif self._decoded is not None and self._decoded[0] is data:
+            # Filters may call str() on their input more than once.
+            return self._decoded[1]
         else:
-            return self.wrapper.decode_encoded(self.data())
+            text = self.wrapper.decode_encoded(data)
+            self._decoded = (data, text)
+            return text
+
+    def open(self):
+        """
+        Returns a file object for reading the data as bytes without loading
+        it all into memory.
+        """
+        self.wait_for_save()
+        return self.storage.open()
+
+    def iter_chunks(self, chunk_size=65536):
+        """
+        Yields the data as bytes in blocks of up to chunk_size.
+        """
+        self.wait_for_save()
+        return self.storage.iter_chunks(chunk_size)
+
+    def mmap(self):
+        """
+        Returns a context manager giving a read only memory map of the data,
+        which can be searched like bytes without loading it all into memory.
+        """
+        self.wait_for_save()
+        return self.storage.mmap()
 
     def iteritems(self):
         """
@@ -414,6 +500,8 @@ class SectionValue(object):
 
     def __setitem__(self, key, value):
         self.parent.data()[self.parentindex+1][key] = value
+        if key == 'name':
+            self.parent.reset_section_index()
 
     def splitlines(self):
         return str(self).splitlines()
@@ -430,6 +518,12 @@ class Sectioned(Data):
             'storage-type' : 'jsonsectioned'
             }
 
+    # Map of section names to positions in keys(), and the _data list and
+    # length it was built for.
+    _section_index = None
+    _section_index_data = None
+    _section_index_len = 0
+
     def setup(self):
         self.setup_storage()
         self._data = [{}]
@@ -444,7 +538,7 @@ class Sectioned(Data):
             raise dexy.exceptions.InternalDexyProblem(msg)
 
     def __str__(self):
-        return "\n".join(str(v) for v in list(self.values()) if str(v))
+        return "\n".join(str(v) for v in self.values() if str(v))
 
     def __len__(self):
         """
@@ -462,16 +556,25 @@ class Sectioned(Data):
             # New section.
             section_dict = {"name" : key, "contents" : value}
             self._data.append(section_dict)
+            if self._section_index_data is self._data:
+                self._section_index.setdefault(key, len(self._data)-2)
+                self._section_index_len = len(self._data)
 
     def __delitem__(self, key):
         index = self.keyindex(key)
         self.data().pop(index+1)
+        self.reset_section_index()
 
     def keys(self):
         return [a['name'] for a in self.data()[1:]]
 
     def values(self):
-        return [SectionValue(a, self, i) for i, a in enumerate(self.data()[1:])]
+        """
+        Iterates over sections as SectionValue objects.
+        """
+        data = self.data()
+        for i in range(1, len(data)):
+            yield SectionValue(data[i], self, i-1)
 
     def output_to_file(self, filepath):
         """
@@ -480,19 +583,37 @@ class Sectioned(Data):
         with open(filepath, "wb") as f:
             f.write(str(self).encode("utf-8"))
 
+    def reset_section_index(self):
+        self._section_index = None
+        self._section_index_data = None
+        self._section_index_len = 0
+
+    def section_index(self):
+        """
+        Returns a dict mapping each section name to the position of its first
+        section in keys(). The dict is kept up to date as sections are added,
+        and rebuilt if _data has been replaced or changed in other ways.
+        """
+        data = self.data()
+        if self._section_index_data is not data or self._section_index_len != len(data):
+            index = {}
+            for i in range(1, len(data)):
+                index.setdefault(data[i]['name'], i-1)
+            self._section_index = index
+            self._section_index_data = data
+            self._section_index_len = len(data)
+        return self._section_index
+
     def keyindex(self, key):
         if self._data == [{}]:
             return -1
 
-        try:
-            return list(self.keys()).index(key)
-        except ValueError:
-            return -1
+        return self.section_index().get(key, -1)
 
     def value(self, key, throwException=True):
         index = self.keyindex(key)
         if index > -1:
-            return list(self.values())[index]
+            return SectionValue(self._data[index+1], self, index)
         else:
             try:
                 return self.data()[0][key]
@@ -512,10 +633,8 @@ class Sectioned(Data):
         """
         Iterable list of sections in document.
         """
-        keys = self.keys()
-        values = self.values()
-        for i in range(len(keys)):
-            yield (keys[i], values[i])
+        for value in self.values():
+            yield (value['name'], value)
 
 class KeyValue(Data):
     """
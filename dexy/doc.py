@@ -3,8 +3,6 @@ import dexy.filter
 import dexy.node
 import os
 import pickle
-import shutil
-import stat
 import time
 
 class Doc(dexy.node.Node):
@@ -69,7 +67,7 @@ class Doc(dexy.node.Node):
 
         self.log_debug("Name interpolation variables:")
         for key, value in name_args.items():
-            self.log_debug("%s: %s" % (key, value))
+            self.log_debug("%s: %s", key, value)
 
         if not "/" in output_name:
             output_name = os.path.join(os.path.dirname(self.name), output_name)
@@ -91,6 +89,11 @@ class Doc(dexy.node.Node):
 
         self.update_settings({'output-name' : updated_output_name})
 
+    def initialize_settings(self, **raw_kwargs):
+        # setup() applies all of the args, including ones which aren't
+        # settings yet, so there's no need to apply them here as well.
+        dexy.node.Node.initialize_settings(self)
+
     def setup(self):
         self.update_settings(self.args)
 
@@ -162,20 +165,15 @@ class Doc(dexy.node.Node):
         for node in self.input_nodes():
             node.consolidate_cache_files()
 
+        object_store = self.wrapper.object_store
+
         if self.state == 'cached':
             self.setup_datas()
 
-            # move cache files to new cache
+            # cache files stay where they are in the object store
             for d in self.datas():
-                if os.path.exists(d.storage.last_data_file()):
-                    last_loc = d.storage.last_data_file()
-                    this_loc = d.storage.this_data_file()
-
-                    self.log_debug("moving %s from %s to %s..." % (d.key, last_loc, this_loc))
-                    shutil.move(last_loc, this_loc)
-
-            if os.path.exists(self.runtime_info_filename(False)):
-                shutil.move(self.runtime_info_filename(False), self.runtime_info_filename(True))
+                object_store.keep(d.storage.data_file_name())
+            object_store.keep(self.runtime_info_name())
 
             self.apply_runtime_info()
 
@@ -184,6 +182,29 @@ class Doc(dexy.node.Node):
                     d.storage.connect()
             self.transition('consolidated')
 
+        elif self.state == 'uncached':
+            # cache files from previous runs are out of date
+            self.setup_datas()
+            for d in self.datas():
+                object_store.forget(d.storage.data_file_name())
+            object_store.forget(self.runtime_info_name())
+
+    def reset_for_rerun(self):
+        dexy.node.Node.reset_for_rerun(self)
+
+        self.wrapper.object_store.forget(self.initial_data.storage.data_file_name())
+        self.wrapper.object_store.forget(self.runtime_info_name())
+        self.initial_data.clear_data()
+
+        # Remove previous filter output so it can't be mistaken for new output.
+        for f in self.filters:
+            if f.output_data.state == 'new':
+                continue
+            if f.output_data.is_cached():
+                f.output_data.clear_cache()
+            f.output_data.clear_data()
+            f.output_data.setup()
+
     def apply_runtime_info(self):
             runtime_info = self.load_runtime_info()
             if runtime_info:
@@ -226,8 +247,6 @@ class Doc(dexy.node.Node):
         if self.setting('dirty'):
             return True
         elif self.name in self.wrapper.filemap:
-            live_stat = self.wrapper.filemap[self.name]['stat']
-
             self.initial_data.setup()
 
             in_this_cache = os.path.exists(self.initial_data.storage.this_data_file())
@@ -235,18 +254,20 @@ class Doc(dexy.node.Node):
 
             if in_this_cache or in_last_cache:
                 # we have a file in the cache from a previous run, compare its
-                # mtime to filemap to determine whether it has changed
+                # content hash to the live file's to determine whether it has
+                # changed, touching mtimes alone doesn't count as a change
                 if in_this_cache:
-                    cache_stat = os.stat(self.initial_data.storage.this_data_file())
+                    cache_file = self.initial_data.storage.this_data_file()
                 else:
-                    cache_stat = os.stat(self.initial_data.storage.last_data_file())
-
-                cache_mtime = cache_stat[stat.ST_MTIME]
-                live_mtime = live_stat[stat.ST_MTIME]
-                msg = "    cache mtime %s live mtime %s now %s changed (live gt cache) %s"
-                msgargs = (cache_mtime, live_mtime, time.time(), live_mtime > cache_mtime)
-                self.log_debug(msg % msgargs)
-                return live_mtime > cache_mtime
+                    cache_file = self.initial_data.storage.last_data_file()
+
+                live_hash = self.live_file_hash()
+                cache_hash = self.wrapper.file_hashes.hash(
+                        self.initial_data.storage_key, cache_file)
+
+                msg = "    cache hash %s live hash %s changed %s"
+                self.log_debug(msg, cache_hash, live_hash, live_hash != cache_hash)
+                return live_hash != cache_hash
             else:
                 # there is no file in the cache, therefore it has 'changed'
                 return True
@@ -254,6 +275,21 @@ class Doc(dexy.node.Node):
             # TODO check hash of contents of virtual files
             return False
 
+    def fetch_from_shared_cache(self):
+        shared_store = self.wrapper.shared_store
+        if shared_store and not self.setting('dirty'):
+            self.setup_datas()
+            return shared_store.fetch(self)
+        else:
+            return False
+
+    def live_file_hash(self):
+        """
+        Content hash of the project file this document is based on.
+        """
+        fileinfo = self.wrapper.filemap[self.name]
+        return self.wrapper.file_hashes.hash(self.name, fileinfo['ospath'], fileinfo['stat'])
+
     def data_class_alias(self):
         data_class_alias = self.setting('data-type')
 
@@ -273,9 +309,16 @@ class Doc(dexy.node.Node):
         return contents
 
     # Runtime Info
+    def runtime_info_name(self):
+        return "%s.runtimeargs.pickle" % self.hashid
+
     def runtime_info_filename(self, this=True):
-        name = "%s.runtimeargs.pickle" % self.hashid
-        return os.path.join(self.initial_data.storage.storage_dir(this), name)
+        name = self.runtime_info_name()
+        filepath = os.path.join(self.initial_data.storage.storage_dir(this), name)
+        if this:
+            return filepath
+        else:
+            return self.wrapper.object_store.path(name, filepath)
 
     def save_runtime_info(self):
         """
@@ -301,7 +344,7 @@ class Doc(dexy.node.Node):
         except IOError:
             pass
 
-        # Load from 'last' if there's nothing in 'this'
+        # Load from the object store if there's nothing in 'this'
         if not info:
             try:
                 with open(self.runtime_info_filename(False), 'rb') as f:
@@ -323,6 +366,10 @@ class Doc(dexy.node.Node):
             # This is a real file on the file system.
             if self.doc_changed or not self.initial_data.is_cached():
                 self.initial_data.copy_from_file(self.name)
+                self.wrapper.file_hashes.record(
+                        self.initial_data.storage_key,
+                        self.initial_data.storage.data_file(),
+                        self.live_file_hash())
         else:
             is_dummy = self.initial_data.is_cached() and self.get_contents() == 'dummy contents'
             if is_dummy:
@@ -330,15 +377,31 @@ class Doc(dexy.node.Node):
             else:
                 self.initial_data.set_data(self.get_contents())
 
-        for f in self.filters:
-            f.start_time = time.time()
-            if f.output_data.state == 'new':
-                f.output_data.setup()
-            if hasattr(f.output_data.storage, 'connect'):
-                f.output_data.storage.connect()
-            f.process()
-            f.finish_time = time.time()
-            f.elapsed = f.finish_time - f.start_time
+        tracer = self.wrapper.tracer
+        try:
+            for f in self.filters:
+                f.start_time = time.time()
+                if f.output_data.state == 'new':
+                    f.output_data.setup()
+                if hasattr(f.output_data.storage, 'connect'):
+                    f.output_data.storage.connect()
+                with tracer.span(f.alias, "filter", self.key):
+                    f.process()
+                f.finish_time = time.time()
+                f.elapsed = f.finish_time - f.start_time
+        except:
+            # Don't let a failed background save hide the filter's error.
+            for data in self.datas():
+                try:
+                    data.wait_for_save()
+                except Exception as e:
+                    msg = "error saving data for '%s' after filter error: %s"
+                    self.log_warn(msg % (data.key, e))
+            raise
+
+        # Intermediate data files may still be being written.
+        for data in self.datas():
+            data.wait_for_save()
 
         self.finish_time = time.time()
         self.elapsed_time = self.finish_time - self.start_time
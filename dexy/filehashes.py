@@ -0,0 +1,85 @@
+import hashlib
+import os
+import pickle
+import zlib
+
+def hash_file(filepath, hashfunction='md5'):
+    """
+    Returns a hex digest of the contents of filepath, reading in blocks.
+    """
+    if hashfunction in ('crc32', 'adler32'):
+        checksum = getattr(zlib, hashfunction)
+        value = checksum(b'')
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                value = checksum(block, value)
+        return "%08x" % value
+    else:
+        h = hashlib.new(hashfunction)
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                h.update(block)
+        return h.hexdigest()
+
+def stat_signature(stat):
+    """
+    The parts of a stat result which indicate that a file may have changed.
+    """
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+class FileHashIndex(object):
+    """
+    Persistent index of content hashes for files, keyed by a name such as a
+    project file path or a storage key. A file is only hashed again if its
+    size, mtime or inode have changed since it was last hashed.
+    """
+    def __init__(self, hashfunction='md5'):
+        self.hashfunction = hashfunction
+        self.entries = {}
+        self.seen = set()
+
+    def load(self, filepath):
+        try:
+            with open(filepath, 'rb') as f:
+                info = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return
+
+        if info.get('hashfunction') == self.hashfunction:
+            self.entries = info['entries']
+
+    def save(self, filepath):
+        """
+        Saves entries for files which were looked at in this run.
+        """
+        entries = dict((k, v) for k, v in self.entries.items() if k in self.seen)
+        info = {'hashfunction' : self.hashfunction, 'entries' : entries}
+        with open(filepath, 'wb') as f:
+            pickle.dump(info, f)
+
+    def hash(self, key, filepath, stat=None):
+        """
+        Returns the content hash of filepath, using the hash stored under key
+        if the file's stat signature has not changed.
+        """
+        if stat is None:
+            stat = os.stat(filepath)
+
+        signature = stat_signature(stat)
+        self.seen.add(key)
+
+        entry = self.entries.get(key)
+        if entry and entry[0] == signature:
+            return entry[1]
+
+        digest = hash_file(filepath, self.hashfunction)
+        self.entries[key] = (signature, digest)
+        return digest
+
+    def record(self, key, filepath, digest):
+        """
+        Stores a hash which is already known, e.g. for a copy of a file which
+        has just been hashed.
+        """
+        self.seen.add(key)
+        self.entries[key] = (stat_signature(os.stat(filepath)), digest)
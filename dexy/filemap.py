@@ -0,0 +1,209 @@
+import bisect
+import fnmatch
+import os
+import pickle
+import posixpath
+import re
+import time
+
+# Directories modified this close to the end of a scan aren't saved in the
+# snapshot, since a change in the same clock tick wouldn't change the mtime.
+RACY_INTERVAL_NS = 2 * 1000 * 1000 * 1000
+
+class FileInfo(dict):
+    """
+    Information about a file in the project. The 'stat' entry is only looked
+    up the first time it is used, reusing the DirEntry stat if there is one.
+    """
+    def __init__(self, ospath, dirpath, entry=None):
+        dict.__init__(self, ospath=ospath, dir=dirpath)
+        self.entry = entry
+
+    def __missing__(self, key):
+        if key == 'stat':
+            if self.entry is not None:
+                stat = self.entry.stat()
+            else:
+                stat = os.stat(self['ospath'])
+            self['stat'] = stat
+            return stat
+        else:
+            raise KeyError(key)
+
+# Indexes are exact, so they can't be used where paths are case insensitive.
+CASE_SENSITIVE_PATHS = os.path.normcase("A/b") == "A/b"
+
+# Compiled match functions for glob patterns, shared by all file maps.
+compiled_globs = {}
+
+def compile_glob(pattern):
+    """
+    Returns a function which matches paths against pattern in the same way as
+    fnmatch.fnmatch, compiling each pattern only once.
+    """
+    if not pattern in compiled_globs:
+        regex = fnmatch.translate(os.path.normcase(pattern))
+        compiled_globs[pattern] = re.compile(regex).match
+    return compiled_globs[pattern]
+
+def file_ext(filepath):
+    """
+    Returns everything from the last '.' in the file's basename, or ''.
+    """
+    basename = posixpath.basename(filepath)
+    i = basename.rfind(".")
+    if i < 0:
+        return ""
+    else:
+        return basename[i:]
+
+class FileMap(dict):
+    """
+    Map of project file paths to FileInfo objects.
+
+    Indexes of files by extension, by basename and by path (sorted, for
+    finding files under a directory) are built the first time glob is called,
+    so patterns only need to be matched against candidate files.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.indexes = None
+
+    def __setitem__(self, key, value):
+        self.indexes = None
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.indexes = None
+        dict.__delitem__(self, key)
+
+    def build_indexes(self):
+        by_ext = {}
+        by_basename = {}
+        order = {}
+
+        for i, filepath in enumerate(self):
+            order[filepath] = i
+            by_ext.setdefault(file_ext(filepath), []).append(filepath)
+            by_basename.setdefault(posixpath.basename(filepath), []).append(filepath)
+
+        self.indexes = {
+                'ext' : by_ext,
+                'basename' : by_basename,
+                'sorted' : sorted(self),
+                'order' : order
+                }
+
+    def under_prefix(self, prefix):
+        """
+        Returns all file paths which start with prefix.
+        """
+        paths = self.indexes['sorted']
+        start = bisect.bisect_left(paths, prefix)
+        end = start
+        while end < len(paths) and paths[end].startswith(prefix):
+            end += 1
+        return paths[start:end]
+
+    def candidates(self, pattern):
+        """
+        Returns the smallest list of files which could match pattern.
+        """
+        if not CASE_SENSITIVE_PATHS:
+            return list(self)
+
+        candidate_lists = []
+
+        # Files must be under any directory at the start of the pattern.
+        literal_prefix = re.split("[*?[]", pattern, 1)[0]
+        if "/" in literal_prefix:
+            dir_prefix = literal_prefix[0:literal_prefix.rfind("/")+1]
+            candidate_lists.append(self.under_prefix(dir_prefix))
+
+        # Files must end with any literal text at the end of the pattern.
+        literal_suffix = re.split("[*?[\\]]", pattern)[-1]
+        last_part = literal_suffix.split("/")[-1]
+        if last_part == pattern.split("/")[-1]:
+            candidate_lists.append(self.indexes['basename'].get(last_part, []))
+        elif "." in last_part:
+            ext = last_part[last_part.rfind("."):]
+            candidate_lists.append(self.indexes['ext'].get(ext, []))
+
+        if candidate_lists:
+            return min(candidate_lists, key=len)
+        else:
+            return list(self)
+
+    def glob(self, pattern):
+        """
+        Returns the file paths which match pattern using fnmatch rules, in the
+        order they appear in the file map.
+        """
+        if self.indexes is None:
+            self.build_indexes()
+
+        match = compile_glob(pattern)
+        matches = [filepath for filepath in self.candidates(pattern)
+                if match(os.path.normcase(filepath))]
+        return sorted(matches, key=self.indexes['order'].__getitem__)
+
+class DirectorySnapshot(object):
+    """
+    Persisted listing of each project directory along with its mtime, so
+    directories which haven't changed since the last scan don't need to be
+    read again.
+    """
+    def __init__(self, filepath, settings):
+        self.filepath = filepath
+        self.settings = settings
+        self.dirs = {}
+        self.new_dirs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filepath, 'rb') as f:
+                info = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return
+
+        if info.get('settings') == self.settings:
+            self.dirs = info['dirs']
+
+    def save(self):
+        racy_after = time.time_ns() - RACY_INTERVAL_NS
+        dirs = dict((dirpath, listing) for dirpath, listing in self.new_dirs.items()
+                if listing[0] < racy_after)
+        info = {'settings' : self.settings, 'dirs' : dirs}
+
+        try:
+            with open(self.filepath, 'wb') as f:
+                pickle.dump(info, f)
+        except IOError:
+            pass
+
+    def listing(self, dirpath):
+        """
+        Returns lists of file names and subdirectory names in dirpath, and a
+        dict of DirEntry objects for files if the directory had to be read.
+        """
+        mtime = os.stat(dirpath).st_mtime_ns
+        listing = self.dirs.get(dirpath)
+
+        if listing and listing[0] == mtime:
+            self.new_dirs[dirpath] = listing
+            return listing[1], listing[2], {}
+
+        filenames = []
+        dirnames = []
+        entries = {}
+
+        for entry in os.scandir(dirpath):
+            if entry.is_dir():
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+                entries[entry.name] = entry
+
+        self.new_dirs[dirpath] = (mtime, filenames, dirnames)
+        return filenames, dirnames, entries
@@ -17,6 +17,8 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
 
     TAGS = []
+    changes_working_dir = False # filter may call os.chdir while running
+    uses_repl_pool = False # filter may check out REPLs from the REPL pool
     _class_settings = {'max-docstring-length' : 75}
     nodoc_settings = [
             'help', 'nodoc'
@@ -102,7 +104,12 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             'workspace-includes' : (
                 """If set to a list of filenames or extensions, only these will
                 be populated to working dir.""",
-                None)
+                None),
+            'lazy-workspace' : (
+                """Whether this filter asks for the inputs it needs, so in
+                'lazy' workspace mode inputs are only placed in the working dir
+                when asked for.""",
+                False)
             }
 
     def __init__(self, doc=None):
@@ -170,6 +177,18 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
                 self.doc.wrapper
                 )
 
+        if self.next_filter and self.doc.wrapper.memory_pipeline:
+            if self.next_filter.reads_input_from_memory():
+                self.output_data.save_in_background = True
+
+    def reads_input_from_memory(self):
+        """
+        Whether this filter only reads its input data from memory and never
+        from the input's data file, so the file can be written in the
+        background while this filter runs.
+        """
+        return False
+
     def is_canonical_output(self):
         if self.input_data.setting('canonical-output') == True:
             return True
@@ -261,14 +280,14 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     def key_with_class(self):
         return "%s:%s" % (self.__class__.__name__, self.key)
 
-    def log_debug(self, message):
-        self.doc.log_debug(message)
+    def log_debug(self, message, *args):
+        self.doc.log_debug(message, *args)
 
-    def log_info(self, message):
-        self.doc.log_info(message)
+    def log_info(self, message, *args):
+        self.doc.log_info(message, *args)
 
-    def log_warn(self, message):
-        self.doc.log_warn(message)
+    def log_warn(self, message, *args):
+        self.doc.log_warn(message, *args)
 
     def process(self):
         """
@@ -290,7 +309,7 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         """
         Creates a new Doc object for an on-the-fly document.
         """
-        self.log_debug("adding doc with contents type %s" % doc_contents.__class__.__name__)
+        self.log_debug("adding doc with contents type %s", doc_contents.__class__.__name__)
         doc_name = os_to_posix(doc_name)
         if not posixpath.sep in doc_name:
             doc_name = posixpath.join(self.input_data.parent_dir(), doc_name)
@@ -298,7 +317,7 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         doc_ext = os.path.splitext(doc_name)[1]
 
         additional_doc_filters = self.setting('additional-doc-filters')
-        self.log_debug("additional-doc-filters are %s" % additional_doc_filters)
+        self.log_debug("additional-doc-filters are %s", additional_doc_filters)
 
         
         additional_doc_settings = self.setting('additional-doc-settings')
@@ -318,7 +337,7 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         if doc_args:
             settings.update(doc_args)
 
-        self.log_debug("additional-doc-settings are %s" % settings)
+        self.log_debug("additional-doc-settings are %s", settings)
 
 
         def create_doc(name, filters, contents, args=None):
@@ -432,21 +451,21 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
         if workspace_includes is not None:
             if inpt.ext in workspace_includes:
-                self.log_debug("Including %s because file extension matches." % inpt)
+                self.log_debug("Including %s because file extension matches.", inpt)
                 return True
             elif inpt.output_data().basename() in workspace_includes:
-                self.log_debug("Including %s because base name matches." % inpt)
+                self.log_debug("Including %s because base name matches.", inpt)
                 return True
             else:
-                self.log_debug("Excluding %s because does not match workspace-includes" % inpt)
+                self.log_debug("Excluding %s because does not match workspace-includes", inpt)
                 return False
 
         elif not inpt.filters:
-            self.log_debug("Including because %s has no filters." % inpt)
+            self.log_debug("Including because %s has no filters.", inpt)
             return True
 
         elif inpt.filters[-1].setting('override-workspace-exclude-filters'):
-            self.log_debug("Including %s because override-workspace-exclude-filters is set." % inpt)
+            self.log_debug("Including %s because override-workspace-exclude-filters is set.", inpt)
             return True
 
         else:
@@ -456,14 +475,15 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
                 self.log_debug("Including because exclude_filters is None.")
                 return True
             elif any(a in workspace_exclude_filters for a in inpt.filter_aliases):
-                self.log_debug("Excluding %s because of workspace-exclude-filters" % inpt)
+                self.log_debug("Excluding %s because of workspace-exclude-filters", inpt)
                 return False
             else:
-                self.log_debug("Including %s because not excluded" % inpt)
+                self.log_debug("Including %s because not excluded", inpt)
                 return True
 
     def makedirs(self):
-        mkdirs = self.setting('mkdirs')
+        # Copy, the setting's list may be shared with other filters.
+        mkdirs = list(self.setting('mkdirs'))
 
         # mkdir should be a string, but handle either string or list
         mkdir = self.setting('mkdir')
@@ -475,7 +495,7 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
         for d in mkdirs:
             dirpath = os.path.join(self.workspace(), d)
-            self.log_debug("Creating directory %s" % dirpath)
+            self.log_debug("Creating directory %s", dirpath)
             os.makedirs(dirpath)
 
     def populate_workspace(self):
@@ -483,13 +503,27 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
         Populates the workspace directory with inputs to the filter, under
         their canonical names.
         """
+        with self.doc.wrapper.tracer.span("populate_workspace", "workspace", self.doc.key):
+            self.populate_workspace_inputs()
+
+    def populate_workspace_inputs(self):
         self.log_debug("in populate_workspace method")
         already_created_dirs = set()
         wd = self.parent_work_dir()
 
+        workspace_mode = self.doc.wrapper.workspace_mode
+        if not workspace_mode in ('copy', 'link', 'lazy',):
+            msg = "workspace mode should be 'copy', 'link' or 'lazy', not '%s'"
+            raise dexy.exceptions.UserFeedback(msg % workspace_mode)
+
+        use_links = workspace_mode in ('link', 'lazy',)
+        is_lazy = workspace_mode == 'lazy' and self.setting('lazy-workspace')
+
         self._files_workspace_populated_with = set()
+        self._lazy_workspace_inputs = {}
 
-        self.doc.wrapper.trash(wd)
+        if os.path.exists(wd):
+            self.doc.wrapper.trash(wd)
 
         try:
             os.makedirs(wd)
@@ -503,17 +537,23 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
         traditional_input_docs = list(self.doc.walk_input_docs())
         input_docs = traditional_input_docs + self.doc.additional_docs
-        self.log_debug("input docs %s" % input_docs)
+        self.log_debug("input docs %s", input_docs)
 
         for i, inpt in enumerate(input_docs):
             if not self.include_input_in_workspace(inpt):
-                self.log_debug("not populating workspace with input '%s'" % inpt.key)
+                self.log_debug("not populating workspace with input '%s'", inpt.key)
                 continue
 
             data = inpt.output_data()
 
             filepath = data.name
 
+            if is_lazy and i < len(traditional_input_docs):
+                self.log_debug("deferring populating workspace with %s for %s", filepath, inpt.key)
+                self._lazy_workspace_inputs[filepath] = data
+                self._files_workspace_populated_with.add(filepath)
+                continue
+
             # Ensure parent dir exists.
             parent_dir = os.path.join(self.workspace(), os.path.dirname(filepath))
             if not parent_dir in already_created_dirs:
@@ -524,7 +564,7 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
                     pass
 
             # Save contents of file to workspace
-            self.log_debug("populating workspace with %s for %s" % (filepath, inpt.key))
+            self.log_debug("populating workspace with %s for %s", filepath, inpt.key)
             file_dest = os.path.join(self.workspace(), filepath)
 
             try:
@@ -532,10 +572,10 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
                     contents = inpt.setting('contents')
                     data.storage.write_data(contents, file_dest)
                 else:
-                    copy_or_link(data, file_dest, use_links=False)
+                    copy_or_link(data, file_dest, use_links=use_links)
 
             except Exception as e:
-                self.log_debug("problem populating working dir with input %s" % data.key)
+                self.log_debug("problem populating working dir with input %s", data.key)
                 self.log_debug(e)
 
             self._files_workspace_populated_with.add(filepath)
@@ -546,6 +586,25 @@ class Filter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
         self.custom_populate_workspace()
 
+    def materialize_workspace_input(self, filepath):
+        """
+        Places the input with canonical name filepath in the workspace, if
+        populate_workspace left it out because the workspace is lazy. Returns
+        True if the input was placed in the workspace.
+        """
+        data = getattr(self, '_lazy_workspace_inputs', {}).pop(filepath, None)
+        if data is None:
+            return False
+
+        file_dest = os.path.join(self.workspace(), filepath)
+        parent_dir = os.path.dirname(file_dest)
+        if not os.path.exists(parent_dir):
+            os.makedirs(parent_dir)
+
+        self.log_debug("populating workspace with %s on demand", filepath)
+        copy_or_link(data, file_dest, use_links=True)
+        return True
+
     def custom_populate_workspace(self):
         """
         Allow filters to run the standard populate_workspace, and also do extra
@@ -581,6 +640,11 @@ class DexyFilter(Filter):
     """
     aliases = ['dexy']
 
+    def reads_input_from_memory(self):
+        # Subclasses which override process may read the input's file.
+        return hasattr(self, "process_text") and \
+                type(self).process is DexyFilter.process
+
     def process(self):
         if hasattr(self, "process_text"):
             output = self.process_text(str(self.input_data))
@@ -1,51 +1,68 @@
-import dexy.filters.ansi
-import dexy.filters.api
-import dexy.filters.archive
-import dexy.filters.asciidoctor
-import dexy.filters.aws
-import dexy.filters.confluence
-import dexy.filters.deprecated
-import dexy.filters.easy
-import dexy.filters.example
-import dexy.filters.fluid_html
-import dexy.filters.genipynb
-import dexy.filters.git
-import dexy.filters.id
-import dexy.filters.ipynb
-import dexy.filters.java
-import dexy.filters.latex
-import dexy.filters.lyx
-import dexy.filters.matrix
-import dexy.filters.md
+# Filter modules are not imported here, plugins are registered from a
+# manifest and each module is imported the first time one of its filters is
+# used. The manifest is rebuilt if any of these files change.
+import dexy.filter
+import dexy.manifest
+import dexy.plugin
+import os
 
-try:
-    import dexy.filters.md_mistune
-except (ImportError, NameError):
-    pass
+filter_modules = [
+    'dexy.filters.ansi',
+    'dexy.filters.api',
+    'dexy.filters.archive',
+    'dexy.filters.asciidoctor',
+    'dexy.filters.aws',
+    'dexy.filters.confluence',
+    'dexy.filters.deprecated',
+    'dexy.filters.easy',
+    'dexy.filters.example',
+    'dexy.filters.fluid_html',
+    'dexy.filters.genipynb',
+    'dexy.filters.git',
+    'dexy.filters.id',
+    'dexy.filters.ipynb',
+    'dexy.filters.java',
+    'dexy.filters.latex',
+    'dexy.filters.lyx',
+    'dexy.filters.matrix',
+    'dexy.filters.md',
+    'dexy.filters.org',
+    'dexy.filters.pexp',
+    'dexy.filters.phantomjs',
+    'dexy.filters.pydoc',
+    'dexy.filters.pytest',
+    'dexy.filters.pyparse',
+    'dexy.filters.pyg',
+    'dexy.filters.pyn',
+    'dexy.filters.rst',
+    'dexy.filters.sanitize',
+    'dexy.filters.soup',
+    'dexy.filters.split',
+    'dexy.filters.standard',
+    'dexy.filters.sub',
+    'dexy.filters.templating',
+    'dexy.filters.templating_plugins',
+    'dexy.filters.websequence',
+    'dexy.filters.wordpress',
+    'dexy.filters.yamlargs',
+    'dexy.filters.xxml',
+    'dexy.filters.zulip',
+    ]
 
-import dexy.filters.org
-import dexy.filters.pexp
-import dexy.filters.phantomjs
-import dexy.filters.pydoc
-import dexy.filters.pytest
-import dexy.filters.pyparse
-import dexy.filters.pyg
-import dexy.filters.pyn
-import dexy.filters.rst
-import dexy.filters.sanitize
-import dexy.filters.soup
-import dexy.filters.split
-import dexy.filters.standard
-import dexy.filters.sub
-import dexy.filters.templating
-import dexy.filters.websequence
-import dexy.filters.wordpress
-import dexy.filters.yamlargs
-import dexy.filters.xxml
-import dexy.filters.zulip
+optional_filter_modules = [
+    'dexy.filters.md_mistune',
+    ]
 
-import dexy.filter
-import os
+package_dir = os.path.dirname(__file__)
+yaml_file = os.path.join(package_dir, 'filters.yaml')
+manifest_file = dexy.manifest.manifest_filepath(package_dir, 'filters-manifest')
+
+manifest = dexy.manifest.PluginManifest(
+        package_dir,
+        manifest_file,
+        filter_modules,
+        optional_filter_modules,
+        [yaml_file],
+        [dexy.filter.Filter, dexy.plugin.TemplatePlugin])
 
-yaml_file = os.path.join(os.path.dirname(__file__), 'filters.yaml')
-dexy.filter.Filter.register_plugins_from_yaml_file(yaml_file)
+manifest.load()
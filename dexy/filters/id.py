@@ -1,8 +1,13 @@
 from dexy.exceptions import UserFeedback, InternalDexyProblem
 from dexy.filters.pyg import PygmentsFilter
 from pygments import highlight
+import importlib.util
+import os
 import ply.lex as lex
 import ply.yacc as yacc
+import re
+import threading
+import types
 
 class LexError(InternalDexyProblem):
     pass
@@ -32,14 +37,24 @@ states = (
     ('idio', 'exclusive',),
 )
 
+# Lexer and parser tables are generated by write_tables and shipped with dexy.
+LEXTAB = "dexy.filters.id_lextab"
+PARSETAB = "dexy.filters.id_parsetab"
+
+# Text which could start an idio marker: a comment character repeated three
+# times as in ### "name", or the start of <!-- section "name" --> or
+# /*** section "name" */. The lexer turns some \r\n line endings into \n.
+# Text without any of these is a single section and doesn't need parsing.
+MAYBE_IDIO = re.compile(r"([#%;/C!])\1\1|<!--|/\*\*\*|\r")
+
 class Id(PygmentsFilter):
     """
     Splits files into sections based on comments like ### "foo"
 
     Replacement for idiopidae. Should be fully backwards-compatible.
 
-    For more information about the settings starting with ply-, see the PLY
-    YACC parser documentation http://www.dabeaz.com/ply/ply.html#ply_nn36
+    Files without anything which could be an idio marker aren't parsed, the
+    whole file becomes the first section.
     """
     aliases = ['idio', 'id', 'idiopidae', 'htmlsections']
     _settings = {
@@ -47,11 +62,11 @@ class Id(PygmentsFilter):
             'highlight' : ("Whether to apply syntax highlighting to sectional output.", None),
             'skip-extensions' : ("Because |idio gets applied to *.*, need to make it easy to skip non-textual files.", (".odt")),
             'remove-leading' : ("If a document starts with empty section named '1', remove it.", False),
-            'ply-optimize' : ("Whether to use optimized mode for the lexer.", 1),
-            'ply-write-tables' : ("Whether to generate parser table files (which will be stored in ply-outputdir and named ply-tabmodule).", 1),
-            'ply-outputdir' : ("Location relative to where you run dexy in which ply will store table files. Defaults to dexy's log directory.", None),
-            'ply-parsetab' : ("Name of parser tabfile (.py extension will be added) to be stored in ply-outputdir if ply-write-tables set to 1.", 'id_parsetab'),
-            'ply-lextab' : ("Name of lexer tabfile (.py extension will be added) to be stored in ply-outputdir if ply-optimize is set to 1.", 'id_lextab'),
+            'ply-optimize' : ("DEPRECATED, lexer tables are shipped with dexy.", 1),
+            'ply-write-tables' : ("DEPRECATED, parser tables are shipped with dexy.", 1),
+            'ply-outputdir' : ("DEPRECATED, table files are no longer written.", None),
+            'ply-parsetab' : ("DEPRECATED, parser tables are shipped with dexy.", 'id_parsetab'),
+            'ply-lextab' : ("DEPRECATED, lexer tables are shipped with dexy.", 'id_lextab'),
             'output-extensions' : PygmentsFilter.MARKUP_OUTPUT_EXTENSIONS + PygmentsFilter.IMAGE_OUTPUT_EXTENSIONS
             }
 
@@ -63,21 +78,16 @@ class Id(PygmentsFilter):
             self.output_data.save()
             return
 
-        lexer.outputdir = self.setting('ply-outputdir')
-        lexer.errorlog = self.doc.wrapper.log
-        lexer.remove_leading = self.setting('remove-leading')
-        parser.outputdir = self.setting('ply-outputdir')
-        parser.errorlog = self.doc.wrapper.log
-        parser.write_tables = self.setting('ply-write-tables')
-
-        _lexer = lexer.clone()
-        _lexer.sections = []
-        _lexer.level = 0
-        start_new_section(_lexer, 0, 0, _lexer.level)
-
-        parser.parse(input_text + "\n", lexer=_lexer)
-        strip_trailing_newline(_lexer)
-        parser_output = _lexer.sections
+        if MAYBE_IDIO.search(input_text):
+            parser_output = self.parse(input_text)
+        else:
+            parser_output = [{
+                    'name' : '1',
+                    'position' : 0,
+                    'lineno' : 0,
+                    'contents' : input_text,
+                    'level' : 0
+                    }]
 
         pyg_lexer = self.create_lexer_instance()
         pyg_formatter = self.create_formatter_instance()
@@ -98,6 +108,25 @@ class Id(PygmentsFilter):
             self.output_data._data.append(section)
         self.output_data.save()
 
+    def parse(self, input_text):
+        """
+        Returns a list of sections parsed from input_text.
+        """
+        thread_lexer, thread_parser = lexer_and_parser()
+        thread_parser.errorlog = self.doc.wrapper.log
+
+        _lexer = thread_lexer.clone()
+        _lexer.errorlog = self.doc.wrapper.log
+        _lexer.remove_leading = self.setting('remove-leading')
+        _lexer.parser = thread_parser
+        _lexer.sections = []
+        _lexer.level = 0
+        start_new_section(_lexer, 0, 0, _lexer.level)
+
+        thread_parser.parse(input_text + "\n", lexer=_lexer)
+        strip_trailing_newline(_lexer)
+        return _lexer.sections
+
 def t_error(t):
     raise LexError("Problem lexing at position %s." % t.lexpos)
 
@@ -494,10 +523,13 @@ def p_error(p):
 
     # Forward input to end of line
     while 1:
-        tok = yacc.token()
+        tok = p.lexer.token()
         if not tok or tok.type == 'NEWLINE': break
 
-    yacc.restart()
+    if hasattr(p.lexer, 'parser'):
+        p.lexer.parser.restart()
+    else:
+        yacc.restart()
 
 def tokenize(text, lexer):
     """
@@ -519,14 +551,49 @@ def token_info(text, lexer):
         return "%03d %-15s %s" % (tok.lexpos, tok.type, tok.value.replace("\n",""))
     return "\n".join(tok_info(tok) for tok in tokenize(text, lexer))
 
-# This is outside of the wrapper system so we aren't aware of user-specified
-# artifacts directory. Just use .dexy if it's there and don't write files if not.
+def build_lexer():
+    if importlib.util.find_spec(LEXTAB):
+        return lex.lex(optimize=1, lextab=LEXTAB)
+    else:
+        return lex.lex(optimize=0)
 
-import os
-if os.path.exists(".dexy"):
-    outputdir=".dexy"
-    lexer = lex.lex(optimize=1, lextab="id_lextab", outputdir=outputdir)
-    parser = yacc.yacc(tabmodule="id_parsetab",debug=0, outputdir=outputdir)
-else:
-    lexer = lex.lex(optimize=0)
-    parser = yacc.yacc(write_tables=0, debug=0)
+def build_parser():
+    # Tables are regenerated in memory if they don't match the grammar.
+    return yacc.yacc(tabmodule=PARSETAB, write_tables=0, debug=0)
+
+def write_tables(outputdir):
+    """
+    Writes the lexer and parser tables shipped with dexy to outputdir. Run
+    `python -m dexy.filters.id` after changing any of the rules above.
+    """
+    lex.lex(optimize=0).writetab("id_lextab", outputdir)
+
+    # Pass the rules without this module's package, so yacc doesn't load the
+    # shipped tables instead of generating new ones.
+    rules = dict((k, v) for k, v in globals().items()
+            if k == 'tokens' or k.startswith('p_'))
+    parsetab = os.path.join(outputdir, "id_parsetab.py")
+    if os.path.exists(parsetab):
+        os.remove(parsetab)
+    yacc.yacc(module=types.SimpleNamespace(__file__=__file__, **rules),
+            tabmodule="id_parsetab", outputdir=outputdir, debug=0)
+
+lexer = build_lexer()
+parser = build_parser()
+
+_thread_local = threading.local()
+
+def lexer_and_parser():
+    """
+    Returns a lexer and parser for the current thread, PLY parsers keep
+    state while parsing so can't be shared between threads.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return lexer, parser
+    elif not hasattr(_thread_local, 'parser'):
+        _thread_local.lexer = build_lexer()
+        _thread_local.parser = build_parser()
+    return _thread_local.lexer, _thread_local.parser
+
+if __name__ == '__main__':
+    write_tables(os.path.dirname(os.path.abspath(__file__)))
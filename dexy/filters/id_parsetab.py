@@ -0,0 +1,90 @@
+
+# id_parsetab.py
+# This file is automatically generated. Do not edit.
+# pylint: disable=W,C,R
+_tabversion = '3.10'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'AMP AT CODE COLONS DBLQUOTE END EXP IDIO IDIOCLOSE IDIOOPEN NEWLINE SGLQUOTE WHITESPACE WORDentries : entries entry\n               | entryentry : NEWLINE\n             | falsestart\n             | codes NEWLINE\n             | codes inlineidio NEWLINE\n             | idioline NEWLINEfalsestart : IDIO words NEWLINE\n                  | IDIO words IDIO NEWLINE\n                  | IDIO quote words quote NEWLINE\n                  | codes IDIO anythings NEWLINE\n                  | WHITESPACE IDIO anythings IDIO NEWLINE\n                  | WHITESPACE IDIO anythings NEWLINEanythings : anythings anything\n                 | anythinganything : WORD\n                | WHITESPACE\n                | CODEcodes : codes codon\n             | codoncodon : CODE \n             | WHITESPACEinlineidio : IDIO AMP WORDidioline : idio\n                | idio WHITESPACE\n                | WHITESPACE idio\n                | WHITESPACE idio WHITESPACEidio : export\n            | exportq\n            | exportql\n            | sectionstart\n            | closedcomment\n            | closedcommentlevels\n            | closedcommentq\n            | closedcommentql\n            | end sectionstart : IDIO quote WORD quote\n                    | IDIO quote COLONS WORD quoteclosedcomment : IDIOOPEN EXP WHITESPACE WORD IDIOCLOSE\n                     | IDIOOPEN EXP WHITESPACE WORD WHITESPACE IDIOCLOSEclosedcommentlevels : IDIOOPEN EXP WHITESPACE COLONS WORD IDIOCLOSE\n                           | IDIOOPEN EXP WHITESPACE COLONS WORD WHITESPACE IDIOCLOSEclosedcommentq : IDIOOPEN EXP WHITESPACE quote words quote IDIOCLOSE\n                      | IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE IDIOCLOSEclosedcommentql : IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE WORD IDIOCLOSE\n                       | IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE WORD WHITESPACE IDIOCLOSEexport : IDIO AT EXP WHITESPACE words\n              | IDIO AT EXP WHITESPACE words WHITESPACEexportq : IDIO AT EXP WHITESPACE quote words quote\n               | IDIO AT EXP WHITESPACE quote words quote WHITESPACEexportql : IDIO AT EXP WHITESPACE quote words quote WHITESPACE words\n                | IDIO AT EXP WHITESPACE quote words quote WHITESPACE words WHITESPACEend : IDIO AT END\n           | IDIOOPEN END IDIOCLOSE\n           | IDIOOPEN END WHITESPACE IDIOCLOSE\n           | IDIOOPEN EXP WHITESPACE quote END quote WHITESPACE IDIOCLOSEquote : DBLQUOTE\n             | SGLQUOTEwords : words WHITESPACE WORD\n             | WORD'
+    
+_lr_action_items = {'NEWLINE':([0,1,2,3,4,5,6,8,9,10,11,12,13,14,15,16,17,18,19,20,22,23,24,26,27,28,29,32,33,34,36,37,40,41,43,44,45,46,47,48,54,55,57,59,61,62,63,64,65,66,67,70,71,76,77,78,79,81,83,87,89,91,94,95,97,99,100,102,103,105,106,107,],[3,3,-2,-3,-4,23,28,-22,-20,-24,-21,-28,-29,-30,-31,-32,-33,-34,-35,-36,-1,-5,40,-19,-22,-7,48,-60,-57,-58,-26,-25,-6,61,-16,-15,-17,-18,64,-8,-53,71,-27,-54,-11,-14,-23,-9,-59,77,-37,81,-13,-55,-10,-38,-47,-12,-39,-48,-40,-41,-49,-42,-43,-50,-44,-56,-51,-45,-52,-46,]),'IDIO':([0,1,2,3,4,5,8,9,11,22,23,26,27,28,29,32,40,43,44,45,46,48,55,61,62,64,65,71,77,81,],[7,7,-2,-3,-4,25,35,-20,-21,-1,-5,-19,-22,-7,47,-60,-6,-16,-15,-17,-18,-8,70,-11,-14,-9,-59,-13,-10,-12,]),'WHITESPACE':([0,1,2,3,4,5,8,9,10,11,12,13,14,15,16,17,18,19,20,22,23,25,26,27,28,29,32,33,34,35,36,38,39,40,41,43,44,45,46,48,50,51,53,54,55,59,61,62,64,65,67,71,73,76,77,78,79,81,83,84,85,87,88,89,91,92,93,94,95,97,99,100,101,102,103,105,106,107,],[8,8,-2,-3,-4,27,-22,-20,37,-21,-28,-29,-30,-31,-32,-33,-34,-35,-36,-1,-5,45,-19,-22,-7,49,-60,-57,-58,45,57,58,60,-6,45,-16,-15,-17,-18,-8,49,-60,69,-53,45,-54,-11,-14,-9,-59,-37,-13,82,-55,-10,-38,87,-12,-39,90,49,-48,49,-40,-41,96,98,99,-42,-43,-50,-44,104,-56,106,-45,-52,-46,]),'CODE':([0,1,2,3,4,5,8,9,11,22,23,25,26,27,28,35,40,41,43,44,45,46,48,55,61,62,64,71,77,81,],[11,11,-2,-3,-4,11,-22,-20,-21,-1,-5,46,-19,-22,-7,46,-6,46,-16,-15,-17,-18,-8,46,-11,-14,-9,-13,-10,-12,]),'IDIOOPEN':([0,1,2,3,4,8,22,23,28,40,48,61,64,71,77,81,],[21,21,-2,-3,-4,21,-1,-5,-7,-6,-8,-11,-9,-13,-10,-12,]),'$end':([1,2,3,4,22,23,28,40,48,61,64,71,77,81,],[0,-2,-3,-4,-1,-5,-7,-6,-8,-11,-9,-13,-10,-12,]),'AT':([7,35,],[31,31,]),'WORD':([7,25,30,33,34,35,41,42,43,44,45,46,49,52,55,56,58,62,69,74,75,80,87,96,99,106,],[32,43,51,-57,-58,43,43,63,-16,-15,-17,-18,65,68,43,72,73,-14,32,84,32,32,65,101,32,65,]),'DBLQUOTE':([7,32,35,50,51,58,65,68,69,72,85,86,88,],[33,-60,33,33,33,33,-59,33,33,33,33,33,33,]),'SGLQUOTE':([7,32,35,50,51,58,65,68,69,72,85,86,88,],[34,-60,34,34,34,34,-59,34,34,34,34,34,34,]),'EXP':([21,31,],[38,53,]),'END':([21,31,33,34,75,],[39,54,-57,-58,86,]),'AMP':([25,],[42,]),'COLONS':([30,33,34,56,58,],[52,-57,-58,52,74,]),'IDIOCLOSE':([33,34,39,60,73,82,84,90,92,96,98,101,104,],[-57,-58,59,76,83,89,91,95,97,100,102,105,107,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'entries':([0,],[1,]),'entry':([0,1,],[2,22,]),'falsestart':([0,1,],[4,4,]),'codes':([0,1,],[5,5,]),'idioline':([0,1,],[6,6,]),'codon':([0,1,5,],[9,9,26,]),'idio':([0,1,8,],[10,10,36,]),'export':([0,1,8,],[12,12,12,]),'exportq':([0,1,8,],[13,13,13,]),'exportql':([0,1,8,],[14,14,14,]),'sectionstart':([0,1,8,],[15,15,15,]),'closedcomment':([0,1,8,],[16,16,16,]),'closedcommentlevels':([0,1,8,],[17,17,17,]),'closedcommentq':([0,1,8,],[18,18,18,]),'closedcommentql':([0,1,8,],[19,19,19,]),'end':([0,1,8,],[20,20,20,]),'inlineidio':([5,],[24,]),'words':([7,30,69,75,80,99,],[29,50,79,85,88,103,]),'quote':([7,35,50,51,58,68,69,72,85,86,88,],[30,56,66,67,75,78,80,67,92,93,94,]),'anythings':([25,35,],[41,55,]),'anything':([25,35,41,55,],[44,44,62,62,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> entries","S'",1,None,None,None),
+  ('entries -> entries entry','entries',2,'p_main','id.py',353),
+  ('entries -> entry','entries',1,'p_main','id.py',354),
+  ('entry -> NEWLINE','entry',1,'p_entry','id.py',358),
+  ('entry -> falsestart','entry',1,'p_entry','id.py',359),
+  ('entry -> codes NEWLINE','entry',2,'p_entry','id.py',360),
+  ('entry -> codes inlineidio NEWLINE','entry',3,'p_entry','id.py',361),
+  ('entry -> idioline NEWLINE','entry',2,'p_entry','id.py',362),
+  ('falsestart -> IDIO words NEWLINE','falsestart',3,'p_sectionfalsestart','id.py',379),
+  ('falsestart -> IDIO words IDIO NEWLINE','falsestart',4,'p_sectionfalsestart','id.py',380),
+  ('falsestart -> IDIO quote words quote NEWLINE','falsestart',5,'p_sectionfalsestart','id.py',381),
+  ('falsestart -> codes IDIO anythings NEWLINE','falsestart',4,'p_sectionfalsestart','id.py',382),
+  ('falsestart -> WHITESPACE IDIO anythings IDIO NEWLINE','falsestart',5,'p_sectionfalsestart','id.py',383),
+  ('falsestart -> WHITESPACE IDIO anythings NEWLINE','falsestart',4,'p_sectionfalsestart','id.py',384),
+  ('anythings -> anythings anything','anythings',2,'p_anythings','id.py',388),
+  ('anythings -> anything','anythings',1,'p_anythings','id.py',389),
+  ('anything -> WORD','anything',1,'p_anything','id.py',393),
+  ('anything -> WHITESPACE','anything',1,'p_anything','id.py',394),
+  ('anything -> CODE','anything',1,'p_anything','id.py',395),
+  ('codes -> codes codon','codes',2,'p_codes','id.py',399),
+  ('codes -> codon','codes',1,'p_codes','id.py',400),
+  ('codon -> CODE','codon',1,'p_codon','id.py',410),
+  ('codon -> WHITESPACE','codon',1,'p_codon','id.py',411),
+  ('inlineidio -> IDIO AMP WORD','inlineidio',3,'p_inlineidio','id.py',415),
+  ('idioline -> idio','idioline',1,'p_idioline','id.py',419),
+  ('idioline -> idio WHITESPACE','idioline',2,'p_idioline','id.py',420),
+  ('idioline -> WHITESPACE idio','idioline',2,'p_idioline','id.py',421),
+  ('idioline -> WHITESPACE idio WHITESPACE','idioline',3,'p_idioline','id.py',422),
+  ('idio -> export','idio',1,'p_linecontent','id.py',426),
+  ('idio -> exportq','idio',1,'p_linecontent','id.py',427),
+  ('idio -> exportql','idio',1,'p_linecontent','id.py',428),
+  ('idio -> sectionstart','idio',1,'p_linecontent','id.py',429),
+  ('idio -> closedcomment','idio',1,'p_linecontent','id.py',430),
+  ('idio -> closedcommentlevels','idio',1,'p_linecontent','id.py',431),
+  ('idio -> closedcommentq','idio',1,'p_linecontent','id.py',432),
+  ('idio -> closedcommentql','idio',1,'p_linecontent','id.py',433),
+  ('idio -> end','idio',1,'p_linecontent','id.py',434),
+  ('sectionstart -> IDIO quote WORD quote','sectionstart',4,'p_sectionstart','id.py',439),
+  ('sectionstart -> IDIO quote COLONS WORD quote','sectionstart',5,'p_sectionstart','id.py',440),
+  ('closedcomment -> IDIOOPEN EXP WHITESPACE WORD IDIOCLOSE','closedcomment',5,'p_closed_comment','id.py',450),
+  ('closedcomment -> IDIOOPEN EXP WHITESPACE WORD WHITESPACE IDIOCLOSE','closedcomment',6,'p_closed_comment','id.py',451),
+  ('closedcommentlevels -> IDIOOPEN EXP WHITESPACE COLONS WORD IDIOCLOSE','closedcommentlevels',6,'p_closed_comment_levels','id.py',456),
+  ('closedcommentlevels -> IDIOOPEN EXP WHITESPACE COLONS WORD WHITESPACE IDIOCLOSE','closedcommentlevels',7,'p_closed_comment_levels','id.py',457),
+  ('closedcommentq -> IDIOOPEN EXP WHITESPACE quote words quote IDIOCLOSE','closedcommentq',7,'p_closed_comment_quoted','id.py',462),
+  ('closedcommentq -> IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE IDIOCLOSE','closedcommentq',8,'p_closed_comment_quoted','id.py',463),
+  ('closedcommentql -> IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE WORD IDIOCLOSE','closedcommentql',9,'p_closed_comment_quoted_with_language','id.py',468),
+  ('closedcommentql -> IDIOOPEN EXP WHITESPACE quote words quote WHITESPACE WORD WHITESPACE IDIOCLOSE','closedcommentql',10,'p_closed_comment_quoted_with_language','id.py',469),
+  ('export -> IDIO AT EXP WHITESPACE words','export',5,'p_export','id.py',475),
+  ('export -> IDIO AT EXP WHITESPACE words WHITESPACE','export',6,'p_export','id.py',476),
+  ('exportq -> IDIO AT EXP WHITESPACE quote words quote','exportq',7,'p_export_quoted','id.py',481),
+  ('exportq -> IDIO AT EXP WHITESPACE quote words quote WHITESPACE','exportq',8,'p_export_quoted','id.py',482),
+  ('exportql -> IDIO AT EXP WHITESPACE quote words quote WHITESPACE words','exportql',9,'p_export_quoted_with_language','id.py',487),
+  ('exportql -> IDIO AT EXP WHITESPACE quote words quote WHITESPACE words WHITESPACE','exportql',10,'p_export_quoted_with_language','id.py',488),
+  ('end -> IDIO AT END','end',3,'p_end','id.py',493),
+  ('end -> IDIOOPEN END IDIOCLOSE','end',3,'p_end','id.py',494),
+  ('end -> IDIOOPEN END WHITESPACE IDIOCLOSE','end',4,'p_end','id.py',495),
+  ('end -> IDIOOPEN EXP WHITESPACE quote END quote WHITESPACE IDIOCLOSE','end',8,'p_end','id.py',496),
+  ('quote -> DBLQUOTE','quote',1,'p_quote','id.py',500),
+  ('quote -> SGLQUOTE','quote',1,'p_quote','id.py',501),
+  ('words -> words WHITESPACE WORD','words',3,'p_words','id.py',505),
+  ('words -> WORD','words',1,'p_words','id.py',506),
+]
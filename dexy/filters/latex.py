@@ -37,13 +37,14 @@ class LatexFilter(SubprocessFilter):
 
         def run_cmd(command):
             self.log_debug("running %s in %s" % (command, os.path.abspath(wd)))
-            proc = subprocess.Popen(command, shell=True,
-                                    cwd=wd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    env=env)
-
-            stdout, stderr = proc.communicate()
+            with self.executable_semaphore():
+                proc = subprocess.Popen(command, shell=True,
+                                        cwd=wd,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=env)
+
+                stdout, stderr = proc.communicate()
             self.log_debug(stdout)
 
         if bibtex_command and self.setting('run-bibtex'):
@@ -104,13 +105,14 @@ class TikzPdfFilter(LatexFilter):
 
         def run_cmd(command):
             self.log_debug("about to run %s in %s" % (command, os.path.abspath(wd)))
-            proc = subprocess.Popen(command, shell=True,
-                                    cwd=wd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT,
-                                    env=self.setup_env())
-
-            stdout, stderr = proc.communicate()
+            with self.executable_semaphore():
+                proc = subprocess.Popen(command, shell=True,
+                                        cwd=wd,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        env=self.setup_env())
+
+                stdout, stderr = proc.communicate()
 
             if proc.returncode > 2: # Set at 2 for now as this is highest I've hit, better to detect whether PDF has been generated?
                 raise dexy.exceptions.UserFeedback("latex error, look for information in %s" %
@@ -2,8 +2,10 @@ from dexy.exceptions import InternalDexyProblem
 from dexy.exceptions import UserFeedback
 from dexy.exceptions import InactivePlugin
 from dexy.filters.process import SubprocessFilter
+import atexit
 import re
 import os
+import threading
 
 try:
     import pexpect
@@ -14,10 +16,90 @@ except ImportError:
 class DexyEOFException(UserFeedback):
     pass
 
+class ReplPool(object):
+    """
+    Keeps REPL processes started ahead of time, so a document can check out
+    one which has already got through its startup instead of waiting for a
+    new interpreter to start.
+
+    Processes are keyed by executable, environment and working dir. Each
+    process is used by one document and then closed, so no state is shared
+    between documents, and when a process is checked out a replacement is
+    started to keep size processes warm for each key. Spares which are left
+    over are closed at the end of the run.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.spares = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def checkout(self, key, spawn):
+        """
+        Returns a warm process for key if there is one, otherwise a new one
+        from calling spawn, and starts processes to replace it.
+        """
+        with self.lock:
+            spares = self.spares.setdefault(key, [])
+            proc = None
+            while spares and proc is None:
+                proc = spares.pop(0)
+                if not proc.isalive():
+                    proc = None
+
+            if proc is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if proc is None:
+            proc = spawn()
+
+        with self.lock:
+            needed = self.size - len(spares)
+        new_spares = [spawn() for i in range(needed)]
+        with self.lock:
+            spares.extend(new_spares)
+
+        return proc
+
+    def close(self):
+        with self.lock:
+            for spares in self.spares.values():
+                for proc in spares:
+                    try:
+                        proc.close(force=True)
+                    except pexpect.ExceptionPexpect:
+                        pass
+            self.spares = {}
+
+_repl_pools = {}
+
+def repl_pool(size):
+    """
+    Returns the REPL pool for the current process, pools aren't shared with
+    forked worker processes.
+    """
+    pool = _repl_pools.get(os.getpid())
+    if pool is None:
+        pool = ReplPool(size)
+        _repl_pools[os.getpid()] = pool
+    pool.size = size
+    return pool
+
+def close_repl_pools():
+    pool = _repl_pools.pop(os.getpid(), None)
+    if pool is not None:
+        pool.close()
+
+atexit.register(close_repl_pools)
+
 class PexpectReplFilter(SubprocessFilter):
     """
     Use pexpect to retrieve output line-by-line based on detecting prompts.
     """
+    uses_repl_pool = True
     _settings = {
             'trim-prompt' : ("The closing prompt to be trimmed off.", '>>>'),
             'send-line-ending' : ("Line ending to transmit at the end of each input line.", "\n"),
@@ -35,6 +117,8 @@ class PexpectReplFilter(SubprocessFilter):
             'strip-regex' : ("Regex to strip", None),
             'data-type' : 'sectioned',
             'allow-match-prompt-without-newline' : ("Whether to require a newline before prompt.", False),
+            'batch-send' : ("Whether to send all the lines of a section at once and then match a prompt for each line, instead of waiting for each prompt before sending the next line. Only for REPLs which echo each line as they read it, like those using readline.", False),
+            'chdir-command' : ("Command to change the REPL's working dir, formatted with the dir using %. Lets REPLs started ahead of time in the project root be used for documents which run in their own working dir.", None),
             }
 
     def is_active(klass):
@@ -77,6 +161,73 @@ class PexpectReplFilter(SubprocessFilter):
     def strip_newlines(self, line):
         return line.replace(" \r", "")
 
+    def spawn(self, executable, wd, env):
+        self.log_debug("about to spawn new process '%s' in '%s'" % (executable, wd))
+        try:
+            return pexpect.spawn(
+                    executable,
+                    cwd=wd,
+                    env=env)
+        except pexpect.ExceptionPexpect as e:
+            if "The command was not found" in str(e):
+                raise InactivePlugin(self)
+            else:
+                raise
+
+    def capture_initial_prompt(self, proc, search_terms, initial_timeout):
+        """
+        Waits for the REPL's first prompt, returns the text received up to
+        and including the prompt.
+        """
+        initial_prompt = self.setting('initial-prompt')
+        try:
+            if initial_prompt:
+                proc.expect(initial_prompt, timeout=initial_timeout)
+            elif self.setting('prompt-regex'):
+                proc.expect(search_terms, timeout=initial_timeout)
+            else:
+                proc.expect_exact(search_terms, timeout=initial_timeout)
+
+        except pexpect.TIMEOUT:
+            if self.setting('initial-prompt'):
+                match = self.setting('initial-prompt')
+            else:
+                match = search_terms
+
+            msg = "%s failed at matching initial prompt within %s seconds. " % (self.__class__.__name__, initial_timeout)
+            msg += "Received '%s', tried to match with '%s'" % (proc.before, match)
+            msg += "\nExact characters received:\n"
+            for i, c in enumerate(str(proc.before)):
+                msg += "chr %02d: %s\n" % (i, ord(c))
+            msg += "The developer might need to set a longer initial prompt timeout or the regexp may be wrong."
+            raise InternalDexyProblem(msg)
+
+        return proc.before.decode('utf-8') + proc.after.decode('utf-8')
+
+    def expect_prompt(self, proc, search_terms, timeout):
+        try:
+            if self.setting('prompt-regex'):
+                proc.expect(search_terms, timeout=timeout)
+            else:
+                proc.expect_exact(search_terms, timeout=timeout)
+        except Exception:
+            raise
+        except pexpect.EOF:
+            self.log_debug("EOF occurred!")
+            raise DexyEOFException()
+        except pexpect.TIMEOUT:
+            for c in str(proc.before):
+                print(ord(c), ":", c)
+            msg = "pexpect timeout error. failed at matching prompt within %s seconds. " % timeout
+            msg += "received '%s', tried to match with '%s'" % (proc.before, search_terms)
+            msg += "something may have gone wrong, or you may need to set a longer timeout"
+            self.log_warn(msg)
+            raise UserFeedback(msg)
+        except pexpect.ExceptionPexpect as e:
+            raise UserFeedback(str(e))
+        except pexpect.EOF as e:
+            raise UserFeedback(str(e))
+
     def section_output(self):
         """
         Runs the code in sections and returns an iterator so we can do custom stuff.
@@ -134,84 +285,53 @@ class PexpectReplFilter(SubprocessFilter):
             wd = os.getcwd()
 
         executable = self.setting('executable')
-        self.log_debug("about to spawn new process '%s' in '%s'" % (executable, wd))
 
-        # Spawn the process
-        try:
-            proc = pexpect.spawn(
-                    executable,
-                    cwd=wd,
-                    env=env)
-        except pexpect.ExceptionPexpect as e:
-            if "The command was not found" in str(e):
-                raise InactivePlugin(self)
-            else:
-                raise
+        # Warm processes start in the project root, so can only be used for
+        # documents which run there or if the REPL can change its dir.
+        pool = repl_pool(self.doc.wrapper.repl_pool)
+        root = os.getcwd()
+        chdir_command = None
+        if pool.size and wd != root and self.setting('chdir-command'):
+            chdir_command = self.setting('chdir-command') % wd
+
+        if pool.size and (wd == root or chdir_command):
+            key = (executable, root, tuple(sorted(env.items())))
+            proc = pool.checkout(key, lambda: self.spawn(executable, root, env))
+        else:
+            proc = self.spawn(executable, wd, env)
 
         self.log_debug("Capturing initial prompt...")
-        initial_prompt = self.setting('initial-prompt')
-        try:
-            if initial_prompt:
-                proc.expect(initial_prompt, timeout=initial_timeout)
-            elif self.setting('prompt-regex'):
-                proc.expect(search_terms, timeout=initial_timeout)
-            else:
-                proc.expect_exact(search_terms, timeout=initial_timeout)
-
-        except pexpect.TIMEOUT:
-            if self.setting('initial-prompt'):
-                match = self.setting('initial-prompt')
-            else:
-                match = search_terms
-
-            msg = "%s failed at matching initial prompt within %s seconds. " % (self.__class__.__name__, initial_timeout)
-            msg += "Received '%s', tried to match with '%s'" % (proc.before, match)
-            msg += "\nExact characters received:\n"
-            for i, c in enumerate(str(proc.before)):
-                msg += "chr %02d: %s\n" % (i, ord(c))
-            msg += "The developer might need to set a longer initial prompt timeout or the regexp may be wrong."
-            raise InternalDexyProblem(msg)
-
-        start = proc.before.decode('utf-8') + proc.after.decode('utf-8')
+        start = self.capture_initial_prompt(proc, search_terms, initial_timeout)
 
         self.log_debug("Initial prompt captured!")
 
+        if chdir_command:
+            # Output isn't added to the transcript.
+            self.log_debug("Changing working dir to '%s'" % wd)
+            proc.send(chdir_command + self.setting('send-line-ending'))
+            self.expect_prompt(proc, search_terms, timeout)
+
         for section_key, section_text in input_sections:
             section_transcript = start
             start = ""
 
             lines = self.lines_for_section(section_text)
+            send_line_ending = self.setting('send-line-ending')
+            if self.setting('batch-send'):
+                self.log_debug("Sending %s lines" % len(lines))
+                proc.send("".join(l.rstrip() + send_line_ending for l in lines))
+
             for l in lines:
-                self.log_debug("Sending '%s'" % l)
                 section_transcript += start
-                proc.send(l.rstrip() + self.setting('send-line-ending'))
-                try:
-                    if self.setting('prompt-regex'):
-                        proc.expect(search_terms, timeout=timeout)
-                    else:
-                        proc.expect_exact(search_terms, timeout=timeout)
-
-                    self.log_debug("Received '%s'" % (proc.before.decode('utf-8')))
-
-                    section_transcript += self.strip_newlines(proc.before.decode('utf-8'))
-                    start = proc.after.decode('utf-8')
-                except Exception:
-                    raise
-                except pexpect.EOF:
-                    self.log_debug("EOF occurred!")
-                    raise DexyEOFException()
-                except pexpect.TIMEOUT:
-                    for c in str(proc.before):
-                        print(ord(c), ":", c)
-                    msg = "pexpect timeout error. failed at matching prompt within %s seconds. " % timeout
-                    msg += "received '%s', tried to match with '%s'" % (proc.before, search_terms)
-                    msg += "something may have gone wrong, or you may need to set a longer timeout"
-                    self.log_warn(msg)
-                    raise UserFeedback(msg)
-                except pexpect.ExceptionPexpect as e:
-                    raise UserFeedback(str(e))
-                except pexpect.EOF as e:
-                    raise UserFeedback(str(e))
+                if not self.setting('batch-send'):
+                    self.log_debug("Sending '%s'" % l)
+                    proc.send(l.rstrip() + send_line_ending)
+                self.expect_prompt(proc, search_terms, timeout)
+
+                self.log_debug("Received '%s'" % (proc.before.decode('utf-8')))
+
+                section_transcript += self.strip_newlines(proc.before.decode('utf-8'))
+                start = proc.after.decode('utf-8')
 
             if self.setting('strip-regex'):
                 section_transcript = re.sub(self.setting('strip-regex'), "", section_transcript)
@@ -235,10 +355,13 @@ class PexpectReplFilter(SubprocessFilter):
         self.log_debug("about to populate_workspace")
         self.populate_workspace()
 
-        for section_name, section_transcript in self.section_output():
-            text = self.strip_trailing_prompts(section_transcript)
-            self.log_debug("About to append section %s" % section_name)
-            self.output_data[section_name] = text
+        # The REPL runs for the whole of section_output, so hold the
+        # max-concurrent semaphore until it's done.
+        with self.executable_semaphore():
+            for section_name, section_transcript in self.section_output():
+                text = self.strip_trailing_prompts(section_transcript)
+                self.log_debug("About to append section %s" % section_name)
+                self.output_data[section_name] = text
 
         self.output_data.save()
 
@@ -260,7 +383,8 @@ class IpythonPexpectReplFilter(PexpectReplFilter):
             'tags' : ['python', 'repl', 'code'],
             'input-extensions' : [".txt", ".py"],
             'output-extensions' : [".pycon"],
-            'version-command' : 'ipython -Version'
+            'version-command' : 'ipython -Version',
+            'chdir-command' : "import os as dexy__os; dexy__os.chdir(%r); del dexy__os"
             }
 
     def is_active(klass):
@@ -312,6 +436,7 @@ class PythonConsole(PexpectReplFilter):
             'input-extensions' : [".txt", ".py"],
             'output-extensions' : ['.pycon'],
             'version-command' : 'python --version',
+            'chdir-command' : "import os as dexy__os; dexy__os.chdir(%r); del dexy__os",
             'save-vars-to-json-cmd' : """import json
 with open("%s-vars.json", "w") as dexy__vars_file:
     dexy__x = {}
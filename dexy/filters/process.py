@@ -2,9 +2,33 @@ from dexy.filter import Filter
 from dexy.utils import file_exists
 import dexy.exceptions
 import fnmatch
+import multiprocessing
 import os
 import platform
 import subprocess
+import threading
+
+# Semaphores limiting how many copies of each executable run at once, shared
+# by worker threads and by worker processes forked after they are created.
+# Keyed by executable and limit, so a changed max-concurrent setting, e.g. in
+# a later dexy watch run, takes effect.
+executable_semaphores = {}
+executable_semaphores_lock = threading.Lock()
+
+def semaphore_for_executable(executable, max_concurrent):
+    key = (executable, max_concurrent)
+    with executable_semaphores_lock:
+        if not key in executable_semaphores:
+            semaphore = multiprocessing.BoundedSemaphore(max_concurrent)
+            executable_semaphores[key] = semaphore
+        return executable_semaphores[key]
+
+class NullSemaphore(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, type, value, traceback):
+        pass
 
 class SubprocessFilter(Filter):
     """
@@ -17,6 +41,7 @@ class SubprocessFilter(Filter):
             'clargs' : ("Arguments to be passed to the executable (same as 'args').", ''),
             'command-string' : ("The full command string.", """%(prog)s %(args)s "%(script_file)s" %(scriptargs)s "%(output_file)s" """),
             'make-dummy-output' : ("Whether to make a dummy output file when one is not generated and add-new-files is True.", False),
+            'max-concurrent' : ("Maximum number of copies of this executable to run at the same time when running in parallel.", None),
             'env' : ("Dictionary of key-value pairs to be added to environment for runs.", {}),
             'executable' : ('The executable to be run', None),
             'initial-timeout' : ('', 10),
@@ -109,8 +134,20 @@ class SubprocessFilter(Filter):
     def setup_initial_timeout(self):
         return self.setting('initial-timeout')
 
+    def executable_semaphore(self):
+        """
+        Returns a semaphore to hold while running this filter's executable,
+        which enforces the max-concurrent setting across workers.
+        """
+        max_concurrent = self.setting('max-concurrent')
+        if max_concurrent:
+            executable = self.setting('executable') or self.alias
+            return semaphore_for_executable(executable, int(max_concurrent))
+        else:
+            return NullSemaphore()
+
     def setup_env(self):
-        env = os.environ
+        env = dict(os.environ)
 
         env.update(self.setting('env'))
 
@@ -249,18 +286,20 @@ class SubprocessFilter(Filter):
             wd = os.getcwd()
 
         self.log_debug("about to run '%s' in '%s'" % (command, os.path.abspath(wd)))
-        proc = subprocess.Popen(command, shell=True,
-                                    cwd=wd,
-                                    stdin=stdin,
-                                    stdout=stdout,
-                                    stderr=stderr,
-                                    env=env)
-
-        if input_text:
-            self.log_debug("about to send input_text '%s'" % input_text)
-            stdout, stderr = proc.communicate(input_text.encode())
-        else:
-            stdout, stderr = proc.communicate()
+        tracer = self.doc.wrapper.tracer
+        with self.executable_semaphore(), tracer.span("subprocess", "subprocess", self.doc.key, command=command):
+            proc = subprocess.Popen(command, shell=True,
+                                        cwd=wd,
+                                        stdin=stdin,
+                                        stdout=stdout,
+                                        stderr=stderr,
+                                        env=env)
+
+            if input_text:
+                self.log_debug("about to send input_text '%s'" % input_text)
+                stdout, stderr = proc.communicate(input_text.encode())
+            else:
+                stdout, stderr = proc.communicate()
 
         self.log_debug("stdout is '%s'" % stdout.decode('utf-8'))
 
@@ -6,12 +6,21 @@ from pygments.formatters import LatexFormatter
 from pygments.formatters import get_formatter_for_filename
 from pygments.lexers import LEXERS as PYGMENTS_LEXERS
 from pygments.lexers import get_lexer_by_name
+import concurrent.futures
 import dexy.commands
 import dexy.exceptions
+import hashlib
+import json
+import multiprocessing
+import os
 import posixpath
 import pygments.lexers.web
+import sqlite3
+import threading
+import time
 
 pygments_lexer_cache = {}
+pygments_formatter_class_cache = {}
 
 file_ext_to_lexer_alias_cache = {
         '.pycon' : 'pycon',
@@ -28,6 +37,127 @@ for module_name, name, aliases, file_extensions, _ in list(PYGMENTS_LEXERS.value
         ext = ext.lstrip("*")
         file_ext_to_lexer_alias_cache[ext] = alias
 
+def highlight_text(text, lexer, formatter):
+    return highlight(text, lexer, formatter)
+
+class HighlightCache(object):
+    """
+    Persistent cache of highlighted text, keyed by a hash of the pygments
+    version, lexer and formatter classes and options, and the text. Stored in
+    a sqlite database in the artifacts dir, so entries are kept between runs
+    and shared with worker processes. The time each entry was last used is
+    recorded, so collect_garbage can remove entries which are no longer used.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.conn = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        if self.pid != os.getpid():
+            # Connections can't be used after a fork.
+            self.conn = sqlite3.connect(self.filepath, timeout=60,
+                    check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS highlights (key TEXT PRIMARY KEY, output BLOB, used REAL)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(highlights)")]
+            if not 'used' in columns:
+                # Created by an older dexy version.
+                self.conn.execute("ALTER TABLE highlights ADD COLUMN used REAL")
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
+
+    def key(self, prefix, text):
+        h = hashlib.sha256(prefix.encode('utf-8'))
+        h.update(text.encode('utf-8', 'surrogatepass'))
+        return h.hexdigest()
+
+    def get(self, keys):
+        """
+        Returns a dict of the outputs stored for any of keys.
+        """
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            conn = self.connect()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i+500]
+                sql = "SELECT key, output FROM highlights WHERE key IN (%s)"
+                sql = sql % ", ".join("?" for k in batch)
+                found.update(conn.execute(sql, batch).fetchall())
+
+            if found:
+                used = [(time.time(), key) for key in found]
+                conn.executemany("UPDATE highlights SET used = ? WHERE key = ?", used)
+                conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, items):
+        """
+        Stores a dict of outputs by key in one transaction.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            conn.executemany("INSERT OR REPLACE INTO highlights VALUES (?, ?, ?)",
+                    [(key, output, now) for key, output in items.items()])
+            conn.commit()
+
+    def collect_garbage(self, unused_since, vacuum=False):
+        """
+        Removes entries which haven't been used since unused_since, returning
+        the number removed. If vacuum is set, the database file is also
+        compacted.
+        """
+        with self.lock:
+            conn = self.connect()
+            cursor = conn.execute(
+                    "DELETE FROM highlights WHERE used IS NULL OR used < ?",
+                    (unused_since,))
+            conn.commit()
+            if vacuum:
+                conn.execute("VACUUM")
+        return cursor.rowcount
+
+highlight_caches = {}
+
+def highlight_cache(wrapper):
+    filepath = os.path.abspath(os.path.join(wrapper.artifacts_dir, "highlight.sqlite3"))
+    if not filepath in highlight_caches:
+        highlight_caches[filepath] = HighlightCache(filepath)
+    return highlight_caches[filepath]
+
+highlight_pools = {}
+
+def highlight_pool(processes):
+    """
+    Returns a process pool for highlighting, kept for later documents. Each
+    process, including forked worker processes, has its own pool.
+    """
+    key = (os.getpid(), processes)
+    if not key in highlight_pools:
+        # Don't fork, this process may be running other threads such as the
+        # background writer or -threads workers.
+        context = multiprocessing.get_context(pool_start_method())
+        highlight_pools[key] = concurrent.futures.ProcessPoolExecutor(
+                processes, mp_context=context)
+    return highlight_pools[key]
+
+def pool_start_method():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return 'forkserver'
+    else:
+        return 'spawn'
+
 class SyntaxHighlightMarkdownFilter(DexyFilter):
     """
     Surrounds code with highlighting instructions for Markdown
@@ -143,6 +273,15 @@ class PygmentsFilter(DexyFilter):
             'linenos' : ("""Whether to include line numbers. May be set to
                 'table' or 'inline'.""", None),
             'line-numbers' : ("""Alternative name for 'linenos'.""", None),
+            'cache' : ("""Whether to keep highlighted sections in a cache
+                which persists between runs, so unchanged sections aren't
+                highlighted again.""", True),
+            'processes' : ("""Number of processes to highlight sections in,
+                for documents with at least min-parallel-sections sections
+                which aren't cached. If 0, sections are highlighted in this
+                process.""", 0),
+            'min-parallel-sections' : ("""Number of sections to highlight
+                which makes it worth sending them to other processes.""", 20),
             }
 
     lexer_cache = {}
@@ -250,7 +389,91 @@ class PygmentsFilter(DexyFilter):
             formatter_args['style'] = self.setting('style')
         self.log_debug("creating pygments formatter with args %s" % (formatter_args))
 
-        return get_formatter_for_filename(self.output_data.name, **formatter_args)
+        ext = posixpath.splitext(self.output_data.name)[1]
+        if ext in pygments_formatter_class_cache:
+            return pygments_formatter_class_cache[ext](**formatter_args)
+        else:
+            formatter = get_formatter_for_filename(self.output_data.name, **formatter_args)
+            pygments_formatter_class_cache[ext] = formatter.__class__
+            return formatter
+
+    def cache_key_prefix(self, lexer, formatter):
+        """
+        The parts of a highlight cache key which don't depend on the text.
+        """
+        info = [pygments.__version__,
+                lexer.__class__.__name__, lexer.options,
+                formatter.__class__.__name__, formatter.options]
+        return json.dumps(info, sort_keys=True, default=str)
+
+    def highlight_texts(self, texts, lexer, formatters):
+        """
+        Highlights a list of texts, each with the corresponding formatter, in
+        a process pool if there are enough of them and the processes setting
+        is set.
+        """
+        processes = self.setting('processes')
+        if processes and len(texts) >= self.setting('min-parallel-sections'):
+            self.log_debug("highlighting %s sections in %s processes" % (len(texts), processes))
+            n = len(texts)
+            chunksize = max(1, n // (processes * 4))
+            return list(highlight_pool(processes).map(highlight_text,
+                texts, [lexer] * n, formatters, chunksize=chunksize))
+        else:
+            return [highlight_text(text, lexer, formatter)
+                    for text, formatter in zip(texts, formatters)]
+
+    def highlight_all(self, texts, lexer, formatter, new_formatter=None):
+        """
+        Returns the highlighted output for each of texts, using the highlight
+        cache and only highlighting each distinct text once.
+
+        Formatters which keep state between calls to format(), such as
+        pygments' ImageFormatter, must not be shared between texts. For these,
+        pass new_formatter, which is called to create a formatter for each
+        text. Otherwise formatter is used for every text.
+        """
+        if self.setting('cache'):
+            cache = highlight_cache(self.doc.wrapper)
+            prefix = self.cache_key_prefix(lexer, formatter)
+            keys = [cache.key(prefix, text) for text in texts]
+            outputs = cache.get(set(keys))
+        else:
+            cache = None
+            keys = texts
+            outputs = {}
+
+        todo = {}
+        for key, text in zip(keys, texts):
+            if not key in outputs:
+                todo[key] = text
+
+        if todo:
+            todo_keys = list(todo)
+            if new_formatter:
+                formatters = [new_formatter() for key in todo_keys]
+            else:
+                formatters = [formatter] * len(todo_keys)
+            highlighted = self.highlight_texts(
+                    [todo[key] for key in todo_keys], lexer, formatters)
+            new_outputs = dict(zip(todo_keys, highlighted))
+            outputs.update(new_outputs)
+            if cache:
+                cache.put(new_outputs)
+
+        return [outputs[key] for key in keys]
+
+    def section_text(self, section_input):
+        try:
+            # If section_input is an instance of SectionValue then calling
+            # 'str' on this instance will call the __str__ method of
+            # SectionValue.
+            return str(section_input)
+        except UnicodeDecodeError:
+            if self.setting('allow-unprintable-input'):
+                return self.setting('unprintable-input-text')
+            else:
+                raise
 
     def process(self):
         if self.ext in self.IMAGE_OUTPUT_EXTENSIONS:
@@ -282,38 +505,29 @@ class PygmentsFilter(DexyFilter):
             lexer = self.create_lexer_instance()
 
             if self.ext in self.IMAGE_OUTPUT_EXTENSIONS:
-                # Place each section into an image.
-                for k, v in self.input_data.items():
-                    formatter = self.create_formatter_instance()
-                    output_for_section = highlight(str(v), lexer, formatter)
+                # Place each section into an image, and entire contents into
+                # main file.
+                formatter = self.create_formatter_instance()
+                sections = list(self.input_data.items())
+                texts = [str(v) for k, v in sections]
+                texts.append(str(self.input_data))
+                outputs = self.highlight_all(texts, lexer, formatter,
+                        self.create_formatter_instance)
+
+                for (k, v), output_for_section in zip(sections, outputs):
                     new_doc_name = "%s--%s%s" % (self.doc.key.replace("|", "--"), k, self.ext)
                     self.add_doc(new_doc_name, output_for_section)
 
-                # Place entire contents into main file.
-                formatter = self.create_formatter_instance()
                 self.update_all_args({'override-workspace-exclude-filters' : True })
                 with open(self.output_filepath(), 'wb') as f:
-                    f.write(highlight(str(self.input_data), lexer, formatter))
+                    f.write(outputs[-1])
 
             else:
                 formatter = self.create_formatter_instance()
-                for section_name, section_input in self.input_data.items():
-                    try:
-                        if isinstance(section_input, str):
-                            section_input = section_input
-                        else:
-                            # If section_input is an instance of
-                            # SectionValue then calling 'str' on this
-                            # instance will call the __str__ method of
-                            # SectionValue.
-                            section_input = str(section_input)
-                        section_output = highlight(section_input, lexer, formatter)
-                    except UnicodeDecodeError:
-                        if self.setting('allow-unprintable-input'):
-                            section_input = self.setting('unprintable-input-text')
-                            section_output = highlight(section_input, lexer, formatter)
-                        else:
-                            raise
+                sections = [(section_name, self.section_text(section_input))
+                        for section_name, section_input in self.input_data.items()]
+                outputs = self.highlight_all([text for name, text in sections],
+                        lexer, formatter)
+                for (section_name, text), section_output in zip(sections, outputs):
                     self.output_data[section_name] = section_output
                 self.output_data.save()
-
@@ -20,6 +20,7 @@ class PythonTest(PythonIntrospection):
     Many packages are installed without tests, so this won't work.
     """
     aliases = ['pytest']
+    changes_working_dir = True
     _settings = {
             'run-tests' : (
                 "Whether to run tests or just return test source code.",
@@ -38,6 +38,7 @@ class InlineAssets(DexyFilter):
     Imports any referenced images as data URIs.
     """
     aliases = ['inliner']
+    changes_working_dir = True
 
     _settings = {
             'html-parser' : ("Name of html parser BeautifulSoup should use.", 'html.parser'),
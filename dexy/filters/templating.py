@@ -5,9 +5,11 @@ from jinja2.exceptions import TemplateNotFound
 from jinja2.exceptions import TemplateSyntaxError
 from jinja2.exceptions import UndefinedError
 import dexy.exceptions
+import dexy.jinjaenv
 import jinja2
 import jinja2.ext
 import os
+import posixpath
 import re
 import traceback
 
@@ -32,6 +34,21 @@ class PassThroughWhitelistUndefined(jinja2.StrictUndefined):
         else:
             self._fail_with_undefined_error(*args, **kwargs)
 
+class WorkspaceLoader(FileSystemLoader):
+    """
+    FileSystemLoader which asks the filter to place a template in its
+    workspace before looking for it, for lazy workspaces.
+    """
+    def __init__(self, filter_instance, searchpath):
+        FileSystemLoader.__init__(self, searchpath)
+        self.filter_instance = filter_instance
+
+    def get_source(self, environment, template):
+        parent_dir = self.filter_instance.output_data.parent_dir()
+        filepath = posixpath.normpath(posixpath.join(parent_dir, template))
+        self.filter_instance.materialize_workspace_input(filepath)
+        return FileSystemLoader.get_source(self, environment, template)
+
 class TemplateFilter(DexyFilter):
     """
     Base class for templating system filters such as JinjaFilter. Templating
@@ -111,6 +128,7 @@ class JinjaFilter(TemplateFilter):
             'jinja-path' : ("List of additional directories to pass to jinja loader.", []),
             'jinja-extensions' : ("List of jinja extensions to activate.", ['jinja2.ext.do']),
             'workspace-includes' : [".jinja"],
+            'lazy-workspace' : True,
             'assertion-passed-indicator' : (
                 "Extra text to return with a passed assertion.",
                 ""),
@@ -125,6 +143,7 @@ class JinjaFilter(TemplateFilter):
             'changetags',
             'jinja-path',
             'workspace-includes',
+            'lazy-workspace',
             'filters',
             'assertion-passed-indicator',
             'jinja-extensions'
@@ -148,7 +167,11 @@ class JinjaFilter(TemplateFilter):
             'comment_end_string': '#>>'
             }
 
-    def setup_jinja_env(self, loader=None):
+    def jinja_env_attrs(self):
+        """
+        Returns the arguments to create a jinja Environment with, apart from
+        the loader.
+        """
         env_attrs = {}
 
         for k, v in self.setting_values().items():
@@ -172,9 +195,6 @@ class JinjaFilter(TemplateFilter):
                     self.log_debug("setting %s to %s" % (underscore_k, v))
                     env_attrs[underscore_k] = v
 
-        if loader:
-            env_attrs['loader'] = loader
-
         extensions = []
         for ext in self.setting('jinja-extensions'):
             self.log_debug("attempting to activate %s" % ext)
@@ -183,10 +203,37 @@ class JinjaFilter(TemplateFilter):
                 extensions.append(ref)
         env_attrs['extensions'] = extensions
 
+        return env_attrs
+
+    def setup_jinja_env(self, loader=None):
+        env_attrs = self.jinja_env_attrs()
+
+        if loader:
+            env_attrs['loader'] = loader
+
         debug_attr_string = ", ".join("%s: %r" % (k, v) for k, v in env_attrs.items())
         self.log_debug("creating jinja2 environment with: %s" % debug_attr_string)
         return jinja2.Environment(**env_attrs)
 
+    def jinja_environment(self, loader):
+        """
+        Returns a jinja environment with template filters which uses loader.
+        Environments are shared between documents with the same jinja
+        settings and filters, and compiled templates are cached on disk.
+        """
+        env_attrs = self.jinja_env_attrs()
+        key = ('jinja', sorted(env_attrs.items()), self.setting('filters'))
+
+        def create():
+            self.log_debug("creating jinja2 environment with: %s" % env_attrs)
+            env = jinja2.Environment(**env_attrs)
+            self.log_debug("setting up jinja template filters")
+            env.filters.update(self.jinja_template_filters())
+            return env
+
+        env = dexy.jinjaenv.environment(self.doc.wrapper, key, create)
+        return env.overlay(loader=loader)
+
     def handle_jinja_exception(self, e, input_text, template_data):
         result = []
         input_lines = input_text.splitlines()
@@ -267,12 +314,10 @@ class JinjaFilter(TemplateFilter):
         macro_dir = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'macros'))
         dirs = ['.', wd, os.path.dirname(self.doc.name), macro_dir] + self.setting('jinja-path')
         self.log_debug("setting up jinja FileSystemLoader with dirs %s" % ", ".join(dirs))
-        loader = FileSystemLoader(dirs)
+        loader = WorkspaceLoader(self, dirs)
 
         self.log_debug("setting up jinja environment")
-        env = self.setup_jinja_env(loader=loader)
-        self.log_debug("setting up jinja template filters")
-        env.filters.update(self.jinja_template_filters())
+        env = self.jinja_environment(loader)
 
         self.log_debug("initializing template")
 
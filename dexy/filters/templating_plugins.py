@@ -504,7 +504,8 @@ class PygmentsStylesheet(TemplatePlugin):
     def generate_stylesheets(self):
         pygments_stylesheets = {}
         if hasattr(self, 'filter_instance') and 'pygments' in self.filter_instance.doc.args:
-            formatter_args = self.filter_instance.doc.args['pygments']
+            # Copy, the doc's args may be shared with other docs.
+            formatter_args = dict(self.filter_instance.doc.args['pygments'])
         else:
             formatter_args = {}
 
@@ -0,0 +1,94 @@
+from jinja2 import FileSystemBytecodeCache
+import hashlib
+import os
+import threading
+
+_environments = {}
+_lock = threading.Lock()
+
+class BytecodeCache(FileSystemBytecodeCache):
+    """
+    Bytecode cache which updates the modification time of cache files when
+    they are used, so collect_garbage can remove files which aren't.
+    """
+    def load_bytecode(self, bucket):
+        FileSystemBytecodeCache.load_bytecode(self, bucket)
+        if bucket.code is not None:
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+def collect_garbage(wrapper, unused_since):
+    """
+    Removes compiled templates which haven't been used since unused_since,
+    returning the number of files removed.
+    """
+    jinja_dir = os.path.join(wrapper.artifacts_dir, "jinja")
+    if not os.path.exists(jinja_dir):
+        return 0
+
+    n = 0
+    for cache_dir in os.scandir(jinja_dir):
+        if cache_dir.is_dir():
+            for entry in os.scandir(cache_dir.path):
+                if entry.stat().st_mtime < unused_since:
+                    try:
+                        os.remove(entry.path)
+                        n += 1
+                    except FileNotFoundError:
+                        pass
+    return n
+
+def bytecode_cache_dir(wrapper, key):
+    """
+    Directory for templates compiled by environments with key. Jinja's
+    bytecode cache doesn't take settings like tags into account, so each
+    kind of environment needs its own directory.
+    """
+    digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+    return os.path.abspath(os.path.join(wrapper.artifacts_dir, "jinja", digest))
+
+def environment(wrapper, key, create):
+    """
+    Returns a jinja Environment shared by everything which passes the same
+    key, calling create to make it the first time. The key should include
+    everything the environment is created from.
+
+    Environments get a bytecode cache in the artifacts dir, so templates
+    which haven't changed aren't compiled again, even in later runs. Shared
+    environments must not be modified, use overlay() to get a copy with a
+    different loader.
+    """
+    cache_dir = bytecode_cache_dir(wrapper, key)
+
+    # The dir may have been removed by dexy reset or cleanup.
+    try:
+        os.makedirs(cache_dir)
+    except os.error:
+        pass
+
+    with _lock:
+        env = _environments.get(cache_dir)
+
+    if env is None:
+        env = create()
+        env.bytecode_cache = BytecodeCache(cache_dir)
+        with _lock:
+            env = _environments.setdefault(cache_dir, env)
+
+    return env
+
+def from_string(env, source, name):
+    """
+    Like env.from_string, but the compiled template is stored in env's
+    bytecode cache under name and used again while source is unchanged.
+    """
+    bcc = env.bytecode_cache
+    bucket = bcc.get_bucket(env, name, None, source)
+    code = bucket.code
+    if code is None:
+        code = env.compile(source, name)
+        bucket.code = code
+        bcc.set_bucket(bucket)
+    return env.template_class.from_code(env, code, env.make_globals(None))
@@ -4,10 +4,11 @@ import dexy.parsers
 import dexy.datas
 
 # Automatically register plugins in any python package named like dexy_*
-import pkg_resources
-for dist in pkg_resources.working_set:
-    if dist.key.startswith("dexy-"):
-        import_pkg = dist.egg_name().split("-")[0]
+import importlib.metadata
+for dist in importlib.metadata.distributions():
+    dist_name = (dist.metadata['Name'] or '').lower().replace("_", "-")
+    if dist_name.startswith("dexy-"):
+        import_pkg = dist_name.replace("-", "_")
         try:
             __import__(import_pkg)
         except ImportError as e:
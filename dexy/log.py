@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats each log record as a JSON object on a single line.
+    """
+    def format(self, record):
+        info = {
+                'time' : record.created,
+                'name' : record.name,
+                'level' : record.levelname,
+                'message' : record.getMessage()
+                }
+        if record.exc_info:
+            info['exception'] = self.formatException(record.exc_info)
+        return json.dumps(info)
+
+def log_formatter(log_format):
+    """
+    Returns a formatter for the log_format setting, which is either a logging
+    format string or 'json' for JSON lines.
+    """
+    if log_format == 'json':
+        return JsonLinesFormatter()
+    else:
+        return logging.Formatter(log_format)
+
+class QueuedLogWriter(object):
+    """
+    Sends records logged to logger to a queue, and writes them to handler from
+    a listener thread so the thread doing the logging doesn't wait on disk
+    writes.
+
+    Forked worker processes don't have the listener thread, so after a fork
+    the child writes to handler directly.
+    """
+    active = []
+
+    def __init__(self, logger, handler):
+        self.logger = logger
+        self.handler = handler
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+
+    def start(self):
+        # Only one writer per logger, records for old writers go to this one.
+        for writer in list(self.active):
+            if writer.logger is self.logger:
+                writer.close()
+
+        self.listener.start()
+        self.logger.addHandler(self.queue_handler)
+        self.active.append(self)
+
+    def flush(self):
+        """
+        Waits until all records logged so far have been written.
+        """
+        if self.listener:
+            self.listener.stop()
+            self.listener.start()
+        self.handler.flush()
+
+    def close(self):
+        if self in self.active:
+            self.active.remove(self)
+        self.logger.removeHandler(self.queue_handler)
+        self.logger.removeHandler(self.handler)
+        if self.listener:
+            self.listener.stop()
+        self.handler.close()
+
+    def write_directly(self):
+        self.listener = None
+        self.logger.removeHandler(self.queue_handler)
+        self.logger.addHandler(self.handler)
+
+    @classmethod
+    def after_fork_in_child(klass):
+        for writer in klass.active:
+            writer.write_directly()
+
+    @classmethod
+    def close_all(klass):
+        for writer in list(klass.active):
+            writer.close()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=QueuedLogWriter.after_fork_in_child)
+
+atexit.register(QueuedLogWriter.close_all)
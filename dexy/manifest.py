@@ -0,0 +1,167 @@
+import dexy.plugin
+import hashlib
+import os
+import pickle
+import sys
+
+# Version of the manifest format, change this if the format changes.
+MANIFEST_VERSION = 1
+
+def user_cache_dir():
+    """
+    Returns the directory for dexy's per-user cache files, following the XDG
+    base directory spec.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "dexy")
+
+def manifest_filepath(package_dir, name):
+    """
+    Returns the path in the user cache dir to save the manifest for the
+    package in package_dir to. The path depends on package_dir, so each
+    installation or checkout of dexy has its own manifest.
+    """
+    package_hash = hashlib.md5(os.path.abspath(package_dir).encode('utf-8')).hexdigest()
+    return os.path.join(user_cache_dir(), "%s-%s.pickle" % (name, package_hash[0:12]))
+
+def class_reference(klass):
+    """
+    Returns a 'module:ClassName' string which cashew can resolve to klass.
+    """
+    return "%s:%s" % (klass.__module__, klass.__name__)
+
+class PluginManifest(object):
+    """
+    Precomputed map of plugin aliases to the modules and classes which
+    implement them, so plugins can be registered without importing the
+    modules which define them. A module is only imported when one of its
+    plugins is first used.
+
+    The manifest is rebuilt, by importing every module, whenever any of the
+    modules or yaml files it was built from change. Yaml files are registered
+    with the first of the registries.
+
+    The manifest is saved to filepath, which should be outside package_dir
+    since installed packages often aren't writable.
+    """
+    def __init__(self, package_dir, filepath, modules, optional_modules, yaml_files, registries):
+        self.package_dir = package_dir
+        self.filepath = filepath
+        self.modules = modules
+        self.optional_modules = optional_modules
+        self.yaml_files = yaml_files
+        self.registries = registries
+
+    def source_files(self):
+        filepaths = list(self.yaml_files)
+        for modname in self.modules + self.optional_modules:
+            filepaths.append(self.module_filepath(modname))
+        return filepaths
+
+    def module_filepath(self, modname):
+        return os.path.join(self.package_dir, "%s.py" % modname.split(".")[-1])
+
+    def signature(self):
+        """
+        Returns a value which changes when any source of plugins changes.
+        """
+        from dexy.version import DEXY_VERSION
+        file_info = []
+        for filepath in self.source_files():
+            try:
+                stat = os.stat(filepath)
+                file_info.append((filepath, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                file_info.append((filepath, None, None))
+        return (MANIFEST_VERSION, DEXY_VERSION, sys.version_info[0:2], file_info)
+
+    def load(self):
+        """
+        Registers plugins from the saved manifest, rebuilding and saving it
+        first if it is missing or out of date.
+        """
+        signature = self.signature()
+
+        try:
+            with open(self.filepath, 'rb') as f:
+                info = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            info = None
+
+        if info is None or info['signature'] != signature:
+            info = self.build(signature)
+            self.save(info)
+        else:
+            for registry in self.registries:
+                self.register_entries(registry, info['entries'][class_reference(registry)])
+
+        # Try again in case optional dependencies have been installed since
+        # the manifest was built.
+        for modname in info['failed']:
+            self.import_module(modname)
+
+    def import_module(self, modname):
+        try:
+            __import__(modname)
+            return True
+        except (ImportError, NameError):
+            return False
+
+    def build(self, signature):
+        """
+        Imports all plugin modules and yaml files, and returns info about the
+        plugins they register.
+        """
+        for modname in self.modules:
+            __import__(modname)
+
+        failed = [modname for modname in self.optional_modules
+                if not self.import_module(modname)]
+
+        for yaml_file in self.yaml_files:
+            self.registries[0].register_plugins_from_yaml_file(yaml_file)
+
+        entries = {}
+        for registry in self.registries:
+            entries[class_reference(registry)] = self.registry_entries(registry)
+
+        return {'signature' : signature, 'entries' : entries, 'failed' : failed}
+
+    def registry_entries(self, registry):
+        """
+        Returns the aliases in the registry which come from the manifest's
+        modules and yaml files, with classes replaced by references to them.
+        """
+        package = self.package_dir
+        modnames = set(self.modules + self.optional_modules)
+
+        entries = {}
+        for alias, (class_or_class_name, settings) in registry.plugins.items():
+            if isinstance(class_or_class_name, type):
+                if class_or_class_name.__module__ in modnames:
+                    entries[alias] = (class_reference(class_or_class_name), settings)
+            elif settings.get('install-dir') == package:
+                entries[alias] = (class_or_class_name, settings)
+        return entries
+
+    def register_entries(self, registry, entries):
+        for alias, class_info in entries.items():
+            existing = registry.plugins.get(alias)
+            if existing and isinstance(existing[0], type):
+                # The module has already been imported.
+                continue
+            registry.plugins[alias] = class_info
+
+    def save(self, info):
+        tmp_filepath = "%s.%s.tmp" % (self.filepath, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+            with open(tmp_filepath, 'wb') as f:
+                pickle.dump(info, f)
+            os.replace(tmp_filepath, self.filepath)
+        except (IOError, OSError, pickle.PicklingError):
+            # Cache directory may not be writable, then we build each time.
+            try:
+                os.remove(tmp_filepath)
+            except OSError:
+                pass
@@ -4,7 +4,37 @@ import dexy.doc
 import dexy.plugin
 import fnmatch
 import json
+import logging
 import re
+import time
+
+def merge_input_closures(roots):
+    """
+    Returns a (bitset, list) tuple of roots and the nodes in their input
+    closures, which must already be cached, each node once and dependencies
+    before the nodes which depend on them.
+    """
+    mask = 0
+    ordered = []
+    seen = set()
+    for root in roots:
+        if root in seen:
+            continue
+
+        root_mask, root_closure = root._input_closure[1:]
+        if root_closure and (mask | root_mask) != mask:
+            # Only look through the closure if some of it hasn't been seen.
+            for node in root_closure:
+                if not node in seen:
+                    seen.add(node)
+                    ordered.append(node)
+            mask |= root_mask
+
+        seen.add(root)
+        ordered.append(root)
+        mask |= root.input_bit()
+
+    return mask, ordered
 
 class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
@@ -18,6 +48,9 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             ('new', 'uncached'),
             ('uncached', 'running'),
             ('running', 'ran'),
+            ('running', 'uncached'),
+            ('ran', 'uncached'),
+            ('consolidated', 'uncached'),
             )
 
     def __init__(self, pattern, wrapper, inputs=None, **kwargs):
@@ -43,6 +76,14 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
         self.state = 'new'
 
+        # Bit identifying this node in input closure bitsets, the cached
+        # (graph version, bitset, ordered list) closure of all inputs and
+        # children, and the cached (graph version, ordered list) result of
+        # walk_inputs.
+        self._input_bit = None
+        self._input_closure = None
+        self._walked_inputs = None
+
         # Class-specific setup.
         self.setup()
 
@@ -69,22 +110,71 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     def arg_value(self, key, default=None):
         return self.args.get(key, default) or self.args.get(key.replace("-", "_"), default)
 
-    def walk_inputs(self):
+    def input_bit(self):
+        if self._input_bit is None:
+            self._input_bit = 1 << self.wrapper.next_node_id()
+        return self._input_bit
+
+    def has_input_closure(self, version):
+        return self._input_closure is not None and self._input_closure[0] == version
+
+    def input_closure(self):
+        """
+        Returns a (bitset, list) tuple of all nodes which are inputs or
+        children of this node, or their inputs or children. The list has
+        each node once, dependencies before the nodes which depend on them.
+
+        Closures are cached until the graph changes, and calculated without
+        recursion so deep graphs don't hit the recursion limit.
+        """
+        version = self.wrapper.graph_version
+        if self.has_input_closure(version):
+            return self._input_closure[1:]
+
+        stack = [(self, iter(self.input_nodes()))]
+        visiting = set([self])
+        while stack:
+            node, remaining = stack[-1]
+            for child in remaining:
+                if not child.has_input_closure(version):
+                    if child in visiting:
+                        raise dexy.exceptions.CircularDependency(child.key)
+                    visiting.add(child)
+                    stack.append((child, iter(child.input_nodes())))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(node)
+                mask, ordered = merge_input_closures(node.input_nodes())
+                node._input_closure = (version, mask, ordered)
+
+        return self._input_closure[1:]
+
+    def input_mask(self):
         """
-        Yield all direct inputs and their inputs.
+        Returns a bitset of all nodes in this node's input closure.
         """
-        children = []
-        def walk(inputs):
-            for inpt in inputs:
-                children.append(inpt)
-                walk(inpt.inputs + inpt.children)
+        return self.input_closure()[0]
 
+    def walk_inputs(self):
+        """
+        Returns all direct inputs and their inputs and children, each node
+        once, dependencies before the nodes which depend on them. Cached
+        until the graph changes.
+        """
         if self.inputs:
-            walk(self.inputs)
+            version = self.wrapper.graph_version
+            if self._walked_inputs is None or self._walked_inputs[0] != version:
+                # Also caches the closures of all inputs.
+                ordered = self.input_closure()[1]
+                if self.children:
+                    ordered = merge_input_closures(self.inputs)[1]
+                self._walked_inputs = (version, ordered)
+            return list(self._walked_inputs[1])
         elif hasattr(self, 'parent'):
-            children = self.parent.walk_inputs()
-
-        return children
+            return self.parent.walk_inputs()
+        else:
+            return []
 
     def walk_input_docs(self):
         """
@@ -94,14 +184,25 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             if node.__class__.__name__ == 'Doc':
                 yield node
 
-    def log_debug(self, message):
-        self.wrapper.log.debug("(state:%s) %s %s: %s" % (self.wrapper.state, self.hashid, self.key_with_class(), message))
+    def log_message(self, message, args):
+        if args:
+            message = message % args
+        return "(state:%s) %s %s: %s" % (self.wrapper.state, self.hashid, self.key_with_class(), message)
 
-    def log_info(self, message):
-        self.wrapper.log.info("(state:%s) %s %s: %s" % (self.wrapper.state, self.hashid, self.key_with_class(), message))
+    def log_debug(self, message, *args):
+        """
+        Logs message at debug level. Any args are interpolated into message
+        only if debug messages are being logged.
+        """
+        if self.wrapper.log.isEnabledFor(logging.DEBUG):
+            self.wrapper.log.debug(self.log_message(message, args))
 
-    def log_warn(self, message):
-        self.wrapper.log.warn("(state:%s) %s %s: %s" % (self.wrapper.state, self.hashid, self.key_with_class(), message))
+    def log_info(self, message, *args):
+        if self.wrapper.log.isEnabledFor(logging.INFO):
+            self.wrapper.log.info(self.log_message(message, args))
+
+    def log_warn(self, message, *args):
+        self.wrapper.log.warn(self.log_message(message, args))
 
     def key_with_class(self):
         return "%s:%s" % (self.__class__.aliases[0], self.key)
@@ -116,10 +217,12 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             self.log_debug("no saved args, will return True for args_changed")
             return True
         else:
-            self.log_debug("    saved args '%s' (%s)" % (saved_args, saved_args.__class__))
-            self.log_debug("    sorted args '%s' (%s)" % (self.sorted_arg_string(), self.sorted_arg_string().__class__))
-            self.log_debug("  args unequal: %s" % (saved_args != self.sorted_arg_string()))
-            return saved_args != self.sorted_arg_string()
+            sorted_arg_string = self.sorted_arg_string()
+            args_changed = saved_args != sorted_arg_string
+            self.log_debug("    saved args '%s'", saved_args)
+            self.log_debug("    sorted args '%s'", sorted_arg_string)
+            self.log_debug("  args unequal: %s", args_changed)
+            return args_changed
 
     def sorted_args(self, skip=['contents']):
         """
@@ -167,9 +270,10 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             self.add_additional_doc(new_doc)
 
     def add_additional_doc(self, doc):
-        self.log_debug("adding additional doc '%s'" % doc.key)
+        self.log_debug("adding additional doc '%s'", doc.key)
         doc.created_by_doc = self
         self.children.append(doc)
+        self.wrapper.graph_changed()
         self.wrapper.add_node(doc)
         self.wrapper.batch.add_doc(doc)
         self.additional_docs.append(doc)
@@ -189,29 +293,31 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
 
     def check_is_cached(self):
         if self.state == 'new':
-            self.log_debug("checking if %s is changed" % self.key)
+            self.log_debug("checking if %s is changed", self.key)
 
             any_inputs_not_cached = False
             for node in self.input_nodes(True):
                 node.check_is_cached()
                 if not node.state == 'cached':
-                    self.log_debug("    input node %s is not cached" % node.key_with_class())
+                    self.log_debug("    input node %s is not cached", node.key_with_class())
                     any_inputs_not_cached = True
 
             self.args_changed = self.check_args_changed()
             self.doc_changed = self.check_doc_changed()
             cache_elements_present = self.check_cache_elements_present()
                 
-            self.log_debug("  doc changed %s" % self.doc_changed)
-            self.log_debug("  args changed %s" % self.args_changed)
-            self.log_debug("  any inputs not cached %s" % any_inputs_not_cached)
+            self.log_debug("  doc changed %s", self.doc_changed)
+            self.log_debug("  args changed %s", self.args_changed)
+            self.log_debug("  any inputs not cached %s", any_inputs_not_cached)
             # log the 'not' so we can search for 'True' in logs to find uncached items
-            self.log_debug("  cache elements missing %s" % (not cache_elements_present))
+            self.log_debug("  cache elements missing %s", not cache_elements_present)
 
             is_cached = not self.doc_changed and not self.args_changed and not any_inputs_not_cached
 
             if is_cached and cache_elements_present:
                 self.transition('cached')
+            elif not any_inputs_not_cached and self.fetch_from_shared_cache():
+                self.transition('cached')
             else:
                 self.transition('uncached')
 
@@ -219,9 +325,33 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             self.wrapper.add_node(self)
             self.wrapper.batch.add_doc(self)
 
+    def fetch_from_shared_cache(self):
+        """
+        Tries to fetch cache files from the shared cache, returns True if
+        they were found. Called when all inputs are cached, nodes which
+        aren't docs have no cache files of their own so there's nothing to
+        fetch.
+        """
+        return bool(self.wrapper.shared_store)
+
     def load_runtime_info(self):
         pass
 
+    def reset_for_rerun(self):
+        """
+        Returns a node which has already run or been consolidated to the
+        'uncached' state, so it will run again in the next call to run().
+        """
+        for doc in self.additional_docs:
+            self.children.remove(doc)
+            self.wrapper.remove_node(doc)
+        if self.additional_docs:
+            self.wrapper.graph_changed()
+        self.additional_docs = []
+
+        if not self.state == 'uncached':
+            self.transition('uncached')
+
     def consolidate_cache_files(self):
         for node in self.input_nodes():
             node.consolidate_cache_files()
@@ -259,7 +389,8 @@ class Node(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
             for task in inpt:
                 task()
         self.wrapper.current_task = self
-        self.run()
+        with self.wrapper.tracer.span(self.key_with_class(), "node", self.key):
+            self.run()
         self.wrapper.current_task = None
 
     def run(self):
@@ -297,6 +428,8 @@ class ScriptNode(BundleNode):
             doc.inputs = doc.inputs + siblings
             siblings.append(doc)
 
+        self.wrapper.graph_changed()
+
 #        self.doc_changed = self.check_doc_changed()
 #
 #        for doc in self.inputs:
@@ -319,24 +452,44 @@ class PatternNode(Node):
         file_pattern = self.key.split("|")[0]
         filter_aliases = self.key.split("|")[1:]
 
-        for filepath, fileinfo in self.wrapper.filemap.items():
-            if fnmatch.fnmatch(filepath, file_pattern):
-                except_p = self.args.get('except')
-                if except_p and re.search(except_p, filepath):
-                    msg = "not creating child of patterndoc for file '%s' because it matches except '%s'"
-                    msgargs = (filepath, except_p)
-                    self.log_debug(msg % msgargs)
+        except_p = self.args.get('except')
+        if except_p:
+            except_re = re.compile(except_p)
+
+        for filepath in self.matching_files(file_pattern):
+            if except_p and except_re.search(filepath):
+                msg = "not creating child of patterndoc for file '%s' because it matches except '%s'"
+                msgargs = (filepath, except_p)
+                self.log_debug(msg, *msgargs)
+            else:
+                if len(filter_aliases) > 0:
+                    doc_key = "%s|%s" % (filepath, "|".join(filter_aliases))
                 else:
-                    if len(filter_aliases) > 0:
-                        doc_key = "%s|%s" % (filepath, "|".join(filter_aliases))
-                    else:
-                        doc_key = filepath
-
-                    msg = "creating child of patterndoc %s: %s"
-                    msgargs = (self.key, doc_key)
-                    self.log_debug(msg % msgargs)
-                    doc = dexy.doc.Doc(doc_key, self.wrapper, [], **self.args)
-                    doc.parent = self
-                    self.children.append(doc)
-                    self.wrapper.add_node(doc)
-                    self.wrapper.batch.add_doc(doc)
+                    doc_key = filepath
+
+                msg = "creating child of patterndoc %s: %s"
+                msgargs = (self.key, doc_key)
+                self.log_debug(msg, *msgargs)
+                doc = dexy.doc.Doc(doc_key, self.wrapper, [], **self.args)
+                doc.parent = self
+                self.children.append(doc)
+                self.wrapper.add_node(doc)
+                self.wrapper.batch.add_doc(doc)
+
+    def matching_files(self, file_pattern):
+        """
+        Returns paths of files in the file map which match file_pattern, using
+        the file map's indexes if it has them. Time taken is added to the
+        batch's pattern expansion stats.
+        """
+        start = time.time()
+
+        filemap = self.wrapper.filemap
+        if hasattr(filemap, 'glob'):
+            filepaths = filemap.glob(file_pattern)
+        else:
+            filepaths = [filepath for filepath in filemap
+                    if fnmatch.fnmatch(filepath, file_pattern)]
+
+        self.wrapper.batch.add_pattern_time(time.time() - start)
+        return filepaths
@@ -0,0 +1,269 @@
+from dexy.filehashes import hash_file
+import os
+import pickle
+import stat
+import time
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+class ObjectStore(object):
+    """
+    Content-addressed store for cache files.
+
+    Each distinct file content is stored once in the objects/ directory,
+    named by its hash. A manifest maps cache file names, which are based on
+    storage keys, to the objects holding their contents, so a cache hit is a
+    lookup in the manifest rather than a file move.
+
+    Storage keys are made from a hash of the doc key and the filter aliases,
+    not from the doc's settings or inputs. Whether an entry is still valid
+    is decided by the doc's usual cache check, which forgets entries for
+    docs which need to run again. Only outputs with identical contents are
+    shared between docs.
+
+    Files written during a run go to the this/ cache dir as before, and are
+    added to the store once the run has completed successfully.
+
+    The time each object was last used in a run and the size of each object
+    are saved with the manifest, so the least recently used objects can be
+    removed when the store gets too large, without checking every object on
+    disk after each run. If retain_unused is True, entries which weren't used in a run stay
+    in the manifest until they are evicted, otherwise they are dropped when
+    the manifest is saved.
+    """
+    def __init__(self, artifacts_dir, hashfunction='md5', retain_unused=False):
+        self.objects_dir = os.path.join(artifacts_dir, 'objects')
+        self.manifest_file = os.path.join(artifacts_dir, 'manifest.pickle')
+        if hashfunction in ('crc32', 'adler32'):
+            # Checksums are too short to identify contents safely.
+            hashfunction = 'md5'
+        self.hashfunction = hashfunction
+        self.retain_unused = retain_unused
+        self.entries = None
+        self.used = {}
+        self.sizes = None
+        self.in_use = set()
+        self.kept = set()
+
+    def load(self):
+        self.entries = {}
+        self.used = {}
+        # None if sizes are unknown, e.g. the manifest was saved by an older
+        # version, then objects are checked on disk in collect_garbage.
+        self.sizes = None if os.path.exists(self.objects_dir) else {}
+        self.in_use = set()
+        self.kept = set()
+
+        try:
+            with open(self.manifest_file, 'rb') as f:
+                info = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return
+
+        if info.get('hashfunction') == self.hashfunction:
+            self.entries = info['entries']
+            self.used = info.get('used', {})
+            self.sizes = info.get('sizes')
+
+    def save(self):
+        """
+        Saves the manifest, only including entries which were kept or added
+        in this run unless retain_unused is set. Objects which are no longer
+        referenced stay on disk until collect_garbage is called.
+        """
+        entries = self.saved_entries()
+        used = dict((object_name, self.used.get(object_name, 0))
+                for object_name in entries.values())
+
+        info = {
+                'hashfunction' : self.hashfunction,
+                'entries' : entries,
+                'used' : used,
+                'sizes' : self.sizes
+                }
+
+        tmp_file = "%s.tmp" % self.manifest_file
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(info, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def saved_entries(self):
+        """
+        The entries which are written to the manifest when it is saved.
+        """
+        return dict((name, object_name)
+                for name, object_name in self.manifest_entries().items()
+                if self.retain_unused or name in self.kept)
+
+    def manifest_entries(self):
+        if self.entries is None:
+            self.load()
+        return self.entries
+
+    def object_path(self, object_name):
+        return os.path.join(self.objects_dir, object_name[0:2], object_name)
+
+    def path(self, name, default=None):
+        """
+        Returns the location of the object holding the contents of the cache
+        file name, or default if there is no such object.
+        """
+        object_name = self.manifest_entries().get(name)
+        if object_name:
+            return self.object_path(object_name)
+        else:
+            return default
+
+    def __contains__(self, name):
+        return name in self.manifest_entries()
+
+    def keep(self, name):
+        """
+        Marks a cache file as used in this run, so it's kept in the manifest.
+        """
+        if name in self.manifest_entries():
+            self.kept.add(name)
+            self.mark_used(self.entries[name])
+
+    def mark_used(self, object_name):
+        self.used[object_name] = time.time()
+        self.in_use.add(object_name)
+
+    def keep_all(self):
+        """
+        Keeps all entries in the manifest without marking them as used, for
+        saving the manifest outside of a run.
+        """
+        self.kept = set(self.manifest_entries())
+
+    def forget(self, name):
+        """
+        Removes a cache file which is out of date from the manifest.
+        """
+        self.manifest_entries().pop(name, None)
+        self.kept.discard(name)
+
+    def add(self, filepath, name):
+        """
+        Moves the file at filepath into the store under the cache file name.
+        If there's already an object with the same contents the file is
+        removed instead.
+        """
+        digest = hash_file(filepath, self.hashfunction)
+        object_name = "%s%s" % (digest, os.path.splitext(name)[1])
+        object_path = self.object_path(object_name)
+        size = os.path.getsize(filepath)
+
+        self.manifest_entries()
+        if self.sizes is not None:
+            self.sizes[object_name] = size
+
+        if os.path.exists(object_path):
+            os.remove(filepath)
+        else:
+            try:
+                os.makedirs(os.path.dirname(object_path))
+            except OSError:
+                pass
+            # Objects are read only so they can be safely hard linked.
+            os.chmod(filepath, stat.S_IMODE(os.stat(filepath).st_mode) & ~WRITE_BITS)
+            os.replace(filepath, object_path)
+
+        self.manifest_entries()[name] = object_name
+        self.kept.add(name)
+        self.mark_used(object_name)
+        return object_path
+
+    def add_dir(self, cache_dir):
+        """
+        Adds all files in the 2-character subdirectories of cache_dir.
+        """
+        for subdir in os.scandir(cache_dir):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    self.add(entry.path, entry.name)
+
+    def objects(self):
+        """
+        Yields (object name, path, size, mtime) for each object on disk.
+        """
+        if not os.path.exists(self.objects_dir):
+            return
+        for subdir in os.scandir(self.objects_dir):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    info = entry.stat()
+                    yield (entry.name, entry.path, info.st_size, info.st_mtime)
+
+    def needs_collecting(self, referenced, max_size, unreferenced):
+        """
+        Whether collect_garbage has objects to remove, going by the recorded
+        object sizes.
+        """
+        if unreferenced and any(not object_name in referenced
+                for object_name in self.sizes):
+            return True
+        else:
+            return bool(max_size) and sum(self.sizes.values()) > max_size
+
+    def collect_garbage(self, trash_dir, max_size=None, unreferenced=True, scan=False):
+        """
+        Moves objects out of the store into trash_dir, returning the number
+        of objects and bytes removed.
+
+        If unreferenced is True, objects which no manifest entry refers to
+        are removed. If max_size is set, the least recently used objects are
+        removed until the store is no larger than max_size, and the entries
+        referring to them are forgotten. Objects used in this run are never
+        removed.
+
+        The recorded object sizes are used to decide what to remove, so
+        nothing on disk is checked unless sizes are unknown or scan is True.
+        """
+        referenced = set(self.saved_entries().values())
+
+        def last_used(obj):
+            object_name, path, size, mtime = obj
+            return (object_name in referenced, self.used.get(object_name, mtime))
+
+        if scan or self.sizes is None:
+            objects = list(self.objects())
+            self.sizes = dict((obj[0], obj[2]) for obj in objects)
+        elif self.needs_collecting(referenced, max_size, unreferenced):
+            objects = [(object_name, self.object_path(object_name), size, 0)
+                    for object_name, size in self.sizes.items()]
+        else:
+            return 0, 0
+
+        objects.sort(key=last_used)
+        total_size = sum(obj[2] for obj in objects)
+
+        evicted = []
+        for obj in objects:
+            if obj[0] in self.in_use:
+                continue
+            elif unreferenced and not obj[0] in referenced:
+                evicted.append(obj)
+            elif max_size and total_size > max_size:
+                evicted.append(obj)
+            else:
+                break
+            total_size -= obj[2]
+
+        if evicted:
+            os.makedirs(trash_dir)
+        for object_name, path, size, mtime in evicted:
+            try:
+                os.replace(path, os.path.join(trash_dir, object_name))
+            except FileNotFoundError:
+                # Removed by something other than dexy.
+                pass
+            self.used.pop(object_name, None)
+            self.sizes.pop(object_name, None)
+
+        evicted_names = set(obj[0] for obj in evicted)
+        for name, object_name in list(self.manifest_entries().items()):
+            if object_name in evicted_names:
+                self.forget(name)
+
+        return len(evicted), sum(obj[2] for obj in evicted)
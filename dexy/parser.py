@@ -1,7 +1,8 @@
-import copy
 import dexy.doc
 import dexy.exceptions
 import dexy.plugin
+import dexy.utils
+import logging
 import posixpath
 
 class AbstractSyntaxTree():
@@ -11,52 +12,65 @@ class AbstractSyntaxTree():
         self.root_nodes_ordered = False
 
         self.lookup_table = {}
-        self.tree = []
 
-        # Lists of (directory, settings) tuples
+        # Root node keys in the order they were added, and keys of all nodes
+        # which are inputs of some other node. Both are kept up to date as
+        # nodes and dependencies are added, so adding is constant time.
+        self.roots = {}
+        self.input_keys = set()
+
+        # Cache of standardized keys, the same key is often added many times.
+        self.standard_keys = {}
+
+        # Lists of (directory, settings) tuples, and merged settings for
+        # each directory calculated from them.
         self.default_args_for_directory = []
         self.environment_for_directory = []
+        self.default_args_cache = {}
+        self.environment_cache = {}
+
+    @property
+    def tree(self):
+        """
+        List of root node keys, i.e. nodes which are not inputs of any other
+        node.
+        """
+        return list(self.roots)
 
     def all_inputs(self):
         """
         Returns a set of all node keys identified as inputs of some other
         element.
         """
-        all_inputs = set()
-        for kwargs in list(self.lookup_table.values()):
-            inputs = kwargs['inputs']
-            all_inputs.update(inputs)
-        return all_inputs
+        return set(self.input_keys)
 
-    def clean_tree(self):
-        """
-        Removes tasks which are already represented as inputs (tree should
-        only contain root nodes).
-        """
-        treecopy = copy.deepcopy(self.tree)
-        all_inputs = self.all_inputs()
-        for task in treecopy:
-            if task in all_inputs:
-                self.tree.remove(task)
+    def standardize_key(self, node_key):
+        if not node_key in self.standard_keys:
+            self.standard_keys[node_key] = self.wrapper.standardize_key(node_key)
+        return self.standard_keys[node_key]
+
+    def mark_as_input(self, node_key):
+        self.input_keys.add(node_key)
+        self.roots.pop(node_key, None)
 
     def add_node(self, node_key, **kwargs):
         """
         Adds the node and its kwargs to the tree and lookup table
         """
-        node_key = self.wrapper.standardize_key(node_key)
+        node_key = self.standardize_key(node_key)
 
-        if not node_key in self.tree:
-            self.tree.append(node_key)
+        if not node_key in self.input_keys:
+            self.roots[node_key] = None
 
         if not node_key in self.lookup_table:
-            self.lookup_table[node_key] = {}
+            self.lookup_table[node_key] = {'inputs' : []}
 
         self.lookup_table[node_key].update(kwargs)
 
-        if not 'inputs' in self.lookup_table[node_key]:
-            self.lookup_table[node_key]['inputs'] = []
+        if 'inputs' in kwargs:
+            for input_key in kwargs['inputs']:
+                self.mark_as_input(input_key)
 
-        self.clean_tree()
         return node_key
 
     def add_dependency(self, node_key, input_node_key):
@@ -69,44 +83,53 @@ class AbstractSyntaxTree():
 
         if not node_key == input_node_key:
             self.lookup_table[node_key]['inputs'].append(input_node_key)
-
-        self.clean_tree()
+            self.mark_as_input(input_node_key)
 
     def args_for_node(self, node_key):
         """
-        Returns the dict of kw args for a node
+        Returns the dict of kw args for a node. Values are shared with the
+        tree, not copied, so nodes and filters must copy dicts or lists from
+        their settings before changing them.
         """
-        node_key = self.wrapper.standardize_key(node_key)
-        args = copy.deepcopy(self.lookup_table[node_key])
-        del args['inputs']
-        return args
+        node_key = self.standardize_key(node_key)
+        return dict((k, v) for k, v in self.lookup_table[node_key].items()
+                if k != 'inputs')
 
     def inputs_for_node(self, node_key):
         """
         Returns the list of inputs for a node
         """
-        node_key = self.wrapper.standardize_key(node_key)
+        node_key = self.standardize_key(node_key)
         return self.lookup_table[node_key]['inputs']
 
     def calculate_default_args_for_directory(self, path):
-        dir_path = posixpath.dirname(posixpath.abspath(path))
-        default_kwargs = {}
-
-        for d, args in self.default_args_for_directory:
-            if posixpath.abspath(d) in dir_path:
-                default_kwargs.update(args)
-
-        return default_kwargs
+        return self.settings_for_directory(path,
+                self.default_args_for_directory, self.default_args_cache)
 
     def calculate_environment_for_directory(self, path):
-        dir_path = posixpath.dirname(posixpath.abspath(path))
-        env = {}
+        return self.settings_for_directory(path,
+                self.environment_for_directory, self.environment_cache)
+
+    def settings_for_directory(self, path, settings_for_directories, cache):
+        """
+        Returns the settings from each (directory, settings) tuple whose
+        directory applies to path, merged in order. Results are cached by
+        directory, since most nodes share a directory with many others.
+        """
+        head, tail = posixpath.split(path)
+        if tail in ('', '.', '..'):
+            head = posixpath.dirname(posixpath.abspath(path))
+        cache_key = (head, len(settings_for_directories))
 
-        for d, args in self.environment_for_directory:
-            if posixpath.abspath(d) in dir_path:
-                env.update(args)
+        if not cache_key in cache:
+            dir_path = posixpath.abspath(head)
+            merged = {}
+            for d, args in settings_for_directories:
+                if posixpath.abspath(d) in dir_path:
+                    merged.update(args)
+            cache[cache_key] = merged
 
-        return env
+        return dict(cache[cache_key])
 
     def walk(self):
         """
@@ -118,6 +141,8 @@ class AbstractSyntaxTree():
         if self.wrapper.roots:
             self.log_warn("roots are not empty: %s" % ", ".join(self.wrapper.roots))
 
+        debug = self.wrapper.log.isEnabledFor(logging.DEBUG)
+
         def create_dexy_node(key, *inputs, **kwargs):
             """
             Stores already created nodes in nodes dict, if called more than
@@ -131,7 +156,7 @@ class AbstractSyntaxTree():
                 kwargs_with_defaults.update(kwargs)
                 kwargs_with_defaults.update({'environment' : node_environment })
 
-                self.wrapper.log.debug("creating node %s" % alias)
+                self.wrapper.log.debug("creating node %s", alias)
                 node = dexy.node.Node.create_instance(
                         alias,
                         pattern,
@@ -139,8 +164,8 @@ class AbstractSyntaxTree():
                         inputs,
                         **kwargs_with_defaults)
 
-                if node.inputs:
-                    self.wrapper.log.debug("inputs are %s" % ", ".join(i.key for i in node.inputs))
+                if node.inputs and debug:
+                    self.wrapper.log.debug("inputs are %s", ", ".join(i.key for i in node.inputs))
 
                 self.wrapper.nodes[key] = node
 
@@ -149,12 +174,22 @@ class AbstractSyntaxTree():
 
             return self.wrapper.nodes[key]
 
+        # Results of parse_item, so nodes which are inputs of several other
+        # nodes are only parsed once.
+        parsed = {}
+
         def parse_item(key):
+            if not key in parsed:
+                parsed[key] = parse_new_item(key)
+            return parsed[key]
+
+        def parse_new_item(key):
             inputs = self.inputs_for_node(key)
             kwargs = self.args_for_node(key)
-            self.wrapper.log.debug("parsing item %s" % key)
-            self.wrapper.log.debug("  inputs: %s" % ", ".join("%r" % inpt for inpt in inputs))
-            self.wrapper.log.debug("  kwargs: %s" % ", ".join("%s: %r" % (k, v) for k, v in kwargs.items()))
+            if debug:
+                self.wrapper.log.debug("parsing item %s", key)
+                self.wrapper.log.debug("  inputs: %s", ", ".join("%r" % inpt for inpt in inputs))
+                self.wrapper.log.debug("  kwargs: %s", ", ".join("%s: %r" % (k, v) for k, v in kwargs.items()))
 
             if kwargs.get('inactive') or kwargs.get('disabled'):
                 return
@@ -168,10 +203,11 @@ class AbstractSyntaxTree():
     
             return create_dexy_node(key, *input_nodes, **kwargs)
 
-        for node_key in self.tree:
-            root_node = parse_item(node_key)
-            if root_node:
-                self.wrapper.roots.append(root_node)
+        with dexy.utils.gc_paused():
+            for node_key in self.tree:
+                root_node = parse_item(node_key)
+                if root_node:
+                    self.wrapper.roots.append(root_node)
 
 class Parser(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
@@ -1,27 +1,200 @@
+from cashew.exceptions import InactivePlugin
+from cashew.exceptions import InternalCashewException
+from cashew.exceptions import NoPlugin
+from cashew.exceptions import UserFeedback
 import cashew
-from cashew import Plugin
+import sys
+
+class Plugin(cashew.Plugin):
+    """
+    Base class for dexy plugins. The settings a class inherits from its
+    parent classes and from other classes are merged once per class rather
+    than for every new instance.
+    """
+    def initialize_settings(self, **raw_kwargs):
+        self._instance_settings = dict(PluginMeta.merged_settings(self.__class__))
+        if raw_kwargs:
+            self.initialize_settings_from_raw_kwargs(raw_kwargs)
+
+    def initialize_settings_from_raw_kwargs(self, raw_kwargs):
+        instance_settings = self._instance_settings
+        hyphen_settings = dict(
+                (k, v)
+                for k, v in raw_kwargs.items()
+                if k in instance_settings)
+
+        underscore_settings = {}
+        for k, v in raw_kwargs.items():
+            if "_" in k and k.replace("_", "-") in instance_settings:
+                underscore_settings[k.replace("_", "-")] = v
+
+        self.update_settings(hyphen_settings)
+        self.update_settings(underscore_settings)
+
+    def setting(self, name_hyphen):
+        """
+        Same as cashew's setting, without checking for environment variables
+        unless the value is a string starting with '$' or '\\$'.
+        """
+        try:
+            value = self._instance_settings[name_hyphen][1]
+        except KeyError:
+            msg = "No setting named '%s'" % name_hyphen
+            raise UserFeedback(msg)
+
+        if isinstance(value, str) and value.startswith(("$", "\\$")):
+            return cashew.Plugin.setting(self, name_hyphen)
+        else:
+            return value
+
+    def setting_values(self, skip=None):
+        """
+        Returns dict of all setting values (removes the helpstrings).
+        """
+        if skip:
+            return {k : v[1] for k, v in self._instance_settings.items() if not k in skip}
+        else:
+            return {k : v[1] for k, v in self._instance_settings.items()}
+
+    def update_settings(self, new_settings):
+        """
+        Update settings for this instance based on the provided dictionary of
+        setting keys: setting values. Values should be a tuple of (helpstring,
+        value,) unless the setting has already been defined in a parent class,
+        in which case just pass the desired value.
+        """
+        if new_settings:
+            self._update_settings(new_settings, False)
+
+    def _update_settings(self, new_settings, enforce_helpstring=True):
+        """
+        Same as cashew's _update_settings, looking each setting up once.
+        """
+        instance_settings = self._instance_settings
+        for raw_setting_name, value in new_settings.items():
+            setting_name = raw_setting_name.replace("_", "-")
+            existing = instance_settings.get(setting_name)
+
+            if existing is None:
+                if isinstance(value, tuple) or (isinstance(value, list) and len(value) == 2):
+                    instance_settings[setting_name] = value
+                elif enforce_helpstring:
+                    msg = "You must specify param '%s' as a tuple of (helpstring, value)"
+                    raise InternalCashewException(msg % setting_name)
+                else:
+                    # Create entry with blank helpstring.
+                    instance_settings[setting_name] = ('', value,)
+
+            elif isinstance(value, tuple):
+                instance_settings[setting_name] = value
+
+            else:
+                # Save inherited helpstring, replace default value.
+                instance_settings[setting_name] = (existing[0], value,)
 
 class PluginMeta(cashew.PluginMeta):
     """
     PluginMeta customized for dexy.
     """
     _store_other_class_settings = {} # allow plugins to define settings for other classes
+    _merged_settings = {} # settings instances of each class start with
+    _alias_settings = {} # settings instances of each (class, alias) start with
     official_dexy_plugins = ("dexy_templates", "dexy_viewer", "dexy_filter_examples")
 
+    yaml_base_classes = {
+            'Template' : 'dexy.template',
+            'PexpectReplFilter' : 'dexy.filters.pexp',
+            'SubprocessCompileFilter' : 'dexy.filters.process',
+            'SubprocessCompileInputFilter' : 'dexy.filters.process',
+            'SubprocessExtToFormatFilter' : 'dexy.filters.process',
+            'SubprocessFilter' : 'dexy.filters.process',
+            'SubprocessFormatFlagFilter' : 'dexy.filters.process',
+            'SubprocessInputFileFilter' : 'dexy.filters.process',
+            'SubprocessInputFilter' : 'dexy.filters.process',
+            'SubprocessStdoutFilter' : 'dexy.filters.process',
+            'SubprocessStdoutTextFilter' : 'dexy.filters.process',
+            'PreserveDataClassFilter' : 'dexy.filters.standard',
+            }
+
+    def register_other_class_settings(cls):
+        cashew.PluginMeta.register_other_class_settings(cls)
+        if getattr(cls, '_other_class_settings', None):
+            # Settings for other classes may change any class's settings.
+            PluginMeta._merged_settings.clear()
+            PluginMeta._alias_settings.clear()
+
+    def create_instance(cls, alias, *instanceargs, **instancekwargs):
+        """
+        Same as cashew's create_instance, skipping the class lookup for
+        plugins registered with a class rather than a class name.
+        """
+        alias = cls.adjust_alias(alias)
+
+        if not alias in cls.plugins:
+            msg = "no alias '%s' available for '%s'"
+            msgargs = (alias, cls.__name__)
+            raise NoPlugin(msg % msgargs)
+
+        class_or_class_name, settings = cls.plugins[alias]
+        if isinstance(class_or_class_name, type):
+            klass = class_or_class_name
+        else:
+            klass = cls.get_reference_to_class(class_or_class_name)
+
+        instance = klass(*instanceargs, **instancekwargs)
+        instance.alias = alias
+
+        if hasattr(instance, '_instance_settings'):
+            instance.update_settings(settings)
+        else:
+            instance._instance_settings = dict(cls.alias_settings(klass, alias, settings))
+
+        if not instance.is_active():
+            raise InactivePlugin(alias)
+
+        return instance
+
+    def merged_settings(cls):
+        """
+        Returns the settings defined by cls, its parent classes and other
+        classes, merged in the same order as cashew merges them for each
+        instance. The returned dict must not be modified.
+        """
+        settings = PluginMeta._merged_settings.get(cls)
+        if settings is None:
+            instance = cls.__new__(cls)
+            instance._instance_settings = {}
+            cashew.Plugin.initialize_settings_from_parents(instance)
+            cashew.Plugin.initialize_settings_from_other_classes(instance)
+            settings = instance._instance_settings
+            PluginMeta._merged_settings[cls] = settings
+        return settings
+
+    def alias_settings(cls, klass, alias, settings):
+        """
+        Returns the settings an instance of klass created under alias starts
+        with, i.e. its merged settings updated with the settings registered
+        for alias. The returned dict must not be modified.
+        """
+        key = (klass, alias)
+        cached = PluginMeta._alias_settings.get(key)
+        if cached is None or not cached[0] is settings:
+            instance = klass.__new__(klass)
+            instance.initialize_settings()
+            instance.update_settings(settings)
+            cached = (settings, instance._instance_settings,)
+            PluginMeta._alias_settings[key] = cached
+        return cached[1]
+
     def load_class_from_locals(cls, class_name):
-        from dexy.template import Template
-        from dexy.filters.pexp import PexpectReplFilter
-        from dexy.filters.process import SubprocessCompileFilter
-        from dexy.filters.process import SubprocessCompileInputFilter
-        from dexy.filters.process import SubprocessExtToFormatFilter
-        from dexy.filters.process import SubprocessFilter
-        from dexy.filters.process import SubprocessFormatFlagFilter
-        from dexy.filters.process import SubprocessInputFileFilter
-        from dexy.filters.process import SubprocessInputFilter
-        from dexy.filters.process import SubprocessStdoutFilter
-        from dexy.filters.process import SubprocessStdoutTextFilter
-        from dexy.filters.standard import PreserveDataClassFilter
-        return locals()[class_name]
+        """
+        Returns a base class which plugins defined in yaml files may use,
+        importing only the module which defines it.
+        """
+        modname = PluginMeta.yaml_base_classes[class_name]
+        if not modname in sys.modules:
+            __import__(modname)
+        return getattr(sys.modules[modname], class_name)
 
     def apply_prefix(cls, modname, alias):
         if modname.startswith("dexy_") and not modname in PluginMeta.official_dexy_plugins:
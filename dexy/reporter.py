@@ -1,5 +1,6 @@
 from dexy.utils import file_exists
 import dexy.plugin
+import logging
 import os
 import shutil
 import sys
@@ -104,14 +105,21 @@ class Reporter(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     def key_for_log(self):
         return "reporter:%s" % self.aliases[0]
 
-    def log_debug(self, message):
-        self.wrapper.log.debug("%s: %s" % (self.key_for_log(), message))
+    def log_message(self, message, args):
+        if args:
+            message = message % args
+        return "%s: %s" % (self.key_for_log(), message)
 
-    def log_info(self, message):
-        self.wrapper.log.info("%s: %s" % (self.key_for_log(), message))
+    def log_debug(self, message, *args):
+        if self.wrapper.log.isEnabledFor(logging.DEBUG):
+            self.wrapper.log.debug(self.log_message(message, args))
 
-    def log_warn(self, message):
-        self.wrapper.log.warn("%s: %s" % (self.key_for_log(), message))
+    def log_info(self, message, *args):
+        if self.wrapper.log.isEnabledFor(logging.INFO):
+            self.wrapper.log.info(self.log_message(message, args))
+
+    def log_warn(self, message, *args):
+        self.wrapper.log.warn(self.log_message(message, args))
 
     def safety_filepath(self):
         return os.path.join(self.report_dir(), self.setting('safety-filename'))
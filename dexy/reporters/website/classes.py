@@ -8,7 +8,7 @@ from jinja2 import Environment
 from jinja2 import FileSystemLoader
 import dexy.data
 import dexy.exceptions
-import dexy.filters.templating_plugins
+import dexy.jinjaenv
 import inspect
 import jinja2
 import os
@@ -140,8 +140,19 @@ class Website(Output):
 
     def detect_html_header(self, doc):
         fragments = ('<html', '<body', '<head')
+        data = doc.output_data()
+
+        if hasattr(data, 'mmap'):
+            # Search the file without loading it into memory.
+            try:
+                with data.mmap() as contents:
+                    return any(contents.find(html_fragment.encode('ascii')) > -1
+                            for html_fragment in fragments)
+            except IOError:
+                pass
+
         return any(html_fragment
-                      in str(doc.output_data())
+                      in str(data)
                       for html_fragment in fragments)
 
     def create_navobj(self):
@@ -175,7 +186,8 @@ class Website(Output):
 
     def jinja_environment(self, template_path, additional_args=None):
         """
-        Returns jinja Environment object.
+        Returns jinja Environment object, shared with other docs using
+        templates in the same dir.
         """
         args = {
                 'undefined' : jinja2.StrictUndefined
@@ -184,12 +196,15 @@ class Website(Output):
         if additional_args:
             args.update(additional_args)
 
-        env = Environment(**args)
-
         dirs = [".", os.path.dirname(__file__), os.path.dirname(template_path)]
-        env.loader = FileSystemLoader(dirs)
 
-        return env
+        def create():
+            env = Environment(**args)
+            env.loader = FileSystemLoader(dirs)
+            return env
+
+        key = ('website', sorted(args.items()), dirs)
+        return dexy.jinjaenv.environment(self.wrapper, key, create)
 
     def apply_jinja_to_page_content(self, doc, env_data):
         args = {
@@ -205,11 +220,13 @@ class Website(Output):
             if doc.safe_setting(setting_name):
                 args[k] = doc.setting(setting_name)
 
-        env = Environment(**args)
+        key = ('website-content', sorted(args.items()))
+        env = dexy.jinjaenv.environment(self.wrapper, key, lambda: Environment(**args))
 
         self.log_debug("Applying jinja to doc content %s" % doc.key)
         try:
-            content_template = env.from_string(str(doc.output_data()))
+            content_template = dexy.jinjaenv.from_string(env,
+                    str(doc.output_data()), doc.key)
             return content_template.render(env_data)
         except Exception:
             self.log_debug("Template:\n%s" % str(doc.output_data()))
@@ -0,0 +1,460 @@
+import collections
+import dexy.doc
+import dexy.exceptions
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import threading
+import traceback
+
+def worker_results(doc, first_trace_event):
+    """
+    Collects the state which a document run in a worker process needs to hand
+    back to the main process.
+    """
+    batch_info = {}
+
+    def collect(d):
+        batch_info[d.key_with_class()] = d.batch_info()
+        for additional_doc in d.additional_docs:
+            collect(additional_doc)
+
+    collect(doc)
+
+    return {
+            'runtime-args' : doc.runtime_args,
+            'additional-docs' : doc.additional_doc_info(),
+            'batch-info' : batch_info,
+            'trace-events' : doc.wrapper.tracer.events_since(first_trace_event)
+            }
+
+def run_node(node, conn, send_results):
+    """
+    Runs a single node, all of whose dependencies have already run, and sends
+    the results down the pipe. Threads share the main process's node objects
+    so they don't need to send results.
+    """
+    tracer = node.wrapper.tracer
+    first_trace_event = tracer.event_count()
+    try:
+        node()
+        if send_results:
+            conn.send(('ok', worker_results(node, first_trace_event), None))
+        else:
+            conn.send(('ok', None, None))
+        return True
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = Exception(str(e))
+        conn.send(('error', e, traceback.format_exc()))
+        return False
+
+def run_in_thread(node, conn, worker_name):
+    """
+    Entry point for a worker thread, runs a single node.
+    """
+    node.wrapper.tracer.set_worker(worker_name)
+    try:
+        run_node(node, conn, False)
+    finally:
+        conn.close()
+
+def run_worker_process(scheduler, conn, worker_name):
+    """
+    Entry point for a forked worker process. Runs nodes sent by the main
+    process until it sends None. Each message also lists the nodes which
+    finished elsewhere since the last one, which are applied to this
+    process's copies of them first.
+    """
+    for process, other_conn in scheduler.workers.values():
+        other_conn.close()
+
+    wrapper = scheduler.wrapper
+    wrapper.tracer.set_worker(worker_name)
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+
+            finished, node_id = message
+            scheduler.apply_finished(finished)
+            node = scheduler.nodes[node_id]
+            node.transition('running')
+            if run_node(node, conn, True):
+                node.transition('ran')
+    finally:
+        conn.close()
+        wrapper.close_repl_pools()
+
+class Scheduler(object):
+    """
+    Runs the node graph as a ready queue. Each node counts its dependencies
+    which haven't run yet, and is queued as soon as the count reaches zero.
+
+    Documents whose filters run external executables go to a pool of
+    `threads` worker threads, since they spend most of their time waiting on
+    subprocesses. Other documents go to a pool of `jobs` forked worker
+    processes, or run in the main process if `jobs` is less than 2.
+    Documents using the REPL pool never go to forked workers, which can't
+    share the main process's pool.
+
+    Worker processes are forked before any documents run and then run one
+    document after another. Their copies of nodes are brought up to date
+    from a log of nodes which finished in the main process, in threads or
+    in other workers, before they run each document.
+
+    Worker threads share the wrapper, its batch, nodes, file hash index,
+    object store and tracer, and the process's working directory, with the
+    main thread and each other. Threads only run their own document's
+    filters, which create their own Data and storage objects, and change
+    the shared objects by single dict, set or list operations, which are
+    safe under the GIL. The working directory is not safe to change, so
+    documents with a filter which changes it never go to a thread, and
+    documents which run in the main thread wait until no threads are
+    running.
+    """
+    def __init__(self, wrapper, jobs, threads=0):
+        self.wrapper = wrapper
+        self.jobs = jobs
+        self.threads = threads
+        self.running = {}
+        self.workers = {}
+
+        # Nodes which have finished running, and how far through this list
+        # each worker process has applied.
+        self.finished = []
+        self.worker_finished = {}
+
+        if jobs > 1:
+            self.context = multiprocessing.get_context('fork')
+        else:
+            self.context = None
+
+        self.free_worker_ids = []
+
+        self.free_thread_ids = list(range(threads))
+
+    @classmethod
+    def is_available(klass):
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    def runs_subprocesses(self, doc):
+        return any(hasattr(f, 'executable_semaphore') for f in doc.filters)
+
+    def uses_repl_pool(self, doc):
+        """
+        Documents whose REPLs can come from the REPL pool. Forked workers
+        would each start their own pool, so these run in threads or the
+        main process instead.
+        """
+        if not self.wrapper.repl_pool:
+            return False
+        return any(f.uses_repl_pool for f in doc.filters)
+
+    def threads_running(self):
+        return any(isinstance(worker, threading.Thread)
+                for node, worker, worker_id in self.running.values())
+
+    def runs_in_thread(self, doc):
+        if any(f.changes_working_dir for f in doc.filters):
+            return False
+        return self.runs_subprocesses(doc)
+
+    def setup_executable_semaphores(self, nodes):
+        """
+        Creates semaphores for filters with a max-concurrent setting before
+        any workers start, so they are shared by all workers.
+        """
+        for node in nodes:
+            for f in getattr(node, 'filters', []):
+                if hasattr(f, 'executable_semaphore'):
+                    f.executable_semaphore()
+
+    def dependencies(self, node):
+        """
+        Nodes which must have run before this node can run, mirroring the
+        order in which Node.__call__ and Node.run call them.
+        """
+        return node.input_nodes(True)
+
+    def collect_nodes(self, roots):
+        """
+        Returns all nodes reachable from roots, dependencies before dependents.
+        """
+        ordered = []
+        seen = set()
+
+        def visit(node):
+            if node in seen:
+                return
+            seen.add(node)
+            for dep in self.dependencies(node):
+                visit(dep)
+            ordered.append(node)
+
+        for root in roots:
+            visit(root)
+
+        return ordered
+
+    def is_done(self, node):
+        return node.state in ('ran', 'consolidated',)
+
+    def run(self, roots):
+        self.nodes = self.collect_nodes(roots)
+        self.node_ids = dict((node, i) for i, node in enumerate(self.nodes))
+        self.setup_executable_semaphores(self.nodes)
+
+        self.ready_bundles = collections.deque()
+        self.ready_threads = collections.deque()
+        self.ready_workers = collections.deque()
+        self.ready_main = collections.deque()
+
+        self.remaining = {}
+        self.dependents = {}
+        for node in self.nodes:
+            if self.is_done(node):
+                continue
+            elif not node.state == 'uncached':
+                msg = "%s in %s" % (node.state, node.key)
+                raise dexy.exceptions.UnexpectedState(msg)
+
+            deps = set(dep for dep in self.dependencies(node)
+                    if not self.is_done(dep))
+            self.remaining[node] = len(deps)
+            for dep in deps:
+                self.dependents.setdefault(dep, []).append(node)
+
+        for node in self.nodes:
+            if self.remaining.get(node) == 0:
+                self.queue(node)
+
+        try:
+            if self.context:
+                # Workers are forked before any threads start, so they
+                # don't hold on to pipes a thread has open while starting
+                # a subprocess, which would stop it from returning.
+                n_docs = sum(1 for node in self.remaining
+                        if self.ready_queue(node) is self.ready_workers)
+                for worker_id in range(min(self.jobs, n_docs)):
+                    self.start_worker(worker_id)
+                    self.free_worker_ids.append(worker_id)
+
+            while self.remaining:
+                while self.ready_bundles:
+                    # Bundles only call their children, which have all
+                    # run, so run them in the main process.
+                    node = self.ready_bundles.popleft()
+                    for task in node:
+                        task()
+                    self.node_finished(node)
+
+                while self.ready_threads and self.free_thread_ids:
+                    self.dispatch_thread(self.ready_threads.popleft())
+
+                while self.ready_workers and self.free_worker_ids:
+                    self.dispatch(self.ready_workers.popleft())
+
+                if self.ready_main and not self.threads_running():
+                    # Only runs while no threads are running, since filters
+                    # may change the working directory.
+                    node = self.ready_main.popleft()
+                    for task in node:
+                        task()
+                    self.node_finished(node)
+
+                elif self.running:
+                    self.wait_for_workers()
+
+                elif self.remaining and not self.ready_bundles:
+                    keys = ", ".join(n.key for n in self.nodes if n in self.remaining)
+                    raise dexy.exceptions.CircularDependency(keys)
+        finally:
+            self.stop_workers()
+
+    def ready_queue(self, node):
+        """
+        Returns the queue node goes in once its dependencies have all run.
+        """
+        if not isinstance(node, dexy.doc.Doc):
+            return self.ready_bundles
+        elif self.threads and self.runs_in_thread(node):
+            return self.ready_threads
+        elif self.context and not self.uses_repl_pool(node):
+            return self.ready_workers
+        else:
+            return self.ready_main
+
+    def queue(self, node):
+        self.ready_queue(node).append(node)
+
+    def node_finished(self, node, results=None):
+        """
+        Logs a node which has run for worker processes to apply, and queues
+        dependents which were only waiting for it.
+        """
+        if isinstance(node, dexy.doc.Doc):
+            if results is None:
+                results = {
+                        'runtime-args' : node.runtime_args,
+                        'additional-docs' : node.additional_doc_info()
+                        }
+            self.finished.append((self.node_ids[node],
+                    results['runtime-args'], results['additional-docs']))
+        else:
+            self.finished.append((self.node_ids[node], None, None))
+
+        del self.remaining[node]
+        for dependent in self.dependents.pop(node, []):
+            self.remaining[dependent] -= 1
+            if not self.remaining[dependent]:
+                self.queue(dependent)
+
+    def apply_finished(self, finished):
+        """
+        Called in a worker process to apply nodes which finished elsewhere to
+        this process's copies of them.
+        """
+        for node_id, runtime_args, additional_docs in finished:
+            node = self.nodes[node_id]
+            if node.state == 'ran':
+                # Ran in this worker.
+                continue
+            node.transition('running')
+            if runtime_args is not None:
+                self.apply_results(node, runtime_args, additional_docs)
+            node.transition('ran')
+
+    def start_worker(self, worker_id):
+        parent_conn, child_conn = self.context.Pipe()
+        worker_name = "process %s" % worker_id
+        process = self.context.Process(target=run_worker_process,
+                args=(self, child_conn, worker_name))
+        process.start()
+        child_conn.close()
+
+        self.workers[worker_id] = (process, parent_conn)
+        self.worker_finished[worker_id] = len(self.finished)
+
+    def dispatch(self, node):
+        worker_id = self.free_worker_ids.pop(0)
+        node.transition('running')
+        node.log_info("running in worker %s..." % worker_id)
+
+        process, conn = self.workers[worker_id]
+        finished = self.finished[self.worker_finished[worker_id]:]
+        conn.send((finished, self.node_ids[node]))
+        self.worker_finished[worker_id] = len(self.finished)
+
+        self.running[conn] = (node, process, worker_id)
+
+    def dispatch_thread(self, node):
+        thread_id = self.free_thread_ids.pop(0)
+        node.transition('running')
+        node.log_info("running in thread %s..." % thread_id)
+
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        worker_name = "thread %s" % thread_id
+        thread = threading.Thread(target=run_in_thread,
+                args=(node, child_conn, worker_name))
+        thread.daemon = True
+        thread.start()
+
+        self.running[parent_conn] = (node, thread, thread_id)
+
+    def wait_for_workers(self):
+        for conn in multiprocessing.connection.wait(list(self.running)):
+            node, worker, worker_id = self.running.pop(conn)
+            is_thread = isinstance(worker, threading.Thread)
+
+            try:
+                status, result, tb = conn.recv()
+            except EOFError:
+                status, result, tb = ('error', None, None)
+                if not is_thread:
+                    # The worker process died, it can't be reused.
+                    del self.workers[worker_id]
+                    conn.close()
+                    worker.join()
+            finally:
+                if is_thread:
+                    conn.close()
+                    worker.join()
+                    self.free_thread_ids.append(worker_id)
+                elif worker_id in self.workers:
+                    self.free_worker_ids.append(worker_id)
+
+            if status == 'ok' and is_thread:
+                node.transition('ran')
+                self.node_finished(node)
+            elif status == 'ok':
+                self.merge(node, result)
+                self.node_finished(node, result)
+            else:
+                self.wrapper.current_task = node
+                if tb:
+                    self.wrapper.log.warn(tb)
+                if result is None:
+                    msg = "worker %s running %s exited with code %s"
+                    msgargs = (worker_id, node.key, getattr(worker, 'exitcode', None))
+                    raise dexy.exceptions.InternalDexyProblem(msg % msgargs)
+                raise result
+
+    def merge(self, doc, results):
+        """
+        Applies results from a worker process to the main process copy of doc.
+        """
+        self.apply_results(doc, results['runtime-args'], results['additional-docs'])
+        self.wrapper.batch.update_docs(results['batch-info'])
+        self.wrapper.tracer.add_events(results['trace-events'])
+        doc.transition('ran')
+
+    def apply_results(self, doc, runtime_args, additional_docs):
+        """
+        Applies what running doc elsewhere changed to this process's copy.
+        """
+        doc.add_runtime_args(runtime_args)
+
+        for doc_key, hashid, doc_settings in additional_docs:
+            new_doc = dexy.doc.Doc(doc_key, self.wrapper, [], **doc_settings)
+            new_doc.contents = None
+            new_doc.args_changed = False
+            new_doc.state = 'ran'
+            assert new_doc.hashid == hashid
+            new_doc.setup_datas()
+            new_doc.apply_runtime_info()
+            self.connect_storage(new_doc)
+            doc.add_additional_doc(new_doc)
+
+        self.connect_storage(doc)
+
+    def connect_storage(self, doc):
+        for data in doc.datas():
+            if data.state == 'new':
+                data.setup()
+            if hasattr(data.storage, 'connect'):
+                data.storage.connect()
+
+    def stop_workers(self):
+        for conn, (node, worker, worker_id) in self.running.items():
+            if isinstance(worker, threading.Thread):
+                worker.join()
+                conn.close()
+            else:
+                worker.terminate()
+        self.running = {}
+
+        for process, conn in self.workers.values():
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+            process.join()
+        self.workers = {}
@@ -0,0 +1,313 @@
+from dexy.version import DEXY_VERSION
+import hashlib
+import json
+import os
+import shutil
+import urllib.error
+import urllib.request
+import uuid
+
+# Filter settings which differ between checkouts without changing output.
+SKIP_FILTER_SETTINGS = ('install-dir',)
+
+class DirectoryBackend(object):
+    """
+    Stores shared cache entries as files in a directory, which may be on a
+    network share. Each entry is a directory named by its key.
+    """
+    def __init__(self, location):
+        self.location = os.path.abspath(os.path.expanduser(location))
+
+    def entry_dir(self, key):
+        return os.path.join(self.location, key[0:2], key)
+
+    def get(self, key, name, filepath):
+        """
+        Copies the file name in entry key to filepath, returns False if
+        there's no such file.
+        """
+        try:
+            shutil.copyfile(os.path.join(self.entry_dir(key), name), filepath)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def read(self, key, name):
+        try:
+            with open(os.path.join(self.entry_dir(key), name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, name, filepath):
+        entry_dir = self.entry_dir(key)
+        try:
+            os.makedirs(entry_dir)
+        except OSError:
+            pass
+        # Copy to a temporary name so other checkouts never see partial files.
+        tmp_filepath = os.path.join(entry_dir, ".%s.%s" % (name, uuid.uuid4()))
+        shutil.copyfile(filepath, tmp_filepath)
+        os.replace(tmp_filepath, os.path.join(entry_dir, name))
+
+    def write(self, key, name, data):
+        entry_dir = self.entry_dir(key)
+        try:
+            os.makedirs(entry_dir)
+        except OSError:
+            pass
+        tmp_filepath = os.path.join(entry_dir, ".%s.%s" % (name, uuid.uuid4()))
+        with open(tmp_filepath, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_filepath, os.path.join(entry_dir, name))
+
+class HttpBackend(object):
+    """
+    Stores shared cache entries on an HTTP server, using GET to fetch files
+    and PUT to store them at URLs of the form location/key/name.
+    """
+    def __init__(self, location, timeout=30):
+        self.location = location.rstrip("/")
+        self.timeout = timeout
+
+    def url(self, key, name):
+        return "%s/%s/%s" % (self.location, key, name)
+
+    def open(self, key, name):
+        try:
+            return urllib.request.urlopen(self.url(key, name), timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def get(self, key, name, filepath):
+        response = self.open(key, name)
+        if response is None:
+            return False
+        with response:
+            with open(filepath, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        return True
+
+    def read(self, key, name):
+        response = self.open(key, name)
+        if response is None:
+            return None
+        with response:
+            return response.read()
+
+    def put(self, key, name, filepath):
+        with open(filepath, 'rb') as f:
+            request = urllib.request.Request(self.url(key, name),
+                    data=f, method='PUT',
+                    headers={'Content-Length' : str(os.path.getsize(filepath))})
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+
+    def write(self, key, name, data):
+        request = urllib.request.Request(self.url(key, name),
+                data=data, method='PUT')
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+class SharedCache(object):
+    """
+    Second level cache of doc outputs which can be shared between checkouts
+    of a project, such as CI jobs and developer clones.
+
+    Entries are keyed by a hash of each filter's alias, version and settings,
+    the content hash of the doc's file or its contents, and the keys of its
+    inputs. A doc which isn't cached locally is fetched from the shared cache
+    instead of being run when its key is found. After a successful run, docs
+    which were run are uploaded if upload is enabled.
+
+    Each entry has a manifest listing its files, written after the files, so
+    entries which are being uploaded are not seen as hits.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, wrapper, backend, upload=True):
+        self.wrapper = wrapper
+        self.backend = backend
+        self.upload = upload
+        self.keys = {}
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self.errors = 0
+
+    def filter_version(self, f):
+        """
+        Version of the software a filter runs, if the filter can report it.
+        """
+        if not f.alias in self.versions:
+            if hasattr(f, 'version'):
+                self.versions[f.alias] = f.version()
+            else:
+                self.versions[f.alias] = None
+        return self.versions[f.alias]
+
+    def filter_info(self, f):
+        settings = dict((k, v) for k, v in f.setting_values().items()
+                if not k in SKIP_FILTER_SETTINGS)
+        return [f.alias, self.filter_version(f), settings]
+
+    def node_info(self, node):
+        info = [DEXY_VERSION, node.key_with_class(), node.sorted_args(None)]
+
+        if hasattr(node, 'filters'):
+            info.append([self.filter_info(f) for f in node.filters])
+
+        if hasattr(node, 'live_file_hash') and node.name in self.wrapper.filemap:
+            info.append(node.live_file_hash())
+
+        return info
+
+    def key(self, node):
+        """
+        Returns the shared cache key for node. Keys are cached, and inputs'
+        keys are calculated without recursion so long chains of inputs don't
+        hit the recursion limit.
+        """
+        if node in self.keys:
+            return self.keys[node]
+
+        stack = [(node, iter(node.input_nodes(True)))]
+        visiting = set([node])
+        while stack:
+            current, remaining = stack[-1]
+            for child in remaining:
+                if not child in self.keys and not child in visiting:
+                    visiting.add(child)
+                    stack.append((child, iter(child.input_nodes(True))))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(current)
+                info = self.node_info(current)
+                info.append([self.keys.get(n) for n in current.input_nodes(True)])
+                text = json.dumps(info, sort_keys=True, default=str)
+                self.keys[current] = hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+        return self.keys[node]
+
+    def this_path(self, name):
+        return os.path.join(self.wrapper.this_cache_dir(), name[0:2], name)
+
+    def has_separator(self, name):
+        return any(sep and sep in name for sep in ("/", os.sep, os.altsep))
+
+    def doc_files(self, doc):
+        """
+        Names of the cache files for doc and any additional docs it created.
+        """
+        names = [d.storage.data_file_name() for d in doc.datas()]
+        names.append(doc.runtime_info_name())
+        for additional_doc in doc.additional_docs:
+            names.extend(self.doc_files(additional_doc))
+        return names
+
+    def fetch(self, doc):
+        """
+        Copies the cache files for doc from the shared cache into this run's
+        cache dir, returns True if they were found.
+        """
+        key = self.key(doc)
+        fetched = []
+        try:
+            manifest = self.backend.read(key, self.MANIFEST)
+            if manifest is not None:
+                names = json.loads(manifest.decode('utf-8'))
+                if not isinstance(names, list):
+                    raise ValueError("manifest isn't a list")
+                expected = set(self.doc_files(doc))
+                for name in names:
+                    if not isinstance(name, str) or not name in expected \
+                            or self.has_separator(name):
+                        raise ValueError("unexpected file %r in manifest" % (name,))
+                for name in names:
+                    filepath = self.this_path(name)
+                    fetched.append(filepath)
+                    if not self.backend.get(key, name, filepath):
+                        raise IOError("missing %s" % name)
+        except (OSError, ValueError) as e:
+            self.wrapper.log.warn("could not fetch %s from shared cache: %s" % (doc.key, e))
+            self.errors += 1
+            for filepath in fetched:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            manifest = None
+
+        if manifest is None:
+            self.misses += 1
+            return False
+        else:
+            doc.log_debug("fetched from shared cache entry %s", key)
+            self.hits += 1
+            return True
+
+    def store(self, doc):
+        # Additional docs aren't known until doc has run, so fetch() can't
+        # check their names against the manifest.
+        if doc.additional_docs:
+            return
+
+        key = self.key(doc)
+        names = self.doc_files(doc)
+        filepaths = [self.this_path(name) for name in names]
+        if not all(os.path.exists(filepath) for filepath in filepaths):
+            return
+
+        try:
+            for name, filepath in zip(names, filepaths):
+                self.backend.put(key, name, filepath)
+            self.backend.write(key, self.MANIFEST, json.dumps(names).encode('utf-8'))
+            self.uploads += 1
+        except OSError as e:
+            self.wrapper.log.warn("could not upload %s to shared cache: %s" % (doc.key, e))
+            self.errors += 1
+
+    def store_docs(self):
+        """
+        Uploads docs which were run in this batch, called after a successful
+        run while their cache files are still in this/.
+        """
+        if not self.upload:
+            return
+
+        for node in self.wrapper.nodes.values():
+            if node.state != 'ran' or not hasattr(node, 'filters'):
+                continue
+            if hasattr(node, 'created_by_doc') or node.setting('dirty'):
+                continue
+            self.store(node)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            return float(self.hits) / lookups
+        else:
+            return 0.0
+
+    def stats(self):
+        return {
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'uploads' : self.uploads,
+                'errors' : self.errors,
+                'hit-rate' : self.hit_rate()
+                }
+
+def shared_cache(wrapper):
+    """
+    Returns a SharedCache for the wrapper's shared-cache setting, which is
+    either a directory or an http(s) URL, or None if it's not set.
+    """
+    location = wrapper.shared_cache
+    if not location:
+        return None
+    elif location.startswith("http://") or location.startswith("https://"):
+        backend = HttpBackend(location)
+    else:
+        backend = DirectoryBackend(location)
+    return SharedCache(wrapper, backend, wrapper.shared_cache_upload)
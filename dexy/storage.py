@@ -1,11 +1,14 @@
 from dexy.exceptions import UserFeedback
 from dexy.exceptions import InternalDexyProblem
+from dexy.utils import copy_file
 from dexy.utils import file_exists
+import contextlib
 import dexy.exceptions
 import dexy.plugin
+import mmap
 import os
-import shutil
 import sqlite3
+import urllib.request
 
 class Storage(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
@@ -51,27 +54,33 @@ class GenericStorage(Storage):
         else:
             return self.this_data_file()
 
+    def data_file_name(self):
+        return "%s%s" % (self.storage_key, self.ext)
+
     def last_data_file(self):
         """
-        Location of data file in last/ cache dir.
+        Location of data file cached by a previous run, in the object store.
         """
-        return os.path.join(self.storage_dir(False), "%s%s" % (self.storage_key, self.ext))
+        default = os.path.join(self.storage_dir(False), self.data_file_name())
+        return self.wrapper.object_store.path(self.data_file_name(), default)
 
     def this_data_file(self):
         """
         Location of data file in this/ cache dir.
         """
-        return os.path.join(self.storage_dir(True), "%s%s" % (self.storage_key, self.ext))
+        return os.path.join(self.storage_dir(True), self.data_file_name())
 
     def data_file_exists(self, this):
         if this:
-            return os.path.exists(self.this_data_file())
+            # Cached data which is still valid stays in the object store.
+            return os.path.exists(self.this_data_file()) or \
+                    self.data_file_name() in self.wrapper.object_store
         else:
             return os.path.exists(self.last_data_file())
 
     def data_file_size(self, this):
         if this:
-            return os.path.getsize(self.this_data_file())
+            return os.path.getsize(self.data_file())
         else:
             return os.path.getsize(self.last_data_file())
 
@@ -93,7 +102,7 @@ class GenericStorage(Storage):
         self.assert_location_is_in_project_dir(filepath)
 
         if os.path.exists(self.this_data_file()) and not filepath == self.this_data_file():
-            shutil.copyfile(self.this_data_file(), filepath)
+            copy_file(self.this_data_file(), filepath)
         else:
              with open(filepath, "wb") as f:
                  if not isinstance(data, str):
@@ -109,6 +118,38 @@ class GenericStorage(Storage):
             except UnicodeDecodeError:
                 return raw
 
+    def open(self):
+        """
+        Opens the data file for reading as bytes.
+        """
+        return open(self.data_file(read=True), "rb")
+
+    def iter_chunks(self, chunk_size=65536):
+        """
+        Yields the contents of the data file as bytes in blocks of up to
+        chunk_size, so large files can be scanned in constant memory.
+        """
+        with self.open() as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+    @contextlib.contextmanager
+    def mmap(self):
+        """
+        Memory maps the data file read only, for use in a with statement.
+        Pages are read from disk as they are accessed.
+        """
+        with self.open() as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files can't be mapped.
+                yield b''
+            else:
+                contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    yield contents
+                finally:
+                    contents.close()
+
     def copy_file(self, filepath):
         """
         If data file exists, copy file and return true. Otherwise return false.
@@ -116,7 +157,7 @@ class GenericStorage(Storage):
         try:
             self.assert_location_is_in_project_dir(filepath)
             this = (self.wrapper.state in ('walked', 'running', 'ran',))
-            shutil.copyfile(self.data_file(this), filepath)
+            copy_file(self.data_file(this), filepath)
             return True
         except:
             return False
@@ -139,7 +180,7 @@ class JsonSectionedStorage(GenericStorage):
 
     def write_data(self, data, filepath=None):
         if not filepath:
-            filepath = self.data_file()
+            filepath = self.data_file(read=False)
 
         self.assert_location_is_in_project_dir(filepath)
 
@@ -188,7 +229,7 @@ class JsonKeyValueStorage(GenericStorage):
 
     def write_data(self, data, filepath=None):
         if not filepath:
-            filepath = self.data_file()
+            filepath = self.data_file(read=False)
 
         self.assert_location_is_in_project_dir(filepath)
 
@@ -198,9 +239,24 @@ class JsonKeyValueStorage(GenericStorage):
 class Sqlite3KeyValueStorage(GenericStorage):
     """
     Storage of key value storage in sqlite3 database files.
+
+    New databases are built in the work/ cache dir, with appended rows
+    buffered and inserted in batches, and moved into place when persisted.
     """
     aliases = ['sqlite3']
 
+    # Number of appended rows to buffer before inserting them.
+    append_buffer_size = 10000
+
+    # Pragmas for a database which is being built, it can be rebuilt if
+    # anything goes wrong so there's no need to wait for writes to reach disk.
+    build_pragmas = (
+            "PRAGMA journal_mode = WAL",
+            "PRAGMA synchronous = OFF",
+            "PRAGMA temp_store = MEMORY",
+            "PRAGMA cache_size = -65536"
+            )
+
     def working_file(self):
         sk = self.storage_key[0:2]
         pathargs = (
@@ -210,64 +266,91 @@ class Sqlite3KeyValueStorage(GenericStorage):
                 )
         return os.path.join(*pathargs)
 
+    def connect_to(self, filepath, read_only=False):
+        self._append_buffer = []
+        if read_only:
+            uri = "file:%s?mode=ro" % urllib.request.pathname2url(os.path.abspath(filepath))
+            self._storage = sqlite3.connect(uri, uri=True)
+        else:
+            self._storage = sqlite3.connect(filepath)
+        self._cursor = self._storage.cursor()
+
+    def copy_to_this(self):
+        """
+        Copies a database connected to read only in the object store, which
+        may be shared with other docs, to this/ so it can be written to.
+        """
+        self._storage.close()
+        copy_file(self.last_data_file(), self.this_data_file())
+        self.connected_to = 'existing'
+        self.connect_to(self.this_data_file())
+
     def connect(self):
-        self._append_counter = 0
         if self.wrapper.state in ('walked', 'checked', 'running'):
             if file_exists(self.this_data_file()):
                 self.connected_to = 'existing'
-                self._storage = sqlite3.connect(self.this_data_file())
-                self._cursor = self._storage.cursor()
-            elif file_exists(self.last_data_file()):
-                msg ="Should not only have last data file %s"
-                msgargs=(self.last_data_file())
-                raise dexy.exceptions.InternalDexyProblem(msg % msgargs)
+                self.connect_to(self.this_data_file())
+            elif self.data_file_exists(True):
+                # cached from a previous run, in the object store
+                self.connected_to = 'object-store'
+                self.connect_to(self.last_data_file(), True)
             else:
                 assert not os.path.exists(self.working_file())
                 assert os.path.exists(os.path.dirname(self.working_file()))
                 self.connected_to = 'working'
-                self._storage = sqlite3.connect(self.working_file())
-                self._cursor = self._storage.cursor()
+                self.connect_to(self.working_file())
+                for pragma in self.build_pragmas:
+                    self._storage.execute(pragma)
                 self._cursor.execute("CREATE TABLE kvstore (key TEXT, value TEXT)")
         elif self.wrapper.state == 'walked':
             raise dexy.exceptions.InternalDexyProblem("connect should not be called in 'walked' state")
         else:
             if file_exists(self.last_data_file()):
-                self._storage = sqlite3.connect(self.last_data_file())
-                self._cursor = self._storage.cursor()
+                self.connect_to(self.last_data_file(), True)
             elif file_exists(self.this_data_file()):
-                self._storage = sqlite3.connect(self.this_data_file())
-                self._cursor = self._storage.cursor()
+                self.connect_to(self.this_data_file())
             else:
                 raise dexy.exceptions.InternalDexyProblem("no data for %s" % self.storage_key)
 
     def append(self, key, value):
-        self._cursor.execute("INSERT INTO kvstore VALUES (?, ?)", (key, value))
-        self._append_counter += 1
-        if self._append_counter > 1000:
-            self.wrapper.log.debug("intermediate commit to sqlite db, resetting append counter to 0")
-            self._storage.commit()
-            self._append_counter = 0
+        if getattr(self, 'connected_to', None) == 'object-store':
+            self.copy_to_this()
+        self._append_buffer.append((key, value))
+        if len(self._append_buffer) >= self.append_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Inserts any buffered rows.
+        """
+        if self._append_buffer:
+            self._storage.executemany("INSERT INTO kvstore VALUES (?, ?)", self._append_buffer)
+            self._append_buffer = []
+
+    def execute(self, sql, args=()):
+        """
+        Runs sql with a new cursor, after inserting any buffered rows, so
+        results can be iterated over without fetching them all at once.
+        """
+        self.flush()
+        return self._storage.execute(sql, args)
 
     def keys(self):
-        self._cursor.execute("SELECT key from kvstore")
-        return [str(k[0]) for k in self._cursor.fetchall()]
+        return [str(row[0]) for row in self.execute("SELECT key from kvstore")]
 
     def items(self):
-        self._cursor.execute("SELECT key, value from kvstore")
-        for k in self._cursor.fetchall():
-            yield (str(k[0]), k[1])
+        for row in self.execute("SELECT key, value from kvstore"):
+            yield (str(row[0]), row[1])
 
     def value(self, key):
-        self._cursor.execute("SELECT value from kvstore where key = ?", (key,))
-        row = self._cursor.fetchone()
+        row = self.execute("SELECT value from kvstore where key = ?", (key,)).fetchone()
         if not row:
             raise Exception("No value found for key '%s'" % key)
         else:
             return row[0]
 
     def like(self, key):
-        self._cursor.execute("SELECT value from kvstore where key LIKE ?", (key,))
-        row = self._cursor.fetchone()
+        row = self.execute("SELECT value from kvstore where key LIKE ?", (key,)).fetchone()
         if not row:
             raise Exception("No value found for key '%s'" % key)
         else:
@@ -276,19 +359,32 @@ class Sqlite3KeyValueStorage(GenericStorage):
     def query(self, query):
         if not '%' in query:
             query = "%%%s%%" % query
-        self._cursor.execute("SELECT * from kvstore where key like ?", (query,))
-        return self._cursor.fetchall()
+        return self.execute("SELECT * from kvstore where key like ?", (query,)).fetchall()
 
     def __getitem__(self, key):
         return self.value(key)
 
     def persist(self):
-        if self.connected_to == 'existing':
-            assert os.path.exists(self.data_file(read=False))
+        if self.connected_to == 'object-store':
+            # Nothing has been appended, it would have been copied to this/.
+            pass
+        elif self.connected_to == 'existing':
+            assert os.path.exists(self.data_file())
+            self.flush()
+            self._storage.commit()
         elif self.connected_to == 'working':
-            self.assert_location_is_in_project_dir(self.data_file(read=False))
+            data_file = self.data_file(read=False)
+            self.assert_location_is_in_project_dir(data_file)
+            self.flush()
+            self._storage.execute("CREATE INDEX kvstore_key ON kvstore (key)")
             self._storage.commit()
-            shutil.copyfile(self.working_file(), self.data_file(read=False))
+            # Fold the write-ahead log back into the database file so the
+            # file is complete on its own, then move it into place.
+            self._storage.execute("PRAGMA journal_mode = DELETE")
+            self._storage.close()
+            os.replace(self.working_file(), data_file)
+            self.connected_to = 'existing'
+            self.connect_to(data_file)
         else:
             msg = "Unexpected 'connected_to' value %s"
             msgargs = self.connected_to
@@ -0,0 +1,103 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+class Tracer(object):
+    """
+    Records timed spans for parts of a dexy run and saves them as a JSON
+    trace in the Trace Event Format, which can be opened in Perfetto,
+    chrome://tracing or speedscope.
+
+    If filepath is empty, nothing is recorded.
+    """
+    def __init__(self, filepath=None):
+        self.filepath = filepath
+        self.events = []
+        self.local = threading.local()
+        self.pid = os.getpid()
+
+    def enabled(self):
+        return bool(self.filepath)
+
+    def set_worker(self, worker_id):
+        """
+        Sets the worker id which spans recorded in the current thread are
+        tagged with.
+        """
+        self.local.worker = worker_id
+
+    def worker(self):
+        return getattr(self.local, 'worker', 'main')
+
+    @contextlib.contextmanager
+    def span(self, name, category, doc=None, **args):
+        """
+        Records a span named name for the time taken by the body of the with
+        statement.
+        """
+        if not self.filepath:
+            yield
+            return
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            finish = time.time()
+            args['worker'] = self.worker()
+            if doc is not None:
+                args['doc'] = doc
+            self.events.append({
+                    'name' : name,
+                    'cat' : category,
+                    'ph' : 'X',
+                    'ts' : start * 1000000,
+                    'dur' : (finish - start) * 1000000,
+                    'pid' : self.pid,
+                    'args' : args
+                    })
+
+    def event_count(self):
+        return len(self.events)
+
+    def events_since(self, n):
+        """
+        Returns events recorded after the first n, used to send events
+        recorded in a worker process back to the main process.
+        """
+        return self.events[n:]
+
+    def add_events(self, events):
+        self.events.extend(events)
+
+    def save(self):
+        if not self.filepath:
+            return
+
+        # Show each worker as a thread of the main process.
+        lanes = {}
+        for event in self.events:
+            worker = event['args']['worker']
+            if not worker in lanes:
+                lanes[worker] = len(lanes)
+            event['tid'] = lanes[worker]
+
+        metadata = [{
+                'name' : 'thread_name',
+                'ph' : 'M',
+                'pid' : self.pid,
+                'tid' : tid,
+                'args' : {'name' : str(worker)}
+                } for worker, tid in lanes.items()]
+
+        info = {
+                'traceEvents' : metadata + self.events,
+                'displayTimeUnit' : 'ms'
+                }
+
+        tmp_filepath = "%s.tmp" % self.filepath
+        with open(tmp_filepath, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_filepath, self.filepath)
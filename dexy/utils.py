@@ -1,4 +1,7 @@
+import contextlib
 import dexy.exceptions
+import errno
+import gc
 import hashlib
 import inspect
 import json
@@ -8,23 +11,117 @@ import platform
 import posixpath
 import re
 import shutil
+import stat
 import tempfile
 import time
 import yaml
 
 is_windows = platform.system() in ('Windows',)
 
+# Use the libyaml parser when pyyaml has been built with it, it's much faster.
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# ioctl request number for FICLONE on linux, from linux/fs.h
+FICLONE = 0x40049409
+
+def reflink(source, destination):
+    """
+    Makes a copy-on-write clone of source at destination, on filesystems
+    which support it. Returns False if a clone can't be made.
+    """
+    if not platform.system() == 'Linux':
+        return False
+
+    import fcntl
+    try:
+        with open(source, 'rb') as src:
+            with open(destination, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except (IOError, OSError):
+        try:
+            os.remove(destination)
+        except OSError:
+            pass
+        return False
+
+def copy_file(source, destination):
+    """
+    Copies the contents of source to destination without passing them
+    through python. Uses copy_file_range where available, which lets the
+    kernel or filesystem do the copy and can share blocks on filesystems
+    which support it, otherwise shutil.copyfile, which uses sendfile on
+    Linux.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(source, 'rb') as src:
+                with open(destination, 'wb') as dst:
+                    remaining = os.fstat(src.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+            if remaining == 0:
+                return
+        except OSError as e:
+            # Not supported here, e.g. across filesystems on older kernels.
+            if not e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                    errno.EOPNOTSUPP, errno.EBADF):
+                raise
+
+    shutil.copyfile(source, destination)
+
+def is_writable(filepath):
+    """
+    Whether any write permission bits are set on filepath.
+    """
+    try:
+        mode = os.stat(filepath).st_mode
+    except OSError:
+        return True
+    return bool(mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def is_root():
+    """
+    Whether this process runs as root, which ignores file permissions.
+    """
+    return hasattr(os, 'geteuid') and os.geteuid() == 0
+
 def copy_or_link(data, destination, use_links=False, read_only_links=True):
     """
-    Copies or makes a hard link. Will copy if on windows or if use_links is False.
+    Copies or makes a link. Will copy if on windows or if use_links is False.
+
+    Links are copy-on-write clones where the filesystem supports them, or
+    else hard links. If read_only_links is True, only files which aren't
+    writable are hard linked, so changes in the workspace can't affect the
+    cache, and nothing is hard linked when running as root, since root can
+    write to read only files. Falls back to copying if a link can't be made,
+    e.g. across devices.
     """
     if is_windows or not use_links:
         data.output_to_file(destination)
-    else:
-        os.link(data.storage.data_file(), destination)
+        return
+
+    source = data.storage.data_file()
+
+    if reflink(source, destination):
+        return
+
+    if not read_only_links or not (is_writable(source) or is_root()):
+        try:
+            os.link(source, destination)
+            return
+        except OSError:
+            pass
+
+    data.output_to_file(destination)
 
 defaults = {
     'artifacts_dir' : '.dexy',
+    'batch_retention' : 10,
+    'cache_max_size' : '',
     'config_file' : 'dexy.conf',
     'configs' : '',
     'debug' : False,
@@ -39,24 +136,32 @@ defaults = {
     'hashfunction' : 'md5',
     'ignore_nonzero_exit' : False,
     'include' : '',
+    'jobs' : 1,
     'log_dir' : '.dexy',
     'log_file' : 'dexy.log',
     'log_format' : "%(name)s - %(levelname)s - %(message)s",
     'log_level' : "INFO",
+    'memory_pipeline' : True,
     'output_root' : '.',
     'parsers' : "dexy-env.json dexy.txt dexy.yaml",
     'pickle' : 'c',
     'plugins': 'dexyplugins.py dexyplugin.py dexyplugins.yaml dexyplugin.yaml',
     'profile' : False,
     'recurse' : True,
+    'repl_pool' : 0,
     'reports' : '',
     'safety_filename' : '.dexy-generated',
+    'shared_cache' : '',
+    'shared_cache_upload' : True,
     'siblings' : False,
     'silent' : False,
     'strace' : False,
     'target' : False,
+    'threads' : 0,
     'timing' : True,
+    'trace' : False,
     'uselocals' : False,
+    'workspace_mode' : 'copy',
     'writeanywhere' : False
 }
 
@@ -76,7 +181,9 @@ def transition(obj, new_state):
         msg = "%s -> %s"
         raise dexy.exceptions.UnexpectedState(msg % attempted_transition)
 
-    if not hasattr(obj, 'time_entered_current_state'):
+    # Checks the instance dict, hasattr would go through Data.__getattr__
+    # and raise and catch an exception for every new object.
+    if not 'time_entered_current_state' in obj.__dict__:
         obj.time_entered_current_state = None
         obj.state_history = []
   
@@ -96,9 +203,49 @@ def logging_log_level(log_level):
         msg = "'%s' is not a valid log level, check python logging module docs"
         raise dexy.exceptions.UserFeedback(msg % log_level)
 
+@contextlib.contextmanager
+def gc_paused():
+    """
+    Turns off the cyclic garbage collector while creating large numbers of
+    objects which stay alive, like parsed configs and nodes. The collector
+    would otherwise scan them over and over without freeing anything.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
 def md5_hash(text):
     return hashlib.md5(text.encode('utf-8')).hexdigest()
 
+SIZE_UNITS = {
+    'K' : 1024,
+    'M' : 1024 ** 2,
+    'G' : 1024 ** 3,
+    'T' : 1024 ** 4
+}
+
+def parse_size(size):
+    """
+    Returns a number of bytes for a size like "500M" or "2G", or a plain
+    number of bytes. Returns None if size is empty.
+    """
+    if not size:
+        return None
+
+    text = str(size).strip().upper().rstrip("B")
+    try:
+        if text[-1:] in SIZE_UNITS:
+            return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+        else:
+            return int(text)
+    except ValueError:
+        msg = "'%s' is not a valid size, use a number of bytes or a size like 500M or 2G"
+        raise dexy.exceptions.UserFeedback(msg % size)
+
 def dict_from_string(text):
     """
     Creates a dict from string like "key1=value1,k2=v2"
@@ -245,12 +392,24 @@ def parse_json_from_file(f):
         msg += str(e)
         raise dexy.exceptions.UserFeedback(msg)
 
+def load_yaml(input_text):
+    """
+    Loads yaml using the faster libyaml parser if available. On errors the
+    pure python parser is used so error messages are consistent.
+    """
+    try:
+        return yaml.load(input_text, Loader=SafeLoader)
+    except (yaml.scanner.ScannerError, yaml.parser.ParserError):
+        if SafeLoader is yaml.SafeLoader:
+            raise
+        return yaml.safe_load(input_text)
+
 def parse_yaml(input_text):
     """
     Parse a single YAML document.
     """
     try:
-        return yaml.safe_load(input_text)
+        return load_yaml(input_text)
     except (yaml.scanner.ScannerError, yaml.parser.ParserError) as e:
         if "found character '\\t'" in str(e):
             msg = "You appear to have hard tabs in your yaml, this is not supported. Please change to using soft tabs instead (your text editor should have this option)."
@@ -6,8 +6,15 @@ from dexy.utils import s
 import chardet
 import dexy.batch
 import dexy.doc
+import dexy.filehashes
+import dexy.filemap
+import dexy.log
+import dexy.objectstore
 import dexy.parser
 import dexy.reporter
+import dexy.scheduler
+import dexy.sharedcache
+import dexy.trace
 import dexy.utils
 import logging
 import logging.handlers
@@ -15,8 +22,10 @@ import os
 import pickle
 import posixpath
 import shutil
+import subprocess
 import sys
 import textwrap
+import threading
 import time
 import traceback
 import uuid
@@ -37,6 +46,8 @@ class Wrapper(object):
             ('checked', 'running'),
             ('running', 'error'),
             ('running', 'ran'),
+            ('ran', 'checked'),
+            ('error', 'checked'),
             )
 
     def printmsg(self, msg):
@@ -84,11 +95,46 @@ class Wrapper(object):
         self.project_root = os.path.abspath(os.getcwd())
         self.project_root_ts = "%s%s" % (self.project_root, os.sep)
         self.state = None
-        self.current_task = None
+        self.thread_state = threading.local()
         self.lookup_nodes = {} # map of shortcuts/keys to all nodes which can match
         self.lookup_sections = {} # map of section names to nodes
+        self.node_count = 0 # number of node ids handed out
+        self.node_count_lock = threading.Lock()
+        self.graph_version = 0 # incremented when inputs of existing nodes change
+        self.file_hashes = dexy.filehashes.FileHashIndex(self.hashfunction)
+        self.object_store = dexy.objectstore.ObjectStore(self.artifacts_dir,
+                self.hashfunction, bool(self.cache_max_size))
+        self.tracer = dexy.trace.Tracer(self.trace)
+        self.shared_store = dexy.sharedcache.shared_cache(self)
         self.transition('new')
 
+    def next_node_id(self):
+        """
+        Returns a new small integer to identify a node in this run. Safe to
+        call from -threads worker threads.
+        """
+        with self.node_count_lock:
+            self.node_count += 1
+            return self.node_count - 1
+
+    @property
+    def current_task(self):
+        """
+        The node being run by the current thread, if any.
+        """
+        return getattr(self.thread_state, 'current_task', None)
+
+    @current_task.setter
+    def current_task(self, node):
+        self.thread_state.current_task = node
+
+    def graph_changed(self):
+        """
+        Called when inputs or children are added to or removed from existing
+        nodes, so cached input closures are recalculated.
+        """
+        self.graph_version += 1
+
     def state_message(self):
         """
         A message to print at end of dexy run depending on the final wrapper state.
@@ -115,9 +161,14 @@ class Wrapper(object):
         self.nodes = {}
         self.roots = []
         self.batch = dexy.batch.Batch(self)
-        self.filemap = self.map_files()
-        self.ast = self.parse_configs()
-        self.ast.walk()
+        with self.tracer.span("map_files", "wrapper"):
+            self.filemap = self.map_files()
+        with self.tracer.span("parse_configs", "wrapper"):
+            self.ast = self.parse_configs()
+        with self.tracer.span("walk", "wrapper"):
+            self.ast.walk()
+        self.log.info("expanded %s file patterns in %0.3f seconds" % (
+            self.batch.pattern_count, self.batch.pattern_time))
 
     def to_walked(self):
         self.walk()
@@ -131,12 +182,17 @@ class Wrapper(object):
 
         # Load information about arguments from previous batch.
         self.load_node_argstrings()
+        self.load_file_hashes()
+        self.object_store.load()
 
-        self.check_cache()
-        self.consolidate_cache()
+        with self.tracer.span("check_cache", "wrapper"):
+            self.check_cache()
+        with self.tracer.span("consolidate_cache", "wrapper"):
+            self.consolidate_cache()
 
         # Save information about this batch's arguments for next time.
         self.save_node_argstrings()
+        self.save_file_hashes()
 
     def check_cache(self):
         """
@@ -147,12 +203,15 @@ class Wrapper(object):
 
     def consolidate_cache(self):
         """
-        Move all cache files from last/ cache to this/ cache
+        Mark cache files in the object store which are still valid to be
+        kept, and those which are out of date to be replaced.
         """
         for node in self.roots:
             node.consolidate_cache_files()
 
-        self.trash(self.last_cache_dir())
+        # last/ dir from older dexy versions
+        if os.path.exists(self.last_cache_dir()):
+            self.trash(self.last_cache_dir())
 
     def to_checked(self):
         self.check()
@@ -201,9 +260,24 @@ class Wrapper(object):
         except IOError:
             pass
 
-    def empty_trash(self):
+    def empty_trash(self, max_seconds=None):
+        """
+        Deletes the contents of the .trash directory. If max_seconds is set
+        and deleting takes longer, whatever is left is deleted by a background
+        process, so a large cache doesn't hold up the end of a run.
+        """
+        if max_seconds is not None:
+            deadline = time.time() + max_seconds
+        else:
+            deadline = None
+
         for dirpath, dirnames, filenames in os.walk(self.trash_dir(), topdown=False):
             for f in filenames:
+                # Check for each file, a single directory of evicted cache
+                # files may hold most of the trash.
+                if deadline and time.time() > deadline:
+                    self.empty_trash_in_background()
+                    return
                 filepath = os.path.join(dirpath, f)
                 os.remove(filepath)
 
@@ -218,6 +292,84 @@ class Wrapper(object):
                 print((os.lstat(dirpath)))
                 shutil.rmtree(dirpath)
 
+    def empty_trash_in_background(self):
+        """
+        Starts a process, which keeps going after dexy exits, to delete the
+        contents of the .trash directory.
+        """
+        paths = [entry.path for entry in os.scandir(self.trash_dir())]
+        script = textwrap.dedent("""\
+            import os, shutil, sys
+            for path in sys.argv[1:]:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, True)
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            """)
+        self.log.debug("deleting %s trash dirs in background", len(paths))
+        subprocess.Popen([sys.executable, "-c", script] + paths,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                close_fds=True,
+                start_new_session=(os.name == 'posix'))
+
+    def collect_garbage(self, vacuum=False):
+        """
+        Removes information about batches beyond batch-retention, moves cache
+        files which are no longer referenced to the trash and, if the object
+        store is larger than cache-max-size, also moves the least recently
+        used cache files to the trash. Highlighted code and compiled
+        templates which recent batches haven't used are removed. If vacuum is
+        set, the object store's files are checked on disk even if its
+        recorded sizes show there is nothing to remove.
+
+        Returns the number of batches removed, and the number and total size
+        of cache files removed.
+        """
+        n_batches = dexy.batch.Batch(self).remove_old_batches(
+                int(self.batch_retention), vacuum)
+
+        max_size = dexy.utils.parse_size(self.cache_max_size)
+        trash_dir = os.path.join(self.trash_dir(), str(uuid.uuid4()))
+        self.object_store.manifest_entries()
+        sizes_known = self.object_store.sizes is not None
+        n_objects, size = self.object_store.collect_garbage(trash_dir, max_size,
+                scan=vacuum)
+        if n_objects or not sizes_known:
+            # Also save sizes found by checking objects on disk.
+            self.object_store.save()
+
+        self.collect_compiled_garbage(vacuum)
+
+        return n_batches, n_objects, size
+
+    def collect_compiled_garbage(self, vacuum=False):
+        """
+        Removes highlighted code and compiled templates which none of the
+        batches being kept have used. Nothing is removed until there are
+        batch-retention batches.
+        """
+        unused_since = dexy.batch.Batch(self).retention_start_time(
+                int(self.batch_retention))
+        if unused_since is None:
+            return
+
+        # Only import the modules if they have stored anything.
+        if os.path.exists(os.path.join(self.artifacts_dir, "highlight.sqlite3")):
+            from dexy.filters import pyg
+            cache = pyg.highlight_cache(self)
+            n = cache.collect_garbage(unused_since, vacuum)
+            self.log.debug("removed %s unused highlighted code blocks", n)
+
+        if os.path.exists(os.path.join(self.artifacts_dir, "jinja")):
+            from dexy import jinjaenv
+            n = jinjaenv.collect_garbage(self, unused_since)
+            self.log.debug("removed %s unused compiled templates", n)
+
     def reset_work_cache_dir(self):
         # remove work/ dir leftover from previous run (if any) and create a new
         # work/ dir for this run
@@ -236,9 +388,13 @@ class Wrapper(object):
             matches = self.roots
 
         try:
-            for node in matches:
-                for task in node:
-                    task()
+            if self.use_scheduler():
+                scheduler = dexy.scheduler.Scheduler(self, int(self.jobs), int(self.threads))
+                scheduler.run(matches)
+            else:
+                for node in matches:
+                    for task in node:
+                        task()
 
         except Exception as e:
             self.error = e
@@ -257,15 +413,51 @@ class Wrapper(object):
         else:
             self.after_successful_run()
 
+        finally:
+            self.close_repl_pools()
+            self.tracer.save()
+
+    def close_repl_pools(self):
+        """
+        Closes REPL processes which were started ahead of time but not used.
+        The pexpect filters are only imported if a document used them.
+        """
+        pexp = sys.modules.get('dexy.filters.pexp')
+        if pexp is not None:
+            pexp.close_repl_pools()
+
+    def use_scheduler(self):
+        """
+        Whether to run nodes in parallel worker processes or threads.
+        """
+        if int(self.jobs) > 1 and not dexy.scheduler.Scheduler.is_available():
+            self.log.warn("parallel jobs need the 'fork' start method, running serially")
+            self.jobs = 1
+
+        return int(self.jobs) > 1 or int(self.threads) > 0
+
     def after_successful_run(self):
         self.transition('ran')
         self.batch.end_time = time.time()
         self.batch.save_to_file()
-        shutil.move(self.this_cache_dir(), self.last_cache_dir())
-        self.empty_trash()
+        if self.shared_store:
+            with self.tracer.span("upload_shared_cache", "wrapper"):
+                self.shared_store.store_docs()
+            self.log.info("shared cache: %(hits)s hits, %(misses)s misses, %(uploads)s uploads, %(errors)s errors" % self.shared_store.stats())
+        self.object_store.add_dir(self.this_cache_dir())
+        self.object_store.save()
+        self.save_file_hashes()
+        with self.tracer.span("collect_garbage", "wrapper"):
+            n_batches, n_objects, size = self.collect_garbage()
+        if n_batches or n_objects:
+            msg = "removed %s old batches and %s cache files (%s bytes)"
+            self.log.info(msg, n_batches, n_objects, size)
+        self.empty_trash(max_seconds=1)
         self.add_lookups()
 
     def add_lookups(self):
+        self.lookup_nodes = {}
+        self.lookup_sections = {}
         for data in self.batch:
             data.add_to_lookup_sections()
             data.add_to_lookup_nodes()
@@ -320,6 +512,62 @@ class Wrapper(object):
         self.to_checked()
         self.run()
 
+    def changed_documents(self):
+        """
+        Returns documents based on project files whose contents have changed
+        since they were last copied into the cache.
+        """
+        return [doc for doc in self.documents()
+                if doc.name in self.filemap and doc.check_doc_changed()]
+
+    def dependent_nodes(self, nodes):
+        """
+        Returns the passed nodes and every node which depends on them,
+        directly or indirectly. All members of a script bundle are included if
+        any one of them is, since they run in sequence.
+        """
+        dependents = {}
+        for node in self.nodes.values():
+            for input_node in node.input_nodes(True):
+                dependents.setdefault(input_node, []).append(node)
+
+        affected = set()
+        to_visit = list(nodes)
+        while to_visit:
+            node = to_visit.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            to_visit.extend(dependents.get(node, []))
+            if hasattr(node, 'parent') and hasattr(node.parent, 'script_storage'):
+                to_visit.extend(node.parent.inputs)
+
+        return affected
+
+    def rerun(self, changed_docs):
+        """
+        Runs again after a completed run, only running the changed documents
+        and the nodes which depend on them. Everything else is used as-is from
+        the previous run.
+        """
+        self.reset_work_cache_dir()
+
+        stuck = [n for n in self.nodes.values() if n.state == 'running']
+        affected = self.dependent_nodes(list(changed_docs) + stuck)
+
+        for node in affected:
+            if hasattr(node, 'script_storage'):
+                node.script_storage = {}
+            node.reset_for_rerun()
+
+        for doc in changed_docs:
+            doc.doc_changed = True
+
+        self.transition('checked')
+        self.run()
+
+        return affected
+
     # Attributes
     def initialize_attribute_defaults(self):
         """
@@ -365,6 +613,19 @@ class Wrapper(object):
         except IOError:
             self.saved_args = {}
 
+    def file_hashes_filename(self):
+        return os.path.join(self.artifacts_dir, 'filehashes.pickle')
+
+    def load_file_hashes(self):
+        """
+        Load content hashes of project files and cached copies of them, so
+        files whose stat info hasn't changed don't need to be hashed again.
+        """
+        self.file_hashes.load(self.file_hashes_filename())
+
+    def save_file_hashes(self):
+        self.file_hashes.save(self.file_hashes_filename())
+
     # Dexy Dirs
     def iter_dexy_dirs(self):
         """
@@ -517,8 +778,10 @@ class Wrapper(object):
     def setup_log(self):
         """
         Creates a logger and assigns it to 'log' attribute of wrapper.
+
+        Records are written to the log file from a background thread.
         """
-        formatter = logging.Formatter(self.log_format)
+        formatter = dexy.log.log_formatter(self.log_format)
         log_level = dexy.utils.logging_log_level(self.log_level)
 
         handler = logging.handlers.RotatingFileHandler(
@@ -529,12 +792,13 @@ class Wrapper(object):
 
         self.log = logging.getLogger('dexy')
         self.log.setLevel(log_level)
-        self.log.addHandler(handler)
+        self.log_writer = dexy.log.QueuedLogWriter(self.log, handler)
+        self.log_writer.start()
         self.log.info("starting logging for dexy")
         self.log_handler = handler
 
     def flush_logs(self):
-        self.log_handler.flush()
+        self.log_writer.flush()
 
     # Project files
     def exclude_dirs(self):
@@ -560,31 +824,50 @@ class Wrapper(object):
         dirs_and_nones = [i.setting('dir') for i in dexy.reporter.Reporter]
         return [d for d in dirs_and_nones if d]
 
+    def filemap_snapshot_filename(self):
+        return os.path.join(self.artifacts_dir, 'filemap.pickle')
+
     def map_files(self):
         """
         Generates a map of files present in the project directory.
+
+        Directory listings are reused from the last scan for directories
+        whose mtime hasn't changed, and file stat info is only looked up
+        when it is needed.
         """
         exclude = self.exclude_dirs()
-        filemap = {}
+        filemap = dexy.filemap.FileMap()
+
+        snapshot = dexy.filemap.DirectorySnapshot(
+                self.filemap_snapshot_filename(),
+                (exclude, self.include))
 
-        for dirpath, dirnames, filenames in os.walk('.', followlinks=True):
-            for x in exclude:
-                if x in dirnames and not x in self.include:
-                    dirnames.remove(x)
+        def scan(dirpath):
+            filenames, dirnames, entries = snapshot.listing(dirpath)
 
             if '.nodexy' in filenames:
-                dirnames[:] = []
+                return
             elif 'pip-delete-this-directory.txt' in filenames:
                 msg = s("""pip left an old build/ file lying around,
                 please remove this before running dexy""")
                 raise UserFeedback(msg)
-            else:
-                for filename in filenames:
-                    filepath = posixpath.normpath(posixpath.join(dirpath, filename))
-                    filemap[filepath] = {}
-                    filemap[filepath]['stat'] = os.stat(os.path.join(dirpath, filename))
-                    filemap[filepath]['ospath'] = os.path.normpath(os.path.join(dirpath, filename))
-                    filemap[filepath]['dir'] = os.path.normpath(dirpath)
+
+            normdir = os.path.normpath(dirpath)
+            for filename in filenames:
+                filepath = posixpath.normpath(posixpath.join(dirpath, filename))
+                ospath = os.path.normpath(os.path.join(dirpath, filename))
+                filemap[filepath] = dexy.filemap.FileInfo(ospath, normdir,
+                        entries.get(filename))
+
+            for dirname in dirnames:
+                if dirname in exclude and not dirname in self.include:
+                    continue
+                scan(os.path.join(dirpath, dirname))
+
+        scan('.')
+
+        if os.path.isdir(self.artifacts_dir):
+            snapshot.save()
 
         return filemap
 
@@ -602,6 +885,16 @@ class Wrapper(object):
         key = node.key_with_class()
         self.nodes[key] = node
 
+    def remove_node(self, node):
+        """
+        Removes a node which was added while running, such as an additional
+        doc, from nodes and the batch. The lookup maps are rebuilt from the
+        batch after each run.
+        """
+        self.nodes.pop(node.key_with_class(), None)
+        if hasattr(self, 'batch'):
+            self.batch.remove_doc(node)
+
     def add_data_to_lookup_nodes(self, key, data):
         if not key in self.lookup_nodes:
             self.lookup_nodes[key] = []
@@ -709,7 +1002,8 @@ class Wrapper(object):
 
                         try:
                             processed_configs.append(filepath)
-                            parser.parse(dirname, config_text)
+                            with dexy.utils.gc_paused():
+                                parser.parse(dirname, config_text)
                         except UserFeedback:
                             sys.stderr.write("Problem occurred while parsing %s\n" % config_file)
                             raise
@@ -735,7 +1029,10 @@ class Wrapper(object):
         for reporter in reporters:
             if self.state in reporter.setting('run-for-wrapper-states'):
                 self.log.debug("running reporter %s" % reporter.aliases[0])
-                reporter.run(self)
+                with self.tracer.span(reporter.aliases[0], "reporter"):
+                    reporter.run(self)
+
+        self.tracer.save()
 
     def is_location_in_project_dir(self, filepath):
         return self.writeanywhere or (self.project_root_ts in os.path.abspath(filepath))
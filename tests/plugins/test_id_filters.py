@@ -2,10 +2,15 @@ from dexy.doc import Doc
 from dexy.exceptions import UserFeedback
 from dexy.filters.id import lexer as id_lexer
 from dexy.filters.id import parser as id_parser
+from dexy.filters.id import MAYBE_IDIO, write_tables
 from dexy.filters.id import start_new_section, token_info
+from dexy.utils import tempdir
 from tests.utils import TEST_DATA_DIR
 from tests.utils import wrap
+import importlib
+import importlib.util
 import os
+import threading
 
 def test_force_text():
     with wrap() as wrapper:
@@ -185,3 +190,52 @@ def test_parse_php_mixed_tags():
     assert "assign-variables" in section_names
     assert "compare" in section_names
     assert "display-variables" in section_names
+
+def test_shipped_tables_match_grammar():
+    with tempdir():
+        write_tables(os.path.abspath("."))
+        for name in ('id_lextab', 'id_parsetab'):
+            spec = importlib.util.spec_from_file_location(name, "%s.py" % name)
+            generated = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(generated)
+            shipped = importlib.import_module("dexy.filters.%s" % name)
+            for k, v in vars(generated).items():
+                if k == '_lr_productions':
+                    # Ignore line numbers of rules.
+                    v = [p[0:4] for p in v]
+                    shipped_v = [p[0:4] for p in shipped._lr_productions]
+                elif k.startswith("_l"):
+                    shipped_v = getattr(shipped, k)
+                else:
+                    continue
+                assert shipped_v == v, "run python -m dexy.filters.id"
+
+def test_text_without_markers_is_not_parsed():
+    for text in ("foo\n", "  # foo bar\nfoo\n", "foo bar ## baz\n", "#!/bin/sh\n"):
+        assert not MAYBE_IDIO.search(text)
+        assert parse(text + "\n")[0]['contents'] == text + "\n"
+
+    with wrap() as wrapper:
+        doc = Doc("example.py|idio|t",
+                wrapper,
+                [],
+                contents="  # foo bar\nfoo\n")
+        wrapper.run_docs(doc)
+        assert list(doc.output_data().keys()) == ['1']
+        assert str(doc.output_data()) == "  # foo bar\nfoo\n"
+
+def test_parse_in_thread():
+    src = "x = 1\n### @export \"vars\"\nx = 6\n"
+    results = []
+    def run_filter():
+        with wrap() as wrapper:
+            doc = Doc("example.py|idio|t", wrapper, [], contents=src)
+            wrapper.run_docs(doc)
+            results.append([(k, str(v)) for k, v in doc.output_data().items()])
+
+    thread = threading.Thread(target=run_filter)
+    thread.start()
+    thread.join()
+    run_filter()
+    assert results[0] == [('1', 'x = 1\n'), ('vars', 'x = 6\n')]
+    assert results[0] == results[1]
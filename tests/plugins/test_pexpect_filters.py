@@ -2,6 +2,8 @@ from dexy.doc import Doc
 from tests.utils import assert_in_output
 from tests.utils import wrap
 from nose.exc import SkipTest
+import dexy.filters.pexp
+import os
 
 def test_shint_filter():
     with wrap() as wrapper:
@@ -134,3 +136,51 @@ x*y
 >>> x*y
 42"""
 
+
+def test_pycon_filter_warm_pool():
+    with wrap() as wrapper:
+        wrapper.repl_pool = 1
+        docs = [Doc("example%s.py|pycon" % i,
+                    wrapper,
+                    [],
+                    pycon = { 'batch-send' : batch_send },
+                    contents = "import os\nos.path.basename(os.getcwd())\nx = 6\nx*7\n")
+                for i, batch_send in enumerate((False, True, False))]
+
+        pool = dexy.filters.pexp.repl_pool(1)
+        wrapper.run_docs(*docs)
+
+        assert pool.hits >= 2
+        assert pool.hits + pool.misses == 3
+        # Spares left over at the end of the run are closed.
+        assert not pool.spares
+        for doc in docs:
+            wd = os.path.basename(os.path.normpath(doc.filters[0].parent_work_dir()))
+            assert str(doc.output_data()).endswith(""">>> import os
+>>> os.path.basename(os.getcwd())
+'%s'
+>>> x = 6
+>>> x*7
+42""" % wd)
+        dexy.filters.pexp.close_repl_pools()
+
+def test_pycon_filter_warm_pool_with_jobs():
+    with wrap() as wrapper:
+        wrapper.repl_pool = 1
+        wrapper.jobs = 2
+        docs = [Doc("example%s.py|pycon" % i,
+                    wrapper,
+                    [],
+                    contents = "x = 6\nx*7\n")
+                for i in range(3)]
+
+        # Docs run in the main process, where they can use its pool.
+        pool = dexy.filters.pexp.repl_pool(1)
+        wrapper.run_docs(*docs)
+        wrapper.validate_state('ran')
+
+        assert pool.hits >= 2
+        assert pool.hits + pool.misses == 3
+        for doc in docs:
+            assert str(doc.output_data()).endswith(">>> x*7\n42")
+        dexy.filters.pexp.close_repl_pools()
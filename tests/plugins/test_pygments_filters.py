@@ -3,6 +3,14 @@ from tests.utils import assert_in_output
 from tests.utils import assert_output
 from tests.utils import assert_output_cached
 from tests.utils import wrap
+from dexy.wrapper import Wrapper
+from mock import MagicMock
+from mock import patch
+import dexy.filters.pyg
+import pygments.formatter
+import os
+import sys
+import time
 
 def test_pyg4rst():
     o = {}
@@ -82,3 +90,121 @@ def test_pygments_line_numbering_latex_alt():
                 )
         wrapper.run_docs(doc)
         assert "firstnumber=1" in str(doc.output_data())
+
+SECTIONED_PYTHON = """### @export "imports"
+import os
+import sys
+
+### @export "hello"
+print("%s")
+"""
+
+def test_pygments_highlight_cache():
+    with wrap() as wrapper:
+        cache = dexy.filters.pyg.highlight_cache(wrapper)
+        with open("example.py", "w") as f:
+            f.write(SECTIONED_PYTHON % "hello")
+        doc = Doc("example.py|idio|t|pyg", wrapper, [])
+        wrapper.run_docs(doc)
+        first_output = str(doc.output_data()['imports'])
+        hits = cache.hits
+
+        # Only the changed section is highlighted again.
+        with open("example.py", "w") as f:
+            f.write(SECTIONED_PYTHON % "goodbye")
+        wrapper = Wrapper()
+        doc = Doc("example.py|idio|t|pyg", wrapper, [])
+        wrapper.run_docs(doc)
+        assert cache.hits == hits + 2
+        assert str(doc.output_data()['imports']) == first_output
+        assert "goodbye" in str(doc.output_data()['hello'])
+
+def highlight_keys(wrapper):
+    conn = dexy.filters.pyg.highlight_cache(wrapper).connect()
+    return set(row[0] for row in conn.execute("SELECT key FROM highlights"))
+
+def test_pygments_highlight_cache_garbage_collected():
+    with wrap() as wrapper:
+        with open("example.py", "w") as f:
+            f.write(SECTIONED_PYTHON % "hello")
+        doc = Doc("example.py|idio|t|pyg", wrapper, [])
+        wrapper.run_docs(doc)
+        first_keys = highlight_keys(wrapper)
+
+        with open("example.py", "w") as f:
+            f.write(SECTIONED_PYTHON % "goodbye")
+        wrapper = Wrapper(batch_retention=1)
+        doc = Doc("example.py|idio|t|pyg", wrapper, [])
+        wrapper.run_docs(doc)
+        second_keys = highlight_keys(wrapper)
+
+        # The section only highlighted in the first run is removed.
+        assert len(first_keys - second_keys) == 1
+        assert len(second_keys - first_keys) == 1
+
+def test_highlight_cache_adds_used_column():
+    with wrap() as wrapper:
+        import sqlite3
+        filepath = os.path.abspath("old.sqlite3")
+        conn = sqlite3.connect(filepath)
+        conn.execute("CREATE TABLE highlights (key TEXT PRIMARY KEY, output BLOB)")
+        conn.execute("INSERT INTO highlights VALUES ('abc', 'output')")
+        conn.commit()
+        conn.close()
+
+        cache = dexy.filters.pyg.HighlightCache(filepath)
+        assert cache.get(['abc']) == {'abc' : 'output'}
+        cache.put({'def' : 'other output'})
+        assert cache.collect_garbage(0) == 0
+        assert cache.collect_garbage(time.time() + 1) == 2
+
+def test_pygments_processes():
+    with wrap() as wrapper:
+        doc = Doc("example.py|idio|t|pyg", wrapper, [],
+                contents=SECTIONED_PYTHON % "hello",
+                pyg = { 'cache' : False })
+        parallel_doc = Doc("parallel/example.py|idio|t|pyg", wrapper, [],
+                contents=SECTIONED_PYTHON % "hello",
+                pyg = { 'cache' : False, 'processes' : 2,
+                    'min-parallel-sections' : 1 })
+        wrapper.run_docs(doc, parallel_doc)
+        for name in ('imports', 'hello'):
+            expected = str(doc.output_data()[name])
+            actual = str(parallel_doc.output_data()[name])
+            assert actual == expected.replace("example.py", "parallel--example.py")
+
+class RecordingFormatter(pygments.formatter.Formatter):
+    """
+    Keeps state between calls to format(), as pygments' ImageFormatter does.
+    """
+    def __init__(self, **options):
+        pygments.formatter.Formatter.__init__(self, encoding='utf-8', **options)
+        self.seen = []
+
+    def format(self, tokensource, outfile):
+        self.seen.append("".join(value for ttype, value in tokensource))
+        outfile.write("|".join(self.seen).encode('utf-8'))
+
+def test_pygments_image_formatter_per_section():
+    create_text_formatter = dexy.filters.pyg.PygmentsFilter.create_formatter_instance
+
+    def create_formatter_instance(self):
+        if self.ext in self.IMAGE_OUTPUT_EXTENSIONS:
+            return RecordingFormatter()
+        else:
+            return create_text_formatter(self)
+
+    with patch.dict(sys.modules, { 'PIL' : MagicMock() }):
+        with patch.object(dexy.filters.pyg.PygmentsFilter,
+                'create_formatter_instance', create_formatter_instance):
+            with wrap() as wrapper:
+                doc = Doc("example.py|idio|t|pyg|pn", wrapper, [],
+                        contents=SECTIONED_PYTHON % "hello")
+                wrapper.run_docs(doc)
+
+                imports = wrapper.nodes["doc:example.py--idio--t--pyg--pn--imports.png"]
+                hello = wrapper.nodes["doc:example.py--idio--t--pyg--pn--hello.png"]
+                assert b"|" not in imports.output_data().data()
+                assert b"|" not in hello.output_data().data()
+                assert b"import os" not in hello.output_data().data()
+                assert "|" not in str(doc.output_data())
@@ -20,10 +20,11 @@ int main()
 
 def test_mkdirs():
     with wrap() as wrapper:
+        mkdirs = ['bar', 'baz']
         doc = Doc("hello.c|c",
                 wrapper,
                 contents = C_HELLO_WORLD,
-                c = {'mkdir' : 'foo', 'mkdirs' : ['bar', 'baz']}
+                c = {'mkdir' : 'foo', 'mkdirs' : mkdirs}
                 )
         wrapper.run_docs(doc)
         dirs = os.listdir(doc.filters[-1].workspace())
@@ -31,6 +32,9 @@ def test_mkdirs():
         assert 'bar' in dirs
         assert 'baz' in dirs
 
+        # args may be shared between docs, so must not be changed
+        assert mkdirs == ['bar', 'baz']
+
 def test_taverna():
     raise SkipTest()
     with wrap() as wrapper:
@@ -245,3 +249,105 @@ LATEX = """\
 Hello!
 \end{document}
 """
+
+TIMED_SCRIPT = """echo "start %(i)s $(date +%%s.%%N)" >> %(log)s
+sleep 0.2
+echo "end %(i)s $(date +%%s.%%N)" >> %(log)s
+echo hello %(i)s
+"""
+
+def read_run_times(log):
+    """
+    Returns (start, end) times logged by each TIMED_SCRIPT.
+    """
+    times = {}
+    with open(log, "r") as f:
+        for line in f:
+            event, i, t = line.split()
+            times.setdefault(i, {})[event] = float(t)
+    return [(t['start'], t['end']) for t in times.values()]
+
+def max_overlapping(times):
+    """
+    Returns the largest number of (start, end) intervals which overlap.
+    """
+    events = sorted([(start, 1) for start, end in times] +
+            [(end, -1) for start, end in times])
+    running = 0
+    most = 0
+    for t, change in events:
+        running += change
+        most = max(most, running)
+    return most
+
+def run_timed_scripts(alias, max_concurrent, trace=None):
+    log = os.path.abspath("times.log")
+    with open("dexy.yaml", "w") as f:
+        f.write("""
+        .sh|%s:
+            - %s: { max-concurrent: %s }
+        """ % (alias, alias, max_concurrent))
+
+    for i in range(4):
+        with open("script%s.sh" % i, "w") as f:
+            f.write(TIMED_SCRIPT % {'i' : i, 'log' : log})
+
+    wrapper = Wrapper(threads=3, trace=trace)
+    wrapper.run_from_new()
+    wrapper.validate_state('ran')
+
+    times = read_run_times(log)
+    assert len(times) == 4
+    return wrapper, times
+
+def test_run_in_threads_with_max_concurrent():
+    with wrap():
+        wrapper, times = run_timed_scripts('sh', 1)
+        assert max_overlapping(times) == 1
+
+        for i in range(4):
+            doc = wrapper.nodes["doc:script%s.sh|sh" % i]
+            assert str(doc.output_data()) == "hello %s\n" % i
+
+def test_subprocess_span_excludes_wait_for_max_concurrent():
+    with wrap():
+        wrapper, times = run_timed_scripts('sh', 1, "trace.json")
+        spans = [(e['ts'], e['ts'] + e['dur']) for e in wrapper.tracer.events
+                if e['name'] == 'subprocess']
+        assert len(spans) == 4
+        assert max_overlapping(spans) == 1
+
+def test_run_in_threads_with_max_concurrent_2():
+    with wrap():
+        wrapper, times = run_timed_scripts('sh', 2)
+        assert max_overlapping(times) <= 2
+
+def test_run_repl_in_threads_with_max_concurrent():
+    with wrap():
+        wrapper, times = run_timed_scripts('shint', 1)
+        assert max_overlapping(times) == 1
+
+def test_main_thread_docs_wait_for_threads():
+    with wrap():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            - slow.sh|sh
+            - hello.txt|dexy
+            """)
+
+        with open("slow.sh", "w") as f:
+            f.write("sleep 0.3")
+
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        wrapper = Wrapper(threads=2, trace="trace.json")
+        wrapper.run_from_new()
+        wrapper.validate_state('ran')
+
+        spans = dict((e['name'], e) for e in wrapper.tracer.events)
+        thread_span = spans['sh']
+        main_span = spans['dexy']
+        assert thread_span['args']['worker'] == 'thread 0'
+        assert main_span['args']['worker'] == 'main'
+        assert main_span['ts'] >= thread_span['ts'] + thread_span['dur']
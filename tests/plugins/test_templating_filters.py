@@ -1,9 +1,11 @@
 from dexy.doc import Doc
+from dexy.wrapper import Wrapper
 #from dexy.utils import char_diff
 from dexy.filters.templating import TemplateFilter
 from dexy.filters.templating_plugins import TemplatePlugin
 from tests.utils import wrap
 from dexy.exceptions import UserFeedback
+import os
 
 def test_jinja_invalid_attribute():
     def make_sections_doc(wrapper):
@@ -245,6 +247,30 @@ def test_jinja_filter_inputs():
         wrapper.run_docs(node)
         assert str(node.output_data()) == "The input is 'I am the input.'"
 
+def test_jinja_lazy_workspace():
+    with wrap() as wrapper:
+        wrapper.workspace_mode = 'lazy'
+        node = Doc("template.txt|jinja",
+                wrapper,
+                [
+                    Doc("macros.jinja",
+                        wrapper,
+                        [],
+                        contents = "{% macro hello() %}hello{% endmacro %}"),
+                    Doc("unused.jinja",
+                        wrapper,
+                        [],
+                        contents = "not used")
+                ],
+                contents = "{% from 'macros.jinja' import hello %}{{ hello() }}")
+
+        wrapper.run_docs(node)
+        assert str(node.output_data()) == "hello"
+
+        workspace = node.filters[-1].workspace()
+        assert os.path.exists(os.path.join(workspace, "macros.jinja"))
+        assert not os.path.exists(os.path.join(workspace, "unused.jinja"))
+
 class TestSimple(TemplatePlugin):
     """
     test plugin
@@ -331,3 +357,64 @@ def test_jinja_filter_using_inflection():
 
         wrapper.run_docs(node)
         assert node.output_data().as_text() == "Abc def"
+
+def test_jinja_environment_shared_and_bytecode_cached():
+    with wrap() as wrapper:
+        with open("_layout.txt", "w") as f:
+            f.write("layout: {% block body %}{% endblock %}")
+
+        def make_docs(wrapper):
+            a = Doc("a.txt|jinja", wrapper, [Doc("_layout.txt", wrapper, [])],
+                    contents = """{% extends "_layout.txt" %}{% block body %}a {{ 1 + 1 }}{% endblock %}""")
+            b = Doc("b.txt|jinja", wrapper, [Doc("_layout.txt", wrapper, [])],
+                    contents = """{% extends "_layout.txt" %}{% block body %}b {{ 2 + 2 }}{% endblock %}""")
+            c = Doc("c.txt|jinja", wrapper, [],
+                    contents = """c %- 3 + 3 -%""",
+                    jinja = { "variable_start_string" : "%-", "variable_end_string" : "-%" })
+            return a, b, c
+
+        a, b, c = make_docs(wrapper)
+        wrapper.run_docs(a, b, c)
+        assert str(a.output_data()) == "layout: a 2"
+        assert str(b.output_data()) == "layout: b 4"
+        assert str(c.output_data()) == "c 6"
+
+        # Docs with the same settings share an environment, c has its own.
+        a_env = a.filters[-1].jinja_environment(None)
+        b_env = b.filters[-1].jinja_environment(None)
+        c_env = c.filters[-1].jinja_environment(None)
+        assert a_env.linked_to is b_env.linked_to
+        assert a_env.linked_to is not c_env.linked_to
+
+        cache_dir = os.path.join(wrapper.artifacts_dir, "jinja")
+        assert len(os.listdir(cache_dir)) == 2
+        cached = os.listdir(a_env.bytecode_cache.directory)
+        assert len(cached) == 3
+
+def test_jinja_bytecode_garbage_collected():
+    with wrap():
+        with open("a.txt", "w") as f:
+            f.write("a {{ d['input.txt'] }}")
+        with open("b.txt", "w") as f:
+            f.write("b {{ 2 + 2 }}")
+        with open("input.txt", "w") as f:
+            f.write("first")
+        with open("dexy.yaml", "w") as f:
+            f.write("- a.txt|jinja:\n    - input.txt\n- b.txt|jinja")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        cache_dir = os.path.join(wrapper.artifacts_dir, "jinja")
+        cache_dir = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        assert len(os.listdir(cache_dir)) == 2
+
+        # Compiled templates which the kept batches didn't use are removed.
+        with open("input.txt", "w") as f:
+            f.write("second")
+        with open("dexy.yaml", "w") as f:
+            f.write("- a.txt|jinja:\n    - input.txt")
+
+        wrapper = Wrapper(batch_retention=1)
+        wrapper.run_from_new()
+        assert str(wrapper.nodes['doc:a.txt|jinja'].output_data()) == "a second"
+        assert len(os.listdir(cache_dir)) == 1
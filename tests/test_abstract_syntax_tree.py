@@ -24,3 +24,58 @@ def test_ast():
         ast.walk()
         assert len(wrapper.roots) == 1
         assert len(wrapper.nodes) == 2
+
+def test_ast_roots():
+    with wrap() as wrapper:
+        wrapper.filemap = wrapper.map_files()
+
+        ast = AbstractSyntaxTree(wrapper)
+        ast.add_node("a.txt")
+        ast.add_node("b.txt")
+        ast.add_node("c.txt")
+        assert ast.tree == ['doc:a.txt', 'doc:b.txt', 'doc:c.txt']
+
+        ast.add_dependency("c.txt", "a.txt")
+        assert ast.tree == ['doc:b.txt', 'doc:c.txt']
+
+        # nodes stay out of the tree once they are inputs
+        ast.add_node("a.txt", foo='bar')
+        assert ast.tree == ['doc:b.txt', 'doc:c.txt']
+        assert ast.all_inputs() == set(['doc:a.txt'])
+
+        args = ast.args_for_node("a.txt")
+        assert args == {'foo' : 'bar'}
+        args['foo'] = 'baz'
+        assert ast.args_for_node("a.txt") == {'foo' : 'bar'}
+
+def test_ast_args_for_node_shares_values():
+    with wrap() as wrapper:
+        wrapper.filemap = wrapper.map_files()
+
+        ast = AbstractSyntaxTree(wrapper)
+        ast.add_node("a.txt|jinja", jinja={'vars' : {'x' : 1}})
+
+        args = ast.args_for_node("a.txt|jinja")
+        args['foo'] = 'bar'
+        assert not 'foo' in ast.args_for_node("a.txt|jinja")
+        assert not 'inputs' in args
+
+        # nested values are not copied
+        assert args['jinja'] is ast.args_for_node("a.txt|jinja")['jinja']
+
+def test_ast_settings_for_directory():
+    with wrap() as wrapper:
+        ast = AbstractSyntaxTree(wrapper)
+        ast.default_args_for_directory.append((".", {'foo' : 'bar', 'jinja' : {'x' : 1}}))
+        ast.default_args_for_directory.append(("s1", {'foo' : 'baz'}))
+
+        assert ast.calculate_default_args_for_directory("a.txt")['foo'] == 'bar'
+        assert ast.calculate_default_args_for_directory("s1/a.txt")['foo'] == 'baz'
+        assert ast.calculate_default_args_for_directory("s1/b.txt")['foo'] == 'baz'
+
+        ast.calculate_default_args_for_directory("a.txt")['foo'] = 'changed'
+        assert ast.calculate_default_args_for_directory("b.txt")['foo'] == 'bar'
+
+        # settings added later apply to directories already looked up
+        ast.default_args_for_directory.append(("s1", {'foo' : 'qux'}))
+        assert ast.calculate_default_args_for_directory("s1/a.txt")['foo'] == 'qux'
@@ -13,10 +13,11 @@ def test_batch():
         os.makedirs(batch.batch_dir())
 
         batch.save_to_file()
-        assert batch.filename() in os.listdir(".dexy/batches")
+        assert os.path.exists(batch.store_filepath())
 
         wrapper = Wrapper()
-        batch = dexy.batch.Batch.load_most_recent(wrapper)
+        loaded = dexy.batch.Batch.load_most_recent(wrapper)
+        assert loaded.uuid == batch.uuid
 
 def test_batch_with_docs():
     with tempdir():
@@ -38,3 +39,69 @@ def test_batch_with_docs():
         for doc_key in batch.docs:
             assert batch.input_data(doc_key)
             assert batch.output_data(doc_key)
+
+def test_batch_loads_docs_lazily():
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        for name in ("hello.txt", "world.txt"):
+            with open(name, "w") as f:
+                f.write(name)
+
+        with open("dexy.yaml", "w") as f:
+            f.write("- hello.txt\n- world.txt")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        first_uuid = wrapper.batch.uuid
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+
+        batch = dexy.batch.Batch.load_most_recent(wrapper)
+        assert batch.uuid == wrapper.batch.uuid
+        assert batch.uuid != first_uuid
+        assert sorted(batch.docs) == ['doc:hello.txt', 'doc:world.txt']
+        assert batch.docs.loaded == {}
+
+        matches = batch.output_data_matching(key="hello.txt")
+        assert [data.key for data in matches] == ["hello.txt"]
+        assert list(batch.docs.loaded) == ['doc:hello.txt']
+        assert batch.output_data('doc:hello.txt') is matches[0]
+
+        storage_key = matches[0].storage_key
+        assert batch.data_for_storage_key(storage_key) is matches[0]
+
+        # previous batches are kept
+        store = dexy.batch.BatchStore(batch.store_filepath())
+        assert store.doc_count(first_uuid) == 2
+
+def test_batch_retention():
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        with open("dexy.yaml", "w") as f:
+            f.write("hello.txt")
+
+        # left over from an older dexy version
+        os.makedirs(".dexy/batches")
+        with open(".dexy/batches/abc.pickle", "w") as f:
+            f.write("old batch")
+
+        uuids = []
+        for i in range(4):
+            wrapper = Wrapper(batch_retention=2)
+            wrapper.run_from_new()
+            uuids.append(wrapper.batch.uuid)
+
+        assert not os.path.exists(".dexy/batches/abc.pickle")
+        store = dexy.batch.BatchStore(wrapper.batch.store_filepath())
+        assert store.batch_info(uuids[0]) is None
+        assert store.batch_info(uuids[2]) is not None
+        assert store.most_recent_uuid() == uuids[3]
+        store.close()
@@ -195,3 +195,19 @@ def test_env_text(stdout):
     dexy.commands.run()
     text = stdout.getvalue()
     assert "uuid" in text
+
+def test_watch_has_dexy_options():
+    import dexy.commands.it
+    import dexy.commands.watch
+    import inspect
+
+    dexy_options = inspect.signature(dexy.commands.it.dexy_command).parameters
+    watch_options = inspect.signature(dexy.commands.watch.watch_command).parameters
+
+    expected = set(dexy_options) - set(dexy.commands.watch.DEXY_ONLY_OPTIONS)
+    expected.update(dexy.commands.watch.WATCH_ONLY_OPTIONS)
+    assert set(watch_options) == expected
+
+    for name in expected:
+        if name in dexy_options:
+            assert watch_options[name].default == dexy_options[name].default, name
@@ -169,6 +169,29 @@ def test_key_value_data():
         assert data.value('foo') == 'bar'
         assert data.storage['foo'] == 'bar'
 
+def test_generic_data_streaming():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        settings = {
+                'canonical-name' : 'doc.txt'
+                }
+        data = dexy.data.Generic("doc.txt", ".txt", "abc000", settings, wrapper)
+        data.setup_storage()
+        data.set_data("line\n" * 10000 + "<body>")
+
+        with data.open() as f:
+            assert b"".join(data.iter_chunks(1000)) == f.read()
+        assert max(len(chunk) for chunk in data.iter_chunks(1000)) == 1000
+
+        with data.mmap() as contents:
+            assert contents.find(b"<body>") == 50000
+
+        data.output_to_file("copy.txt")
+        with open("copy.txt", "r") as f:
+            assert f.read() == str(data)
+
 def test_key_value_data_sqlite():
     with wrap() as wrapper:
         wrapper.to_walked()
@@ -188,6 +211,74 @@ def test_key_value_data_sqlite():
         assert data.value('foo') == 'bar'
         assert ["%s: %s" % (k, v) for k, v in data.items()][0] == "foo: bar"
 
+def test_key_value_data_sqlite_bulk():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        settings = {
+                'canonical-name' : 'doc.sqlite3'
+                }
+
+        data = dexy.data.KeyValue("doc.sqlite3", ".sqlite3", "abc000", settings, wrapper)
+        data.setup_storage()
+        data.storage.connect()
+
+        n = data.storage.append_buffer_size * 2 + 5
+        for i in range(n):
+            data.append("key%s" % i, "value%s" % i)
+
+        # buffered rows are inserted before reading
+        assert data.value("key%s" % (n-1)) == "value%s" % (n-1)
+
+        data.save()
+        assert not os.path.exists(data.storage.working_file())
+        assert os.path.exists(data.storage.this_data_file())
+
+        assert len(data.keys()) == n
+        assert data.value("key10") == "value10"
+        assert next(iter(data.items())) == ("key0", "value0")
+
+        indexes = data.storage.execute("PRAGMA index_list(kvstore)").fetchall()
+        assert [row[1] for row in indexes] == ["kvstore_key"]
+        assert data.storage.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+def test_key_value_data_sqlite_in_object_store():
+    with wrap() as wrapper:
+        wrapper.to_walked()
+        wrapper.to_checked()
+
+        settings = {
+                'canonical-name' : 'doc.sqlite3'
+                }
+
+        data = dexy.data.KeyValue("doc.sqlite3", ".sqlite3", "abc000", settings, wrapper)
+        data.setup_storage()
+        data.storage.connect()
+        data.append('foo', 'bar')
+        data.save()
+
+        data.storage._storage.close()
+        object_path = wrapper.object_store.add(data.storage.this_data_file(),
+                data.storage.data_file_name())
+        with open(object_path, 'rb') as f:
+            object_contents = f.read()
+
+        data = dexy.data.KeyValue("doc.sqlite3", ".sqlite3", "abc000", settings, wrapper)
+        data.setup_storage()
+        data.storage.connect()
+        assert data.storage.connected_to == 'object-store'
+        assert data.value('foo') == 'bar'
+
+        # objects may be shared with other docs, so they're never written to
+        data.append('baz', 'qux')
+        data.save()
+        assert data.storage.connected_to == 'existing'
+        assert os.path.exists(data.storage.this_data_file())
+        assert data.value('baz') == 'qux'
+        with open(object_path, 'rb') as f:
+            assert f.read() == object_contents
+
 def test_generic_data():
     with wrap() as wrapper:
         wrapper.to_walked()
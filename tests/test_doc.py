@@ -1,6 +1,8 @@
 from dexy.data import Data
+from dexy.data import Generic
 from dexy.doc import Doc
 from dexy.exceptions import UserFeedback
+from mock import patch
 from nose.tools import raises
 from tests.utils import wrap
 
@@ -49,3 +51,59 @@ def test_create_virtual_initial_artifact():
         doc = Doc("abc.txt", wrapper, [], contents="these are the contents")
         wrapper.run_docs(doc)
         assert doc.output_data().__class__.__name__ == "Generic"
+
+def test_intermediate_data_saved_in_background():
+    with wrap() as wrapper:
+        doc = Doc("foo.txt|ww|head|dexy", wrapper, [], contents="foo")
+        ww, head, dexy = doc.filters
+
+        # head takes its input from memory, dexy copies its input's file.
+        assert ww.output_data.save_in_background
+        assert not head.output_data.save_in_background
+        assert not dexy.output_data.save_in_background
+
+        wrapper.run_docs(doc)
+        assert wrapper.state == 'ran'
+        for data in doc.datas():
+            assert data.is_cached()
+        assert str(doc.output_data()) == "foo\n"
+
+def test_intermediate_data_saved_in_foreground():
+    with wrap() as wrapper:
+        wrapper.memory_pipeline = False
+        doc = Doc("foo.txt|ww|head", wrapper, [], contents="foo")
+        assert not any(f.output_data.save_in_background for f in doc.filters)
+
+def test_failed_background_save_keeps_filter_error():
+    with wrap() as wrapper:
+        doc = Doc("foo.txt|ww|head", wrapper, [], contents="foo")
+        ww = doc.filters[0]
+        write_data = Generic.write_data
+
+        def failing_write_data(data, content):
+            if data is ww.output_data:
+                raise IOError("disk full")
+            write_data(data, content)
+
+        def process_text(filter_instance, input_text):
+            raise UserFeedback("head failed")
+
+        with patch('dexy.data.Generic.write_data', failing_write_data):
+            with patch('dexy.filters.standard.HeadFilter.process_text', process_text):
+                try:
+                    wrapper.run_docs(doc)
+                    assert False, "should raise UserFeedback"
+                except UserFeedback as e:
+                    assert "head failed" in str(e)
+
+def test_generic_str_decodes_once():
+    with wrap() as wrapper:
+        doc = Doc("foo.txt", wrapper, [], contents="foo")
+        wrapper.run_docs(doc)
+        data = doc.output_data()
+        data._data = "caf\u00e9".encode("utf-8")
+
+        with patch.object(wrapper, 'decode_encoded', wraps=wrapper.decode_encoded) as decode:
+            assert str(data) == "caf\u00e9"
+            assert str(data) == "caf\u00e9"
+            assert decode.call_count == 1
@@ -3,6 +3,7 @@ from dexy.node import Node
 from dexy.node import PatternNode
 from dexy.wrapper import Wrapper
 from tests.utils import wrap
+import dexy.batch
 import dexy.doc
 import dexy.node
 import os
@@ -93,6 +94,39 @@ def test_script_node_caching__slow():
         for node in list(wrapper1.nodes.values()):
             assert node.state == 'ran'
 
+def test_node_caching_uses_content_hash():
+    with wrap():
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        with open("dexy.yaml", "w") as f:
+            f.write("hello.txt|dexy")
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        assert wrapper.nodes['doc:hello.txt|dexy'].state == 'ran'
+
+        # touching the file without changing its contents is not a change
+        future = time.time() + 100
+        os.utime("hello.txt", (future, future))
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        assert wrapper.nodes['doc:hello.txt|dexy'].state == 'consolidated'
+
+        # changing the contents is, even if the size stays the same and the
+        # mtime goes backwards
+        with open("hello.txt", "w") as f:
+            f.write("jello")
+        past = future - 1000
+        os.utime("hello.txt", (past, past))
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        doc = wrapper.nodes['doc:hello.txt|dexy']
+        assert doc.state == 'ran'
+        assert str(doc.output_data()) == "jello"
+
 # TODO mock out os.stat to get different mtimes without having to sleep?
 
 def test_node_caching__slow():
@@ -176,6 +210,24 @@ def test_node_init_with_inputs():
         for i, n in enumerate(node.walk_inputs()):
             assert expected[i] == n.key
 
+def test_walk_inputs_once_each():
+    with wrap() as wrapper:
+        a = Node("a.txt", wrapper)
+        b = Node("b.txt", wrapper, [a])
+        c = Node("c.txt", wrapper, [a, b])
+        d = Node("d.txt", wrapper, [c, b])
+
+        # dependencies come before the nodes which depend on them
+        assert [n.key for n in d.walk_inputs()] == ["a.txt", "b.txt", "c.txt"]
+        assert d.input_mask() == a.input_bit() | b.input_bit() | c.input_bit()
+
+        # cached closures are recalculated when additional docs are added
+        extra = Doc("extra.txt", wrapper, [], contents="extra")
+        wrapper.nodes = {}
+        wrapper.batch = dexy.batch.Batch(wrapper)
+        a.add_additional_doc(extra)
+        assert [n.key for n in d.walk_inputs()] == ["extra.txt", "a.txt", "b.txt", "c.txt"]
+
 def test_doc_node_populate():
     with wrap() as wrapper:
         node = Node.create_instance(
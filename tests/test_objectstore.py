@@ -0,0 +1,129 @@
+from tests.utils import tempdir
+from dexy.objectstore import ObjectStore
+from dexy.wrapper import Wrapper
+from mock import patch
+import os
+
+def test_object_store():
+    with tempdir():
+        os.mkdir("artifacts")
+        store = ObjectStore("artifacts")
+
+        for name in ("a.txt", "b.txt"):
+            with open(name, "w") as f:
+                f.write("same contents")
+
+        a_path = store.add("a.txt", "abc-000.txt")
+        b_path = store.add("b.txt", "def-000.txt")
+
+        assert a_path == b_path
+        assert not os.path.exists("a.txt")
+        assert not os.path.exists("b.txt")
+        assert store.path("abc-000.txt") == a_path
+        assert store.path("xyz-000.txt", "default") == "default"
+
+        store.forget("def-000.txt")
+        assert not "def-000.txt" in store
+        store.save()
+
+        store = ObjectStore("artifacts")
+        assert "abc-000.txt" in store
+        assert not "def-000.txt" in store
+
+        # entries which aren't kept in a run are dropped from the manifest
+        store.load()
+        store.save()
+        store = ObjectStore("artifacts")
+        assert not "abc-000.txt" in store
+
+def test_identical_outputs_stored_once():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            - a.txt|dexy
+            - b.txt|dexy
+            """)
+
+        for name in ("a", "b"):
+            with open("%s.txt" % name, "w") as f:
+                f.write("same contents")
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+
+        a = wrapper.nodes['doc:a.txt|dexy'].output_data()
+        b = wrapper.nodes['doc:b.txt|dexy'].output_data()
+        assert a.storage.data_file() == b.storage.data_file()
+        assert str(a) == str(b) == "same contents"
+
+        this_files = [f for d in os.listdir(".dexy/this")
+                for f in os.listdir(os.path.join(".dexy/this", d))]
+        assert this_files == []
+
+        objects = [f for d in os.listdir(".dexy/objects")
+                for f in os.listdir(os.path.join(".dexy/objects", d))]
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        for node in wrapper.nodes.values():
+            assert node.state == 'consolidated'
+        b = wrapper.nodes['doc:b.txt|dexy'].output_data()
+        assert str(b) == "same contents"
+
+        assert objects == [f for d in os.listdir(".dexy/objects")
+                for f in os.listdir(os.path.join(".dexy/objects", d))]
+
+def test_collect_garbage():
+    with tempdir():
+        os.mkdir("artifacts")
+        store = ObjectStore("artifacts", retain_unused=True)
+
+        for i, name in enumerate(("old", "new", "unused")):
+            with open(name, "w") as f:
+                f.write(name * 100)
+            store.add(name, "%s-000.txt" % name)
+            store.used[store.entries["%s-000.txt" % name]] = i
+        store.forget("unused-000.txt")
+        store.save()
+
+        store = ObjectStore("artifacts", retain_unused=True)
+        store.load()
+        n, size = store.collect_garbage("trash")
+        assert (n, size) == (1, 600)
+        assert len(os.listdir("trash")) == 1
+        assert "old-000.txt" in store and "new-000.txt" in store
+
+        # least recently used objects are removed first
+        n, size = store.collect_garbage("trash2", 400)
+        assert (n, size) == (1, 300)
+        assert not "old-000.txt" in store
+        assert "new-000.txt" in store
+
+        # objects used in this run are never removed
+        store.keep("new-000.txt")
+        assert store.collect_garbage("trash3", 1) == (0, 0)
+
+def test_collect_garbage_uses_recorded_sizes():
+    with tempdir():
+        os.mkdir("artifacts")
+        store = ObjectStore("artifacts")
+        with open("a", "w") as f:
+            f.write("a" * 100)
+        store.add("a", "a-000.txt")
+        store.save()
+
+        store = ObjectStore("artifacts")
+        store.keep("a-000.txt")
+        with patch.object(store, 'objects', side_effect=AssertionError):
+            # nothing to remove, so objects on disk aren't listed
+            assert store.collect_garbage("trash", 1000) == (0, 0)
+
+        n, size = store.collect_garbage("trash", 1000, scan=True)
+        assert (n, size) == (0, 0)
+        assert store.sizes == {store.entries["a-000.txt"] : 100}
+
+        store.in_use = set()
+        with patch.object(store, 'objects', side_effect=AssertionError):
+            assert store.collect_garbage("trash", 50) == (1, 100)
+        assert store.sizes == {}
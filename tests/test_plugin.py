@@ -1,4 +1,15 @@
+from cashew.exceptions import InternalCashewException
+from cashew.exceptions import UserFeedback
+from nose.tools import raises
+from tests.utils import tempdir
+import cashew
+import dexy.manifest
 import dexy.plugin
+import json
+import os
+import pickle
+import subprocess
+import sys
 
 class WidgetBase(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
     """
@@ -69,3 +80,196 @@ def test_other_class_settings():
     fruit = Fruit()
     fruit.initialize_settings()
     assert fruit.setting('color') == 'red'
+
+def cashew_settings(klass):
+    instance = klass.__new__(klass)
+    cashew.Plugin.initialize_settings(instance)
+    return instance._instance_settings
+
+def test_settings_merged_once_per_class():
+    first = Widget.create_instance('sub')
+    second = Widget.create_instance('sub')
+    merged = dexy.plugin.PluginMeta.merged_settings(SubWidget)
+
+    assert merged == cashew_settings(SubWidget)
+    assert dexy.plugin.PluginMeta.merged_settings(SubWidget) is merged
+    assert first._instance_settings is not merged
+
+    first.update_settings({'foo' : 'changed'})
+    assert first.setting('foo') == 'changed'
+    assert second.setting('foo') == 'baz'
+    assert merged['foo'][1] == 'baz'
+
+def test_merged_settings_match_cashew_for_dexy_plugins():
+    import dexy.filter
+    import dexy.load_plugins
+    for alias in ('pyg', 'jinja', 'py', 'pycon'):
+        klass = dexy.filter.Filter.create_instance(alias).__class__
+        assert dexy.plugin.PluginMeta.merged_settings(klass) == cashew_settings(klass)
+
+def test_other_class_settings_registered_later():
+    Fruit().initialize_settings()
+
+    class Grain(dexy.plugin.Plugin, metaclass=dexy.plugin.PluginMeta):
+        """grain class"""
+        aliases = []
+        _settings = {}
+        _other_class_settings = {
+                'fruit' : {
+                        "ripe" : ("Whether the fruit is ripe", True)
+                    }
+                }
+
+    fruit = Fruit()
+    fruit.initialize_settings(color='green')
+    assert fruit.setting('ripe') == True
+    assert fruit.setting('color') == 'green'
+
+def test_update_settings_same_as_cashew():
+    new_settings = {
+            'foo' : 'new foo',
+            'new_setting' : 'new value',
+            'pair' : ['a', 'b'],
+            'abc' : ("New help", 456)
+            }
+
+    widget = Widget.create_instance('widget')
+    widget.update_settings(new_settings)
+
+    expected = Widget.create_instance('widget')
+    cashew.Plugin.update_settings(expected, new_settings)
+
+    assert widget._instance_settings == expected._instance_settings
+    assert widget._instance_settings['new-setting'] == ('', 'new value')
+    assert widget._instance_settings['foo'] == ("Default value for foo", 'new foo')
+
+@raises(InternalCashewException)
+def test_update_settings_requires_helpstring():
+    widget = Widget.create_instance('widget')
+    widget._update_settings({'undefined' : 'value'})
+
+def test_create_instance_same_as_cashew():
+    for alias in ('widget', 'sub'):
+        widget = Widget.create_instance(alias)
+        expected = cashew.PluginMeta.create_instance(Widget, alias)
+        assert widget.__class__ is expected.__class__
+        assert widget.alias == expected.alias
+        assert widget._instance_settings == expected._instance_settings
+
+def test_create_instance_settings_not_shared():
+    first = Widget.create_instance('widget')
+    second = Widget.create_instance('widget')
+    assert first._instance_settings is not second._instance_settings
+
+    first.update_settings({'foo' : 'changed'})
+    assert Widget.create_instance('widget').setting('foo') == 'bar'
+    assert second.setting('foo') == 'bar'
+
+def test_create_instance_uses_current_alias_settings():
+    Widget.create_instance('widget')
+    klass, settings = Widget.plugins['widget']
+    try:
+        Widget.plugins['widget'] = (klass, dict(settings, foo='registered'))
+        assert Widget.create_instance('widget').setting('foo') == 'registered'
+    finally:
+        Widget.plugins['widget'] = (klass, settings)
+    assert Widget.create_instance('widget').setting('foo') == 'bar'
+
+def test_setting_reads_environment_variables():
+    widget = Widget.create_instance('widget')
+    widget.update_settings({'foo' : '$DEXY_TEST_WIDGET_FOO'})
+    os.environ['DEXY_TEST_WIDGET_FOO'] = 'from env'
+    try:
+        assert widget.setting('foo') == 'from env'
+    finally:
+        del os.environ['DEXY_TEST_WIDGET_FOO']
+
+@raises(UserFeedback)
+def test_setting_unknown_name():
+    Widget.create_instance('widget').setting('not-a-setting')
+
+IMPORT_TIME_SCRIPT = """
+import json, sys, time
+start = time.time()
+import dexy.load_plugins
+elapsed = time.time() - start
+modules = sorted(m for m in sys.modules if m.startswith('dexy.filters.'))
+import dexy.filter
+filter_class_name = dexy.filter.Filter.create_instance('pyg').__class__.__name__
+print(json.dumps({
+    'elapsed' : elapsed,
+    'modules' : modules,
+    'filter-class-name' : filter_class_name,
+    'pyg-imported' : 'dexy.filters.pyg' in sys.modules,
+    'pexp-imported' : 'dexy.filters.pexp' in sys.modules
+    }))
+"""
+
+def import_load_plugins():
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_TIME_SCRIPT], cwd=project_dir)
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+def test_plugin_modules_imported_lazily():
+    # first import may need to rebuild the plugin manifest
+    import_load_plugins()
+    info = import_load_plugins()
+
+    assert info['modules'] == []
+    assert info['filter-class-name'] == 'PygmentsFilter'
+    assert info['pyg-imported']
+    assert not info['pexp-imported']
+
+MODULE_COUNT_SCRIPT = """
+import importlib, json, sys
+before = len(sys.modules)
+import dexy.load_plugins
+lazy = len(sys.modules) - before
+for modname in dexy.filters.manifest.modules:
+    importlib.import_module(modname)
+print(json.dumps({'lazy' : lazy, 'eager' : len(sys.modules) - before}))
+"""
+
+def test_load_plugins_imports_fraction_of_modules():
+    # Counting modules rather than timing imports keeps this from being
+    # flaky, see benchmarks/import_time.py for timings.
+    import_load_plugins()
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", MODULE_COUNT_SCRIPT], cwd=project_dir)
+    counts = json.loads(output.decode('utf-8').splitlines()[-1])
+    assert counts['lazy'] < counts['eager'] / 2
+
+def test_manifest_saved_outside_package():
+    import dexy.load_plugins
+    manifest = dexy.filters.manifest
+    package_dir = os.path.abspath(os.path.dirname(dexy.filters.__file__))
+    assert not os.path.abspath(manifest.filepath).startswith(package_dir)
+
+def test_manifest_rebuilt_when_stale():
+    import dexy.load_plugins
+    real_manifest = dexy.filters.manifest
+
+    with tempdir():
+        manifest = dexy.manifest.PluginManifest(
+                real_manifest.package_dir,
+                os.path.abspath("manifest.pickle"),
+                real_manifest.modules,
+                real_manifest.optional_modules,
+                real_manifest.yaml_files,
+                real_manifest.registries)
+        manifest.load()
+
+        with open(manifest.filepath, 'rb') as f:
+            info = pickle.load(f)
+        assert info['signature'] == manifest.signature()
+        assert 'pyg' in info['entries']['dexy.filter:Filter']
+        assert info['entries']['dexy.filter:Filter']['pyg'][0] == 'dexy.filters.pyg:PygmentsFilter'
+
+        info['signature'] = None
+        with open(manifest.filepath, 'wb') as f:
+            pickle.dump(info, f)
+
+        manifest.load()
+
+        with open(manifest.filepath, 'rb') as f:
+            assert pickle.load(f)['signature'] == manifest.signature()
@@ -67,3 +67,36 @@ def test_load_json():
             assert False, "should raise error"
         except UserFeedback as e:
             assert "No value for zxx" in str(e)
+
+def test_section_index_kept_up_to_date():
+    with wrap() as wrapper:
+        settings = {
+                'canonical-name' : "doc.txt"
+                }
+        data = Sectioned("doc.txt", ".txt", "def123", settings, wrapper)
+        data.setup()
+
+        for i in range(1000):
+            data["section%s" % i] = "contents %s" % i
+        assert data.keyindex("section999") == 999
+        assert str(data.value("section500")) == "contents 500"
+
+        data["section10"] = "new contents"
+        assert str(data["section10"]) == "new contents"
+        assert len(data) == 1000
+
+        del data["section0"]
+        assert data.keyindex("section1") == 0
+        assert data.keyindex("section0") == -1
+
+        data["section1"]["name"] = "first"
+        assert data.keyindex("first") == 0
+        assert data.keyindex("section1") == -1
+
+        data._data = [{}, {"name" : "only", "contents" : "replaced"}]
+        assert data.keyindex("only") == 0
+        assert data.keyindex("section2") == -1
+
+        values = data.values()
+        assert not isinstance(values, list)
+        assert [(k, str(v)) for k, v in data.items()] == [("only", "replaced")]
@@ -0,0 +1,135 @@
+from tests.utils import tempdir
+from dexy.wrapper import Wrapper
+import http.server
+import json
+import os
+import threading
+
+CONFIG = """
+- hello.sh|sh
+- combined.txt|jinja:
+    - hello.sh|sh
+    - contents: "{{ d['hello.sh|sh'] }} world"
+"""
+
+def checkout(name, shared_cache, upload=True):
+    """
+    Creates a project in dir name if it doesn't exist and runs it, returning
+    the wrapper and the output of each doc.
+    """
+    if not os.path.exists(name):
+        os.mkdir(name)
+        with open(os.path.join(name, "dexy.yaml"), "w") as f:
+            f.write(CONFIG)
+        with open(os.path.join(name, "hello.sh"), "w") as f:
+            f.write("echo hello")
+
+    cwd = os.getcwd()
+    os.chdir(name)
+    try:
+        if not os.path.exists(".dexy"):
+            Wrapper().create_dexy_dirs()
+        wrapper = Wrapper(shared_cache=shared_cache, shared_cache_upload=upload)
+        wrapper.run_from_new()
+        outputs = dict((doc.key, str(doc.output_data()))
+                for doc in wrapper.documents())
+    finally:
+        os.chdir(cwd)
+    return wrapper, outputs
+
+def check_shared_cache(location):
+    wrapper, outputs = checkout("first", location)
+    assert wrapper.state == 'ran'
+    assert wrapper.shared_store.hits == 0
+    assert wrapper.shared_store.uploads == 2
+
+    wrapper, outputs = checkout("second", location, False)
+    assert wrapper.state == 'ran'
+    assert wrapper.shared_store.hits == 2
+    assert wrapper.shared_store.uploads == 0
+    assert wrapper.nodes['doc:hello.sh|sh'].state == 'consolidated'
+    assert outputs['hello.sh|sh'] == "hello\n"
+    assert outputs['combined.txt|jinja'] == "hello\n world"
+
+    # A changed file isn't found in the shared cache.
+    with open(os.path.join("second", "hello.sh"), "w") as f:
+        f.write("echo goodbye")
+    wrapper, outputs = checkout("second", location, False)
+    assert wrapper.shared_store.hits == 0
+    assert wrapper.nodes['doc:hello.sh|sh'].state == 'ran'
+    assert outputs['hello.sh|sh'] == "goodbye\n"
+
+def test_shared_cache_directory():
+    with tempdir():
+        check_shared_cache(os.path.abspath("shared"))
+
+def tamper_manifests(location, bad_name):
+    """
+    Adds a file the remote claims belongs to every entry in location.
+    """
+    for dirpath, dirnames, filenames in os.walk(location):
+        if "manifest.json" in filenames:
+            manifest = os.path.join(dirpath, "manifest.json")
+            with open(manifest) as f:
+                names = json.load(f)
+            name = bad_name(names)
+            with open(os.path.normpath(os.path.join(dirpath, name)), "w") as f:
+                f.write("evil")
+            with open(manifest, "w") as f:
+                json.dump(names + [name], f)
+
+def check_unexpected_manifest_name(bad_name):
+    with tempdir():
+        location = os.path.abspath("shared")
+        checkout("first", location)
+        tamper_manifests(location, bad_name)
+
+        # combined.txt isn't fetched since its input wasn't.
+        wrapper, outputs = checkout("second", location, False)
+        assert wrapper.shared_store.hits == 0
+        assert wrapper.shared_store.errors == 1
+        assert outputs['hello.sh|sh'] == "hello\n"
+        assert outputs['combined.txt|jinja'] == "hello\n world"
+        assert not os.path.exists("escaped")
+
+def test_shared_cache_rejects_path_in_manifest():
+    # Resolves to the project's parent dir in this/ and to the shared dir.
+    check_unexpected_manifest_name(lambda names: "../../escaped")
+
+def test_shared_cache_rejects_unknown_file_in_manifest():
+    check_unexpected_manifest_name(lambda names: names[0][0:2] + "other.txt")
+
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    files = {}
+
+    def do_GET(self):
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_response(404)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    def do_PUT(self):
+        length = int(self.headers['Content-Length'])
+        self.files[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def test_shared_cache_http():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CacheRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        with tempdir():
+            check_shared_cache("http://127.0.0.1:%s/cache" % server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -5,6 +5,14 @@ from nose.tools import raises
 from dexy.utils import s
 from dexy.utils import split_path
 from dexy.utils import iter_paths
+from dexy.utils import copy_or_link
+from dexy.utils import tempdir
+from dexy.utils import gc_paused
+from mock import MagicMock
+from mock import patch
+import gc
+import os
+import stat
 
 def test_iter_path():
     full_path = "/foo/bar/baz"
@@ -47,3 +55,52 @@ class InactiveDexyFilter(Filter):
 def test_inactive_filters_skip():
     with runfilter("inactive", "hello"):
         pass
+
+def test_copy_or_link():
+    with tempdir():
+        with open("cached.txt", "w") as f:
+            f.write("cached")
+
+        data = MagicMock()
+        data.storage.data_file.return_value = "cached.txt"
+        def output_to_file(filepath):
+            with open(filepath, "w") as f:
+                f.write("copied")
+        data.output_to_file.side_effect = output_to_file
+
+        copy_or_link(data, "copy.txt")
+        with open("copy.txt") as f:
+            assert f.read() == "copied"
+
+        with patch('dexy.utils.reflink', return_value=False), patch('dexy.utils.is_root', return_value=False):
+            # writable files are never hard linked
+            copy_or_link(data, "link.txt", use_links=True)
+            assert os.stat("link.txt").st_nlink == 1
+
+            os.chmod("cached.txt", stat.S_IRUSR)
+            copy_or_link(data, "readonly-link.txt", use_links=True)
+            with open("readonly-link.txt") as f:
+                assert f.read() == "cached"
+            assert os.stat("cached.txt").st_nlink == 2
+
+        # root can write to read only files, so they are copied
+        with patch('dexy.utils.reflink', return_value=False), patch('dexy.utils.is_root', return_value=True):
+            copy_or_link(data, "root-copy.txt", use_links=True)
+            with open("root-copy.txt") as f:
+                assert f.read() == "copied"
+            assert os.stat("cached.txt").st_nlink == 2
+
+def test_gc_paused():
+    assert gc.isenabled()
+    with gc_paused():
+        assert not gc.isenabled()
+    assert gc.isenabled()
+
+def test_gc_paused_leaves_gc_disabled():
+    gc.disable()
+    try:
+        with gc_paused():
+            pass
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
@@ -7,8 +7,14 @@ from tests.utils import capture_stdout
 from tests.utils import tempdir
 from tests.utils import wrap
 from dexy.wrapper import Wrapper
+from mock import patch
 import dexy.batch
+import dexy.filemap
+import dexy.scheduler
+import fnmatch
+import json
 import os
+import time
 
 def test_deprecated_dot_dexy_file():
     with tempdir():
@@ -88,6 +94,19 @@ def test_remove_trash_with_trash():
         wrapper.empty_trash()
         assert not os.path.exists(".trash")
 
+def test_remove_trash_stops_at_deadline():
+    with tempdir():
+        wrapper = Wrapper()
+        os.makedirs(".trash/evicted")
+        for i in range(3):
+            with open(".trash/evicted/%s" % i, "w") as f:
+                f.write("")
+
+        with patch.object(wrapper, 'empty_trash_in_background') as background:
+            wrapper.empty_trash(max_seconds=-1)
+            assert background.called
+        assert len(os.listdir(".trash/evicted")) == 3
+
 def test_state_new_after_init():
     wrapper = Wrapper()
     wrapper.validate_state('new')
@@ -399,3 +418,238 @@ def test_run_target_ba():
         assert wrapper.nodes['bundle:baz'].state == 'ran'
         assert wrapper.nodes['bundle:foob'].state == 'uncached'
         assert wrapper.nodes['bundle:foobar'].state == 'uncached'
+
+def test_run_with_parallel_jobs():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            report.txt|jinja:
+                - a.txt|dexy
+                - b.txt|dexy:
+                    - c.txt|dexy
+            """)
+
+        for name in ("a", "b", "c"):
+            with open("%s.txt" % name, "w") as f:
+                f.write("contents of %s" % name)
+
+        with open("report.txt", "w") as f:
+            f.write("""{{ d['a.txt|dexy'] }} {{ d['b.txt|dexy'] }}""")
+
+        wrapper = Wrapper(jobs=3)
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+        wrapper.validate_state('ran')
+
+        report = wrapper.nodes['doc:report.txt|jinja']
+        assert str(report.output_data()) == "contents of a contents of b"
+        assert wrapper.batch.docs['doc:report.txt|jinja']['finish_time'] > 0
+
+        wrapper = Wrapper(jobs=3)
+        wrapper.run_from_new()
+        wrapper.validate_state('ran')
+        for node in wrapper.roots:
+            assert node.state == 'consolidated'
+
+def test_worker_processes_run_several_docs():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            - slow.sh|sh
+            - a.txt|dexy
+            - b.txt|dexy
+            - c.txt|dexy
+            - report.txt|jinja:
+                - slow.sh|sh
+            """)
+
+        with open("slow.sh", "w") as f:
+            f.write("sleep 0.3\necho slow")
+
+        for name in ("a", "b", "c"):
+            with open("%s.txt" % name, "w") as f:
+                f.write("contents of %s" % name)
+
+        with open("report.txt", "w") as f:
+            f.write("""{{ d['slow.sh|sh'] }}""")
+
+        wrapper = Wrapper(jobs=2, threads=1, trace="trace.json")
+        wrapper.create_dexy_dirs()
+        start_worker = dexy.scheduler.Scheduler.start_worker
+        with patch.object(dexy.scheduler.Scheduler, 'start_worker',
+                autospec=True, side_effect=start_worker) as started:
+            wrapper.run_from_new()
+        wrapper.validate_state('ran')
+        assert started.call_count == 2
+
+        # report.txt ran in a worker forked before slow.sh ran.
+        spans = dict((e['name'], e) for e in wrapper.tracer.events)
+        assert spans['jinja']['args']['worker'].startswith('process')
+        assert spans['sh']['args']['worker'] == 'thread 0'
+        report = wrapper.nodes['doc:report.txt|jinja']
+        assert str(report.output_data()) == "slow\n"
+
+def test_rerun_changed_documents():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            report.txt|jinja:
+                - a.txt
+                - b.txt
+            other:
+                - c.txt|jinja
+            """)
+
+        for name in ("a", "b", "c"):
+            with open("%s.txt" % name, "w") as f:
+                f.write("contents of %s" % name)
+
+        with open("report.txt", "w") as f:
+            f.write("""{{ d['a.txt'] }} {{ d['b.txt'] }}""")
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+
+        with open("a.txt", "w") as f:
+            f.write("new contents of a")
+
+        wrapper.filemap = wrapper.map_files()
+        changed_docs = wrapper.changed_documents()
+        assert [doc.key for doc in changed_docs] == ['a.txt']
+
+        wrapper.rerun(changed_docs)
+        wrapper.validate_state('ran')
+
+        report = wrapper.nodes['doc:report.txt|jinja']
+        assert str(report.output_data()) == "new contents of a contents of b"
+        assert 'uncached' in [s for s, t in report.state_history[2:]]
+        for key in ('doc:b.txt', 'doc:c.txt|jinja',):
+            assert wrapper.nodes[key].state == 'ran'
+            assert len(wrapper.nodes[key].state_history) == 2
+
+        wrapper = Wrapper()
+        wrapper.run_from_new()
+        report = wrapper.nodes['doc:report.txt|jinja']
+        assert report.state == 'consolidated'
+        assert str(report.output_data()) == "new contents of a contents of b"
+
+def test_map_files_reuses_directory_snapshot():
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        os.makedirs("s1/s2")
+        with open("s1/s2/a.txt", "w") as f:
+            f.write("a")
+
+        old = time.time() - 100
+        for d in ("s1/s2", "s1", "."):
+            os.utime(d, (old, old))
+
+        wrapper = Wrapper()
+        filemap = wrapper.map_files()
+        assert sorted(filemap) == ['s1/s2/a.txt']
+        assert filemap['s1/s2/a.txt']['stat'].st_size == 1
+        assert os.path.exists(wrapper.filemap_snapshot_filename())
+
+        # a new file in a subdirectory is found even though its parent
+        # directories are unchanged and are listed from the snapshot
+        with open("s1/s2/b.txt", "w") as f:
+            f.write("bb")
+
+        filemap = Wrapper().map_files()
+        assert sorted(filemap) == ['s1/s2/a.txt', 's1/s2/b.txt']
+        assert filemap['s1/s2/b.txt']['stat'].st_size == 2
+
+def test_filemap_glob_matches_fnmatch():
+    filepaths = ["a.txt", "b.py", "src/c.py", "src/d/e.py", "src/d/.py",
+            "docs/src/f.py", "g.tar.gz", "README", "src/README", "x.c", "x.h"]
+    filemap = dexy.filemap.FileMap((filepath, {}) for filepath in filepaths)
+
+    patterns = ["*.py", "src/*.py", "src/**/*.py", "*/d/*", "README", "*README",
+            "*.gz", "*.tar.gz", "*.[ch]", "x.?", "*", "src/d/.py", "missing/*.txt"]
+
+    for pattern in patterns:
+        expected = [f for f in filepaths if fnmatch.fnmatch(f, pattern)]
+        assert filemap.glob(pattern) == expected, pattern
+
+def test_json_lines_log():
+    with tempdir():
+        wrapper = Wrapper(log_format='json', log_level='DEBUG')
+        wrapper.create_dexy_dirs()
+        wrapper = Wrapper(log_format='json', log_level='DEBUG')
+
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        with open("dexy.yaml", "w") as f:
+            f.write("hello.txt|dexy")
+
+        wrapper.run_from_new()
+        wrapper.flush_logs()
+
+        with open(wrapper.log_path(), "r") as f:
+            records = [json.loads(line) for line in f]
+
+        assert records[0]['message'] == "starting logging for dexy"
+        assert any(r['level'] == 'DEBUG' and "checking if hello.txt|dexy is changed" in r['message']
+                for r in records)
+
+def test_trace():
+    with tempdir():
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+
+        with open("hello.txt", "w") as f:
+            f.write("hello")
+
+        with open("hello.sh", "w") as f:
+            f.write("echo hello")
+
+        with open("dexy.yaml", "w") as f:
+            f.write("- hello.txt|dexy\n- hello.sh|sh")
+
+        wrapper = Wrapper(trace="trace.json", jobs=2, threads=1)
+        wrapper.run_from_new()
+        wrapper.report()
+
+        with open("trace.json", "r") as f:
+            events = json.load(f)['traceEvents']
+
+        spans = dict(((e['name'], e['args'].get('doc')), e) for e in events if e['ph'] == 'X')
+        for name in ("map_files", "parse_configs", "walk", "check_cache", "consolidate_cache", "output"):
+            assert (name, None) in spans
+
+        assert spans[('dexy', 'hello.txt|dexy')]['args']['worker'] == 'process 0'
+        assert spans[('sh', 'hello.sh|sh')]['args']['worker'] == 'thread 0'
+        assert ('subprocess', 'hello.sh|sh') in spans
+        assert ('populate_workspace', 'hello.sh|sh') in spans
+
+def test_rerun_removes_stale_additional_docs():
+    with tempdir():
+        with open("dexy.yaml", "w") as f:
+            f.write("""
+            script.sh|sh:
+                - sh: { add-new-files: True }
+            """)
+
+        with open("script.sh", "w") as f:
+            f.write("echo one > one.txt")
+
+        wrapper = Wrapper()
+        wrapper.create_dexy_dirs()
+        wrapper.run_from_new()
+        assert 'doc:one.txt' in wrapper.nodes
+
+        with open("script.sh", "w") as f:
+            f.write("echo two > two.txt")
+
+        wrapper.filemap = wrapper.map_files()
+        wrapper.rerun(wrapper.changed_documents())
+        wrapper.validate_state('ran')
+
+        assert 'doc:two.txt' in wrapper.nodes
+        assert not 'doc:one.txt' in wrapper.nodes
+        assert not 'doc:one.txt' in wrapper.batch.docs
+        assert not 'one.txt' in wrapper.lookup_nodes